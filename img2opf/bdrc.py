@@ -0,0 +1,102 @@
+import hashlib
+import logging
+
+import rdflib
+import requests
+from rdflib import URIRef
+from rdflib.namespace import Namespace, NamespaceManager
+
+# URI config
+BDR = Namespace("http://purl.bdrc.io/resource/")
+NSM = NamespaceManager(rdflib.Graph())
+NSM.bind("bdr", BDR)
+
+# s3 bucket directory config
+ARCHIVE_BUCKET = "archive.tbrc.org"
+OCR_OUTPUT_BUCKET = "ocr.bdrc.io"
+SERVICE = "vision"
+BATCH_PREFIX = "batch"
+IMAGES = "images"
+OUTPUT = "output"
+PAGE_INDEX = "index"
+INFO_FN = "info.json"
+
+
+def get_value(json_node):
+    if json_node["type"] == "literal":
+        return json_node["value"]
+    else:
+        return NSM.qname(URIRef(json_node["value"]))
+
+
+def get_s3_image_list(volume_prefix_url):
+    """
+    returns the content of the dimension.json file for a volume ID, accessible at:
+    https://iiifpres.bdrc.io/il/v:bdr:V22084_I0888 for volume ID bdr:V22084_I0888
+    """
+    r = requests.get(f"https://iiifpres.bdrc.io/il/v:{volume_prefix_url}")
+    if r.status_code != 200:
+        logging.error(
+            f"Volume Images list Error: No images found for volume {volume_prefix_url}: status code: {r.status_code}"
+        )
+        return {}
+    return r.json()
+
+
+def get_volume_infos(work_prefix_url):
+    """
+    the input is something like bdr:W22084, the output is a list like:
+    [
+      {
+        "vol_num": 1,
+        "volume_prefix_url": "bdr:V22084_I0886",
+        "imagegroup": "I0886"
+      },
+      ...
+    ]
+    """
+    r = requests.get(
+        f"http://purl.bdrc.io/query/table/volumesForWork?R_RES={work_prefix_url}&format=json&pageSize=500"
+    )
+    if r.status_code != 200:
+        logging.error(
+            f"Volume Info Error: No info found for Work {work_prefix_url}: status code: {r.status_code}"
+        )
+        return
+    # the result of the query is already in ascending volume order
+    res = r.json()
+    for b in res["results"]["bindings"]:
+        volume_prefix_url = NSM.qname(URIRef(b["volid"]["value"]))
+        yield {
+            "vol_num": get_value(b["volnum"]),
+            "volume_prefix_url": volume_prefix_url,
+            "imagegroup": volume_prefix_url[4:],
+        }
+
+
+def get_s3_prefix_path(
+    work_local_id, imagegroup, service=None, batch_prefix=None, data_types=None
+):
+    """
+    the input is like W22084, I0886. The output is an s3 prefix ("folder"), the function
+    can be inspired from
+    https://github.com/buda-base/volume-manifest-tool/blob/f8b495d908b8de66ef78665f1375f9fed13f6b9c/manifestforwork.py#L94
+    which is documented
+    """
+    md5 = hashlib.md5(str.encode(work_local_id))
+    two = md5.hexdigest()[:2]
+
+    pre, rest = imagegroup[0], imagegroup[1:]
+    if pre == "I" and rest.isdigit() and len(rest) == 4:
+        suffix = rest
+    else:
+        suffix = imagegroup
+
+    base_dir = f"Works/{two}/{work_local_id}"
+    if service:
+        batch_dir = f"{base_dir}/{service}/{batch_prefix}001"
+        paths = {BATCH_PREFIX: batch_dir}
+        for dt in data_types:
+            paths[dt] = f"{batch_dir}/{dt}/{work_local_id}-{suffix}"
+        return paths
+    return f"{base_dir}/images/{work_local_id}-{suffix}"
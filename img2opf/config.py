@@ -1,3 +1,41 @@
 IMAGES_DIR="./images"
 OUTPUT_DIR="./output"
 
+# Pecha.ocr concurrency
+VOLUME_PARALLELISM = 2
+OCR_WORKERS = 16
+OCR_WINDOW = 32  # pages of a volume submitted to the OCR workers ahead
+
+# IIIF image source
+IIIF_BASE_URL = "https://iiif.bdrc.io"
+IIIF_SIZE = "!3000,3000"
+IIIF_FORMAT = "jpg"
+IIIF_POOL_SIZE = 16
+IIIF_TIMEOUT = 60
+
+# page preprocessing before OCR
+PREPROCESS_INK_THRESHOLD = 128
+PREPROCESS_MIN_INK = 0.005
+PREPROCESS_MAX_INK = 0.9
+PREPROCESS_PAD = 16
+PREPROCESS_MAX_LONG_EDGE = 3000
+
+# local page store
+PAGE_STORE_PATH = "./archive/pages.sqlite"
+
+# ocr layout index
+INDEX_CELL_SIZE = 128
+
+# ocr quality scan
+QUALITY_LOW_WORD_CONFIDENCE = 0.6  # words below it are counted as weak
+QUALITY_MIN_WORDS = 5  # pages with fewer words are not scored
+
+# slack notifications
+NOTIFIER_INTERVAL = 30  # seconds between two posts
+NOTIFIER_MAX_PENDING = 500  # oldest messages are dropped beyond
+NOTIFIER_TIMEOUT = 10
+
+# vision client pool
+VISION_QUOTA_PER_MINUTE = 1800  # requests per minute of a project
+VISION_COOLDOWN = 60  # seconds a client rests after its quota is exhausted
+VISION_BACKOFF = 2  # seconds a client rests after a first transient error
@@ -0,0 +1,97 @@
+import io
+import json
+import tarfile
+from pathlib import Path
+
+from PIL import Image
+
+from .layout import PageIndex
+
+
+def get_crops(response, level="line"):
+    """
+    return: (box, text) of the lines or words of an ocr response, in reading order
+    """
+    index = PageIndex.from_response(response)
+    if level == "word":
+        return list(zip(index.boxes, index.words_text(range(len(index.boxes)))))
+    crops = []
+    for line, box in enumerate(index.line_boxes()):
+        word_ids = index.line(line)
+        text = index.text[index.starts[word_ids[0]] : index.ends[word_ids[-1]]]
+        crops.append((box, text))
+    return crops
+
+
+def crop_page(image, response, level="line", scale=1.0, pad=4, min_size=8):
+    """
+    decode a page image and crop its lines or words with the boxes of its ocr response,
+    the boxes of the response are in the coordinates of this image.
+    scale: resize factor of the crops
+    return: list of (png bytes, text, box)
+    """
+    img = Image.open(io.BytesIO(image))
+    img = img.convert("L")
+    samples = []
+    for (x0, y0, x1, y1), text in get_crops(response, level):
+        if not text.strip() or x1 - x0 < min_size or y1 - y0 < min_size:
+            continue
+        box = (
+            max(int(x0) - pad, 0),
+            max(int(y0) - pad, 0),
+            min(int(x1) + pad, img.width),
+            min(int(y1) + pad, img.height),
+        )
+        crop = img.crop(box)
+        if scale != 1.0:
+            size = (max(round(crop.width * scale), 1), max(round(crop.height * scale), 1))
+            crop = crop.resize(size, Image.LANCZOS)
+        out = io.BytesIO()
+        crop.save(out, format="PNG")
+        samples.append((out.getvalue(), text, box))
+    return samples
+
+
+class ShardWriter:
+    """
+    write samples into tar shards of `shard_size` samples, {prefix}-000000.tar, ...
+    A sample is {key}.png and {key}.txt in a shard, and a line of index.jsonl with its
+    shard, text and metadata.
+    """
+
+    def __init__(self, output_dir, prefix="shard", shard_size=10000):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(exist_ok=True, parents=True)
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.n_samples = 0
+        self.tar = None
+        self.shard_fn = None
+        self.index = (self.output_dir / "index.jsonl").open("w")
+
+    def _add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def write(self, key, image, text, **meta):
+        if self.n_samples % self.shard_size == 0:
+            if self.tar:
+                self.tar.close()
+            self.shard_fn = f"{self.prefix}-{self.n_samples // self.shard_size:06}.tar"
+            self.tar = tarfile.open(self.output_dir / self.shard_fn, "w")
+        self._add(f"{key}.png", image)
+        self._add(f"{key}.txt", text.encode("utf-8"))
+        self.index.write(
+            json.dumps(
+                {"key": key, "shard": self.shard_fn, "text": text, **meta},
+                ensure_ascii=False,
+            )
+            + "\n"
+        )
+        self.n_samples += 1
+
+    def close(self):
+        if self.tar:
+            self.tar.close()
+        self.index.close()
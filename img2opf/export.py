@@ -0,0 +1,93 @@
+import codecs
+import gzip
+import json
+
+CHUNK_SIZE = 16 * 1024
+TEXT_ANNOTATIONS_KEY = '"textAnnotations"'
+PAGE_SEPARATOR = "\n\n\n"
+
+_decoder = json.JSONDecoder()
+
+
+def read_page_text(f, chunk_size=CHUNK_SIZE):
+    """
+    f: binary file object of a google ocr response in json
+    return: `textAnnotations[0].description` of the response, or None for pages without text.
+
+    The response is read chunk by chunk and only decoded up to the end of the first
+    text annotation, the rest of the response (all the symbols) is never parsed.
+    """
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    key_start = 0
+    start = None
+    while True:
+        chunk = f.read(chunk_size)
+        buf += text_decoder.decode(chunk, final=not chunk)
+
+        if start is None:
+            key = buf.find(TEXT_ANNOTATIONS_KEY, key_start)
+            if key == -1:
+                key_start = max(len(buf) - len(TEXT_ANNOTATIONS_KEY), 0)
+            else:
+                bracket = buf.find("[", key + len(TEXT_ANNOTATIONS_KEY))
+                if bracket != -1:
+                    start = bracket + 1
+
+        if start is not None:
+            while start < len(buf) and buf[start].isspace():
+                start += 1
+            if start < len(buf):
+                if buf[start] == "]":
+                    return None
+                try:
+                    annotation, _ = _decoder.raw_decode(buf, start)
+                    return annotation.get("description", "")
+                except json.JSONDecodeError:
+                    # first annotation not fully read yet
+                    pass
+
+        if not chunk:
+            return None
+
+
+def get_page_text(fn):
+    """
+    fn: path to a .json.gz ocr output
+    """
+    with gzip.open(str(fn), "rb") as f:
+        return read_page_text(f)
+
+
+def export_volume_text(vol_dir, output_dir, per_page=False):
+    """
+    write the text of all the .json.gz ocr outputs of `vol_dir` either into
+    output_dir/<vol_name>.txt or into output_dir/<vol_name>/<page_name>.txt.
+    return: number of pages exported
+    """
+    page_fns = sorted(fn for fn in vol_dir.iterdir() if fn.name.endswith(".json.gz"))
+    texts = ((fn.name[: -len(".json.gz")], get_page_text(fn)) for fn in page_fns)
+    return write_volume_text(texts, vol_dir.name, output_dir, per_page=per_page)
+
+
+def write_volume_text(texts, vol_name, output_dir, per_page=False):
+    """
+    texts: iterable of (page_name, page_text) in page order
+    return: number of pages written
+    """
+    n_pages = 0
+    if per_page:
+        vol_output_dir = output_dir / vol_name
+        vol_output_dir.mkdir(exist_ok=True, parents=True)
+        for page_name, text in texts:
+            (vol_output_dir / f"{page_name}.txt").write_text(text or "")
+            n_pages += 1
+    else:
+        output_dir.mkdir(exist_ok=True, parents=True)
+        with (output_dir / f"{vol_name}.txt").open("w") as f:
+            for page_name, text in texts:
+                if n_pages:
+                    f.write(PAGE_SEPARATOR)
+                f.write(text or "")
+                n_pages += 1
+    return n_pages
@@ -0,0 +1,44 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import config
+
+
+def get_iiif_session(pool_size=config.IIIF_POOL_SIZE, retries=3):
+    """
+    keep-alive session with a connection pool big enough for `pool_size` concurrent
+    requests, retrying on connection errors and 429/5xx.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_iiif_url(
+    volume_prefix_url,
+    filename,
+    size=config.IIIF_SIZE,
+    fmt=config.IIIF_FORMAT,
+    base_url=config.IIIF_BASE_URL,
+):
+    """
+    IIIF Image API url of an image of a volume, resized by the server.
+    size: IIIF size parameter, eg: "max", "!2000,2000" (fit in a box), "pct:50"
+    fmt: jpg or png
+    """
+    return f"{base_url}/{volume_prefix_url}::{filename}/full/{size}/0/default.{fmt}"
+
+
+def fetch_iiif_image(session, url, timeout=config.IIIF_TIMEOUT):
+    r = session.get(url, timeout=timeout)
+    r.raise_for_status()
+    return r.content
@@ -0,0 +1,193 @@
+import numpy as np
+
+from . import config
+
+# detectedBreak types which end a line
+LINE_BREAKS = {"EOL_SURE_SPACE", "LINE_BREAK"}
+BREAK_TEXT = {
+    "SPACE": " ",
+    "SURE_SPACE": " ",
+    "EOL_SURE_SPACE": "\n",
+    "LINE_BREAK": "\n",
+    "HYPHEN": "-\n",
+}
+
+
+def get_box(bounding_box):
+    """
+    return: [x0, y0, x1, y1] of the vertices of a google ocr boundingBox
+    """
+    xs = [vertex.get("x", 0) for vertex in bounding_box.get("vertices", [])] or [0]
+    ys = [vertex.get("y", 0) for vertex in bounding_box.get("vertices", [])] or [0]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def iter_words(response):
+    for page in response.get("fullTextAnnotation", {}).get("pages", []):
+        for block in page.get("blocks", []):
+            for paragraph in block.get("paragraphs", []):
+                for word in paragraph.get("words", []):
+                    yield word
+
+
+class PageIndex:
+    """
+    words of a page in reading order as flat arrays: boxes (x0, y0, x1, y1), line
+    numbers and [start, end) offsets in the page text, with a grid index on the boxes.
+    """
+
+    def __init__(
+        self, boxes, lines, starts, ends, text, cell_size, cell_starts, cell_words
+    ):
+        self.boxes = boxes
+        self.lines = lines
+        self.starts = starts
+        self.ends = ends
+        self.text = text
+        self.cell_size = cell_size
+        self.cell_starts = cell_starts
+        self.cell_words = cell_words
+        self.n_cols = (
+            int(np.clip(boxes[:, 2], 0, None).max()) // cell_size + 1 if len(boxes) else 1
+        )
+
+    @classmethod
+    def from_response(cls, response, cell_size=config.INDEX_CELL_SIZE):
+        boxes, lines, starts, ends = [], [], [], []
+        text = []
+        offset, line = 0, 0
+        for word in iter_words(response):
+            boxes.append(get_box(word.get("boundingBox", {})))
+            lines.append(line)
+            word_text = ""
+            break_type = None
+            for symbol in word.get("symbols", []):
+                word_text += symbol.get("text", "")
+                break_type = (
+                    symbol.get("property", {}).get("detectedBreak", {}).get("type")
+                )
+            starts.append(offset)
+            ends.append(offset + len(word_text))
+            word_text += BREAK_TEXT.get(break_type, "")
+            text.append(word_text)
+            offset += len(word_text)
+            if break_type in LINE_BREAKS or break_type == "HYPHEN":
+                line += 1
+
+        boxes = np.array(boxes, dtype=np.int32).reshape(-1, 4)
+        cell_starts, cell_words = cls._build_grid(boxes, cell_size)
+        return cls(
+            boxes,
+            np.array(lines, dtype=np.int32),
+            np.array(starts, dtype=np.int32),
+            np.array(ends, dtype=np.int32),
+            "".join(text),
+            cell_size,
+            cell_starts,
+            cell_words,
+        )
+
+    @staticmethod
+    def _build_grid(boxes, cell_size):
+        """
+        grid in CSR layout: words of cell c are cell_words[cell_starts[c]:cell_starts[c + 1]]
+        """
+        if not len(boxes):
+            return np.zeros(2, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        cells = np.clip(boxes, 0, None) // cell_size
+        n_cols = int(cells[:, 2].max()) + 1
+        n_rows = int(cells[:, 3].max()) + 1
+        cell_ids, word_ids = [], []
+        for word_id, (c0, r0, c1, r1) in enumerate(cells):
+            cols, rows = np.meshgrid(np.arange(c0, c1 + 1), np.arange(r0, r1 + 1))
+            ids = (rows * n_cols + cols).ravel()
+            cell_ids.append(ids)
+            word_ids.append(np.full(len(ids), word_id))
+        cell_ids = np.concatenate(cell_ids)
+        word_ids = np.concatenate(word_ids)
+        order = np.argsort(cell_ids, kind="stable")
+        counts = np.bincount(cell_ids, minlength=n_rows * n_cols)
+        cell_starts = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+        return cell_starts, word_ids[order].astype(np.int32)
+
+    def query_region(self, x0, y0, x1, y1):
+        """
+        return: ids of the words overlapping the region, in reading order
+        """
+        if not len(self.boxes):
+            return np.zeros(0, dtype=np.int32)
+        n_cells = len(self.cell_starts) - 1
+        n_rows = n_cells // self.n_cols
+        c0, c1 = max(x0 // self.cell_size, 0), min(x1 // self.cell_size, self.n_cols - 1)
+        r0, r1 = max(y0 // self.cell_size, 0), min(y1 // self.cell_size, n_rows - 1)
+        if c0 > c1 or r0 > r1:
+            return np.zeros(0, dtype=np.int32)
+        candidates = np.unique(
+            np.concatenate(
+                [
+                    self.cell_words[
+                        self.cell_starts[row * self.n_cols + c0] : self.cell_starts[
+                            row * self.n_cols + c1 + 1
+                        ]
+                    ]
+                    for row in range(int(r0), int(r1) + 1)
+                ]
+            )
+        )
+        boxes = self.boxes[candidates]
+        overlap = (
+            (boxes[:, 0] <= x1)
+            & (boxes[:, 2] >= x0)
+            & (boxes[:, 1] <= y1)
+            & (boxes[:, 3] >= y0)
+        )
+        return candidates[overlap]
+
+    def line(self, line):
+        """
+        return: ids of the words of a line, in reading order
+        """
+        return np.flatnonzero(self.lines == line)
+
+    def line_boxes(self):
+        """
+        return: (n_lines, 4) boxes of the lines
+        """
+        n_lines = int(self.lines.max()) + 1 if len(self.lines) else 0
+        boxes = np.zeros((n_lines, 4), dtype=np.int32)
+        boxes[:, :2] = np.iinfo(np.int32).max
+        np.minimum.at(boxes[:, 0], self.lines, self.boxes[:, 0])
+        np.minimum.at(boxes[:, 1], self.lines, self.boxes[:, 1])
+        np.maximum.at(boxes[:, 2], self.lines, self.boxes[:, 2])
+        np.maximum.at(boxes[:, 3], self.lines, self.boxes[:, 3])
+        return boxes
+
+    def words_text(self, word_ids):
+        return [self.text[self.starts[i] : self.ends[i]] for i in word_ids]
+
+    def save(self, fn):
+        np.savez_compressed(
+            fn,
+            boxes=self.boxes,
+            lines=self.lines,
+            starts=self.starts,
+            ends=self.ends,
+            text=np.array(self.text),
+            cell_size=self.cell_size,
+            cell_starts=self.cell_starts,
+            cell_words=self.cell_words,
+        )
+
+    @classmethod
+    def load(cls, fn):
+        with np.load(fn) as data:
+            return cls(
+                data["boxes"],
+                data["lines"],
+                data["starts"],
+                data["ends"],
+                str(data["text"]),
+                int(data["cell_size"]),
+                data["cell_starts"],
+                data["cell_words"],
+            )
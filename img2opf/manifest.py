@@ -0,0 +1,70 @@
+import hashlib
+
+MANIFEST_FN = "manifest.json"
+
+
+def get_md5(data):
+    """
+    return: md5 hex digest, the ETag s3 gives an object uploaded in one PUT
+    """
+    return hashlib.md5(data).hexdigest()
+
+
+def build_manifest(
+    work_local_id,
+    imagegroup,
+    outputs,
+    output_prefix,
+    engine,
+    timestamp,
+    previous=None,
+    archived=None,
+):
+    """
+    outputs: (page, gzipped ocr output, ocr timestamp) of the volume, as archived. The
+    ocr timestamp can be None if it is not known, the manifest timestamp is used.
+    It can be a part of the volume, eg: on a resume.
+    timestamp: time the manifest is published
+    archived: pages whose output is in the archive, if known
+    return: manifest of the volume, with key, size, md5, ocr timestamp and engine of
+    every page. An unchanged page keeps the ocr timestamp and engine of the previous
+    manifest, a page missing from `outputs` keeps its previous entry unless it is not
+    `archived` anymore.
+    """
+    previous_pages = previous["pages"] if previous else {}
+    pages = {}
+    for page, output, ocr_timestamp in outputs:
+        md5 = get_md5(output)
+        entry = previous_pages.get(page)
+        if not entry or entry["md5"] != md5:
+            entry = {
+                "key": f"{output_prefix}/{page}.json.gz",
+                "size": len(output),
+                "md5": md5,
+                "ocr_timestamp": ocr_timestamp or timestamp,
+                "engine": engine,
+            }
+        pages[page] = entry
+    for page, entry in previous_pages.items():
+        if page not in pages and (archived is None or page in archived):
+            pages[page] = entry
+    return {
+        "work": work_local_id,
+        "imagegroup": imagegroup,
+        "timestamp": timestamp,
+        "pages": dict(sorted(pages.items())),
+    }
+
+
+def get_changed_pages(manifest, local_dir):
+    """
+    return: {page: md5 of the local output, None if missing} of the pages of the
+    manifest whose local output in local_dir differs from the archived one
+    """
+    changed = {}
+    for page, entry in manifest["pages"].items():
+        output_fn = local_dir / f"{page}.json.gz"
+        local_md5 = get_md5(output_fn.read_bytes()) if output_fn.is_file() else None
+        if local_md5 != entry["md5"]:
+            changed[page] = local_md5
+    return changed
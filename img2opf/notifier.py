@@ -1,9 +1,121 @@
+import atexit
+import logging
 import os
+import queue
+import threading
+from collections import Counter, deque
+from logging.handlers import QueueHandler, QueueListener
 
-import slack
+from . import config
 
-client = slack.WebClient(token=os.environ["SLACK_API_TOKEN"])
+_client = None
+
+
+def get_client():
+    """
+    slack client, created on first use so importing the module needs no token
+    """
+    global _client
+    if _client is None:
+        import slack
+
+        _client = slack.WebClient(
+            token=os.environ["SLACK_API_TOKEN"], timeout=config.NOTIFIER_TIMEOUT
+        )
+    return _client
 
 
 def slack_notifier(message):
-    response = client.chat_postMessage(channel="#ocr-logs", text=message)
+    response = get_client().chat_postMessage(channel="#ocr-logs", text=message)
+
+
+def coalesce(messages):
+    """
+    return: messages in order of first occurrence, repeated ones counted, eg: "msg (x3)"
+    """
+    counts = Counter(messages)
+    return [
+        msg if counts[msg] == 1 else f"{msg} (x{counts[msg]})"
+        for msg in dict.fromkeys(messages)
+    ]
+
+
+class BatchNotifier:
+    """
+    `notify` only appends to a bounded buffer and never blocks the caller. A background
+    thread posts the buffered messages every `interval` seconds as one coalesced message.
+    When the buffer is full the oldest messages are dropped and counted, and a failed
+    post keeps its messages for the next interval.
+    """
+
+    def __init__(
+        self,
+        send=slack_notifier,
+        interval=config.NOTIFIER_INTERVAL,
+        max_pending=config.NOTIFIER_MAX_PENDING,
+    ):
+        self.send = send
+        self.interval = interval
+        self.pending = deque(maxlen=max_pending)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def notify(self, msg):
+        with self._lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(msg)
+
+    __call__ = notify
+
+    def flush(self):
+        with self._lock:
+            messages = list(self.pending)
+            self.pending.clear()
+            dropped, self.dropped = self.dropped, 0
+        if not messages and not dropped:
+            return
+        lines = coalesce(messages)
+        if dropped:
+            lines.append(f"_{dropped} messages dropped_")
+        try:
+            self.send("\n".join(lines))
+        except Exception as e:
+            logging.error(f"Notifier error: {e}")
+            with self._lock:
+                # older than the messages which came in meanwhile, dropped first if full
+                messages.extend(self.pending)
+                n_dropped = max(len(messages) - self.pending.maxlen, 0)
+                self.pending = deque(messages[n_dropped:], maxlen=self.pending.maxlen)
+                self.dropped += dropped + n_dropped
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+
+def start_queue_logging(handler, level=logging.INFO):
+    """
+    route the records of the root logger through a queue to `handler`, which runs in a
+    listener thread: logging calls never wait on the file or the network.
+    return: the listener, stopped at exit
+    """
+    log_queue = queue.Queue()
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,16 +1,32 @@
 import io
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
 
-from google.cloud import vision
 from google.cloud.vision import types
 from google.protobuf.json_format import MessageToJson
 
-vision_client = vision.ImageAnnotatorClient()
+from .vision_pool import get_vision_pool
 
+# clients of the credentials in VISION_CREDENTIALS and endpoints in VISION_ENDPOINTS,
+# the default credentials if none. A request exhausting the quota of a client is retried
+# on another one, or on the same one after config.VISION_COOLDOWN if it is the only one.
+vision_pool = get_vision_pool()
 
-def google_ocr(image):
+try:
+    from importlib.metadata import version
+
+    OCR_ENGINE = f"google-cloud-vision/{version('google-cloud-vision')}/document_text_detection"
+except Exception:
+    OCR_ENGINE = "google-cloud-vision/document_text_detection"
+
+
+def google_ocr(image, lang_hints=None):
     """
     image: file_path or image bytes
+    lang_hints: language codes given to the api as hints, eg: ["bo"]
     return: google ocr response in Json
     """
     if isinstance(image, (str, Path)):
@@ -20,12 +36,75 @@ def google_ocr(image):
         content = image
     ocr_image = types.Image(content=content)
 
-    response = vision_client.document_text_detection(image=ocr_image)
+    kwargs = {}
+    if lang_hints:
+        kwargs["image_context"] = types.ImageContext(language_hints=lang_hints)
+    response = vision_pool.document_text_detection(image=ocr_image, **kwargs)
     response_json_str = MessageToJson(response)
 
     return eval(response_json_str)
 
 
+IMAGE_SUFFIXES = [".png", ".jpg", ".jpeg"]
+
+
+def get_text(image):
+    """
+    image: file_path or image bytes
+    return: text of the image, None if no text is detected
+    """
+    response = google_ocr(image)
+    if "textAnnotations" not in response:
+        return None
+    return response["textAnnotations"][0]["description"]
+
+
+def ocr_in_order(fns, workers, window=None):
+    """
+    OCR the images with `workers` threads and yield (fn, text or exception) in the order
+    of `fns`. Results which come early wait in a reorder buffer of at most `window` images.
+    """
+    window = window or workers * 2
+    fns = iter(fns)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque(
+            (fn, executor.submit(get_text, fn)) for fn in islice(fns, window)
+        )
+        while pending:
+            for next_fn in islice(fns, 1):
+                pending.append((next_fn, executor.submit(get_text, next_fn)))
+            fn, future = pending.popleft()
+            try:
+                text = future.result()
+            except Exception as ex:
+                text = ex
+            yield fn, text
+
+
+def combine_pages(fns, input_path, pages_path, combined_fn):
+    """
+    write the texts of the pages of `fns` saved in pages_path into combined_fn, in the
+    order of `fns`, and remove pages_path
+    """
+    with combined_fn.open("w") as combined:
+        is_first = True
+        for fn in fns:
+            page_fn = pages_path / fn.relative_to(input_path).parent / f"{fn.stem}.txt"
+            if not page_fn.is_file():
+                continue
+            if not is_first:
+                combined.write("\n\n\n")
+            combined.write(page_fn.read_text())
+            is_first = False
+    shutil.rmtree(pages_path, ignore_errors=True)
+
+
+def load_manifest(manifest_fn):
+    if not manifest_fn.is_file():
+        return set()
+    return set(manifest_fn.read_text().splitlines())
+
+
 if __name__ == "__main__":
 
     import argparse
@@ -34,7 +113,9 @@ if __name__ == "__main__":
 
     ap = argparse.ArgumentParser()
     ap.add_argument(
-        "--input_dir", type=str, help="directory path containing all the images"
+        "--input_dir",
+        type=str,
+        help="directory path containing all the images, sub directories included",
     )
     ap.add_argument("--n", type=int, help="start page number", default=1)
     ap.add_argument(
@@ -45,6 +126,9 @@ if __name__ == "__main__":
         action="store_true",
         help="Combine the output of all the images in output_dir",
     )
+    ap.add_argument(
+        "--workers", type=int, default=8, help="number of parallel OCR requests"
+    )
     args = ap.parse_args()
 
     print("[INFO] OCR started ....")
@@ -52,25 +136,40 @@ if __name__ == "__main__":
     output_path = Path(args.output_dir)
     output_path.mkdir(exist_ok=True, parents=True)
 
-    fns = [fn for fn in input_path.iterdir() if fn.suffix in [".png", ".jpg", ".jpeg"]]
-    if args.combine:
-        fns = sorted(fns)
-
-    texts = []
-    for fn in tqdm(fns[args.n - 1 :]):
-        response = google_ocr(fn)
-        if "textAnnotations" not in response:
-            continue
-        text = response["textAnnotations"][0]["description"]
-        if not args.combine:
-            output_fn = output_path / f"{fn.stem}.txt"
-            output_fn.write_text(text)
-        else:
-            texts.append(text)
-
-    if args.combine and texts:
-        output_fn = output_path / f"{input_path.name}.txt"
-        output_fn.write_text("\n\n\n".join(texts))
-        print("[INFO] Output is saved at:", str(output_fn))
-    else:
-        print("INFO]  Output is saved at:", str(output_path))
+    # pages already done in a previous run, one relative image path per line
+    manifest_fn = output_path / f"{input_path.name}.manifest"
+    done = load_manifest(manifest_fn)
+
+    all_fns = sorted(fn for fn in input_path.rglob("*") if fn.suffix in IMAGE_SUFFIXES)
+    all_fns = all_fns[args.n - 1 :]
+    fns = [fn for fn in all_fns if fn.relative_to(input_path).as_posix() not in done]
+
+    # with --combine, pages are saved one by one in pages_path and combined in sorted
+    # order once they are all done, pages failed in a previous run keep their position
+    combined_fn = output_path / f"{input_path.name}.txt"
+    pages_path = output_path / f".{input_path.name}.pages"
+    with manifest_fn.open("a") as manifest:
+        for fn, text in tqdm(ocr_in_order(fns, args.workers), total=len(fns)):
+            rel_fn = fn.relative_to(input_path)
+            if isinstance(text, Exception):
+                print(f"[ERROR] {rel_fn}: {text}")
+                continue
+            if text is not None:
+                base_path = pages_path if args.combine else output_path
+                output_fn = base_path / rel_fn.parent / f"{fn.stem}.txt"
+                output_fn.parent.mkdir(exist_ok=True, parents=True)
+                output_fn.write_text(text)
+            manifest.write(f"{rel_fn.as_posix()}\n")
+            manifest.flush()
+            done.add(rel_fn.as_posix())
+
+    n_failed = sum(fn.relative_to(input_path).as_posix() not in done for fn in all_fns)
+    if n_failed:
+        print(f"[ERROR] {n_failed} pages failed, run the same command again to resume")
+    elif args.combine and (fns or pages_path.is_dir()):
+        combine_pages(all_fns, input_path, pages_path, combined_fn)
+
+    if args.combine and not n_failed:
+        print("[INFO] Output is saved at:", str(combined_fn))
+    elif not args.combine:
+        print("[INFO] Output is saved at:", str(output_path))
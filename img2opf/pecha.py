@@ -1,32 +1,391 @@
-import requests
+import gzip
+import io
+import json
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from functools import partial
+from itertools import islice
+from pathlib import Path
+
+from PIL import Image
 
 from . import config
+from .iiif import fetch_iiif_image, get_iiif_session, get_iiif_url
+from .ocr import google_ocr
+from .preprocess import (
+    get_resize_transform,
+    map_response_to_original,
+    preprocess_image,
+)
+
+IMAGE_SUFFIXES = [".png", ".jpg", ".jpeg", ".tif", ".tiff"]
+UNSUPPORTED_SUFFIXES = [".tif", ".tiff"]
+
+
+def to_supported_format(filename, content):
+    """
+    Google Vision doesn't support tiff, they are converted to png.
+    return: (filename, content)
+    """
+    if Path(filename).suffix.lower() not in UNSUPPORTED_SUFFIXES:
+        return filename, content
+    out = io.BytesIO()
+    Image.open(io.BytesIO(content)).save(out, format="png")
+    return f"{filename.split('.')[0]}.png", out.getvalue()
+
+
+def get_page_name(filename):
+    return filename.split(".")[0]
+
+
+class LocalSource:
+    """
+    images of a local directory
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def __iter__(self):
+        for fn in sorted(self.path.iterdir()):
+            if fn.suffix.lower() in IMAGE_SUFFIXES:
+                yield fn.name, fn.read_bytes
+
+
+class S3Source:
+    """
+    images `filenames` stored under `prefix` of an s3 bucket
+    """
+
+    def __init__(self, bucket, prefix, filenames, client=None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.filenames = filenames
+        self.client = client or boto3.client("s3")
+
+    def _get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def __iter__(self):
+        for filename in self.filenames:
+            yield filename, partial(self._get, f"{self.prefix}/{filename}")
+
+
+class IIIFSource:
+    """
+    images `filenames` of a volume fetched from a IIIF Image API server, resized
+    by the server to `size` and encoded as `fmt`.
+    orig_sizes: {filename: (width, height)} of the original images, the ocr responses
+    of the resized images are mapped back to them
+    """
+
+    def __init__(
+        self,
+        volume_prefix_url,
+        filenames,
+        size=config.IIIF_SIZE,
+        fmt=config.IIIF_FORMAT,
+        base_url=config.IIIF_BASE_URL,
+        session=None,
+        orig_sizes=None,
+    ):
+        self.volume_prefix_url = volume_prefix_url
+        self.filenames = filenames
+        self.size = size
+        self.fmt = fmt
+        self.base_url = base_url
+        self.session = session or get_iiif_session()
+        self.orig_sizes = {
+            get_page_name(filename): size
+            for filename, size in (orig_sizes or {}).items()
+        }
+
+    def orig_size(self, filename):
+        """
+        return: (width, height) of the original image of a page, None if unknown
+        """
+        return self.orig_sizes.get(get_page_name(filename))
+
+    def _get(self, filename):
+        url = get_iiif_url(
+            self.volume_prefix_url, filename, self.size, self.fmt, self.base_url
+        )
+        return fetch_iiif_image(self.session, url)
+
+    def __iter__(self):
+        for filename in self.filenames:
+            yield f"{get_page_name(filename)}.{self.fmt}", partial(self._get, filename)
+
+
+class LocalSink:
+    """
+    ocr outputs saved as path/<page_name>.json.gz
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(exist_ok=True, parents=True)
+
+    def exists(self, filename):
+        return (self.path / f"{get_page_name(filename)}.json.gz").is_file()
+
+    def save(self, filename, response, image=None):
+        content = gzip.compress(json.dumps(response).encode())
+        (self.path / f"{get_page_name(filename)}.json.gz").write_bytes(content)
+
+    def close(self):
+        pass
+
+
+class S3Sink:
+    """
+    ocr outputs saved as <output_prefix>/<page_name>.json.gz in an s3 bucket, and the
+    images under images_prefix if given. `extra_objects` ({key: bytes}) are written
+    once the volume is done.
+    """
+
+    def __init__(
+        self, bucket, output_prefix, images_prefix=None, extra_objects=None, client=None
+    ):
+        import boto3
+
+        self.bucket = bucket
+        self.output_prefix = output_prefix
+        self.images_prefix = images_prefix
+        self.extra_objects = extra_objects or {}
+        self.client = client or boto3.client("s3")
+
+    def _output_key(self, filename):
+        return f"{self.output_prefix}/{get_page_name(filename)}.json.gz"
+
+    def exists(self, filename):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._output_key(filename))
+        except ClientError:
+            return False
+        return True
+
+    def save(self, filename, response, image=None):
+        if self.images_prefix and image:
+            self.client.put_object(
+                Bucket=self.bucket, Key=f"{self.images_prefix}/{filename}", Body=image
+            )
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._output_key(filename),
+            Body=gzip.compress(json.dumps(response).encode()),
+        )
+
+    def close(self):
+        for key, body in self.extra_objects.items():
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=body)
+
+
+class Volume:
+    def __init__(self, name, source, sink):
+        self.name = name
+        self.source = source
+        self.sink = sink
+
+    def _ocr_page(self, filename, load, preprocess=None):
+        if self.sink.exists(filename):
+            return False
+        orig_size = None
+        if hasattr(self.source, "orig_size"):
+            orig_size = self.source.orig_size(filename)
+        filename, content = to_supported_format(filename, load())
+        transform = None
+        ocr_content = content
+        if preprocess is not None:
+            ocr_content, transform = preprocess_image(content, **preprocess)
+        response = google_ocr(ocr_content)
+        if transform:
+            response = map_response_to_original(response, transform)
+        if orig_size:
+            size = Image.open(io.BytesIO(content)).size
+            if size != tuple(orig_size):
+                response = map_response_to_original(
+                    response, get_resize_transform(size, orig_size)
+                )
+                # the archived page images are the originals, not resized ones
+                content = None
+        self.sink.save(filename, response, image=content)
+        return True
+
+    def ocr(self, executor, window=config.OCR_WINDOW, preprocess=None):
+        """
+        OCR the pages of the volume which are not in the sink yet. Pages are OCRed in
+        `executor`, which can be shared by many volumes, at most `window` at a time.
+        return: number of pages OCRed
+        """
+        pages = iter(self.source)
+        pending = deque(
+            executor.submit(self._ocr_page, filename, load, preprocess)
+            for filename, load in islice(pages, window)
+        )
+        n_pages = 0
+        while pending:
+            for filename, load in islice(pages, 1):
+                pending.append(
+                    executor.submit(self._ocr_page, filename, load, preprocess)
+                )
+            try:
+                n_pages += pending.popleft().result()
+            except Exception as ex:
+                logging.error(f"OCR issue in volume {self.name}: {ex}")
+        self.sink.close()
+        return n_pages
 
 
 class Pecha:
-    def __init__(self, images_dir=config.IMAGES_DIR, output_dir=config.OUTPUT_DIR):
+    def __init__(
+        self,
+        images_dir=config.IMAGES_DIR,
+        output_dir=config.OUTPUT_DIR,
+        parallelism=config.VOLUME_PARALLELISM,
+        ocr_workers=config.OCR_WORKERS,
+        preprocess=None,
+    ):
+        """
+        parallelism: number of volumes processed at the same time
+        ocr_workers: number of OCR requests at the same time, shared by all the volumes
+        preprocess: None or keyword arguments of `preprocess_image`
+        """
         self.images_dir = images_dir
         self.output_dir = output_dir
+        self.parallelism = parallelism
+        self.ocr_workers = ocr_workers
+        self.preprocess = preprocess
 
     @property
     def volumes(self):
         return self._get_volumes()
 
     def _get_volumes(self):
-        raise NotImplemented()
+        raise NotImplementedError()
 
     def ocr(self):
-        for volume in self.volumes:
-            volume.get_images()
-            volume.run_ocr()
-            volume.archive()
+        """
+        return: {volume name: number of pages OCRed}
+        """
+        n_pages = {}
+        with ThreadPoolExecutor(
+            max_workers=self.ocr_workers
+        ) as ocr_executor, ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            futures = {
+                executor.submit(volume.ocr, ocr_executor, preprocess=self.preprocess): volume
+                for volume in self.volumes
+            }
+            for future in as_completed(futures):
+                volume = futures[future]
+                try:
+                    n_pages[volume.name] = future.result()
+                except Exception as ex:
+                    logging.error(f"Volume {volume.name} failed: {ex}")
+        return n_pages
+
+
+class LocalPecha(Pecha):
+    """
+    every sub directory of images_dir is a volume, or images_dir itself if it has none.
+    """
+
+    def _get_volumes(self):
+        images_dir = Path(self.images_dir)
+        vol_dirs = sorted(path for path in images_dir.iterdir() if path.is_dir())
+        for vol_dir in vol_dirs or [images_dir]:
+            yield Volume(
+                vol_dir.name,
+                LocalSource(vol_dir),
+                LocalSink(Path(self.output_dir) / vol_dir.name),
+            )
+
 
 class BdrcPecha(Pecha):
-    def __init__(self, work_id):
-        self.work_id = work_id
-        volumes_url = (
-            f"purl.bdrc.io/query/table/volumesForInstance?R_RES=bdr:M{self.work_id}&pageSize=500&format=json"
+    """
+    source: "s3" (archive bucket) or "iiif"
+    sink: "s3" (ocr output bucket, with BDRC layout) or "local" (output_dir/work/imagegroup)
+    """
+
+    def __init__(self, work_id, source="s3", sink="s3", **kwargs):
+        super().__init__(**kwargs)
+        if ":" in work_id:
+            self.work_local_id, self.work = work_id.split(":")[-1], work_id
+        else:
+            self.work_local_id, self.work = work_id, f"bdr:{work_id}"
+        self.source = source
+        self.sink = sink
+        self.iiif_session = None
+
+    def _get_source(self, vol_info, image_list):
+        from .bdrc import ARCHIVE_BUCKET, get_s3_prefix_path
+
+        filenames = [imageinfo["filename"] for imageinfo in image_list]
+        if self.source == "iiif":
+            if self.iiif_session is None:
+                self.iiif_session = get_iiif_session(self.ocr_workers)
+            orig_sizes = {
+                imageinfo["filename"]: (imageinfo["width"], imageinfo["height"])
+                for imageinfo in image_list
+                if "width" in imageinfo and "height" in imageinfo
+            }
+            return IIIFSource(
+                vol_info["volume_prefix_url"],
+                filenames,
+                session=self.iiif_session,
+                orig_sizes=orig_sizes,
+            )
+        s3prefix = get_s3_prefix_path(self.work_local_id, vol_info["imagegroup"])
+        return S3Source(ARCHIVE_BUCKET, s3prefix, filenames)
+
+    def _get_sink(self, vol_info):
+        from .bdrc import (
+            BATCH_PREFIX,
+            IMAGES,
+            INFO_FN,
+            OCR_OUTPUT_BUCKET,
+            OUTPUT,
+            SERVICE,
+            get_s3_prefix_path,
+        )
+
+        if self.sink == "local":
+            return LocalSink(
+                Path(self.output_dir) / self.work_local_id / vol_info["imagegroup"]
+            )
+        s3_paths = get_s3_prefix_path(
+            self.work_local_id,
+            vol_info["imagegroup"],
+            service=SERVICE,
+            batch_prefix=BATCH_PREFIX,
+            data_types=[IMAGES, OUTPUT],
+        )
+        info = {
+            "timestamp": datetime.now(timezone.utc).isoformat().split(".")[0],
+            "imagesfolder": IMAGES,
+        }
+        return S3Sink(
+            OCR_OUTPUT_BUCKET,
+            s3_paths[OUTPUT],
+            images_prefix=s3_paths[IMAGES],
+            extra_objects={
+                f"{s3_paths[BATCH_PREFIX]}/{INFO_FN}": json.dumps(info).encode("UTF-8")
+            },
         )
 
     def _get_volumes(self):
+        from .bdrc import get_s3_image_list, get_volume_infos
 
+        for vol_info in get_volume_infos(self.work):
+            image_list = get_s3_image_list(vol_info["volume_prefix_url"])
+            yield Volume(
+                vol_info["imagegroup"],
+                self._get_source(vol_info, image_list),
+                self._get_sink(vol_info),
+            )
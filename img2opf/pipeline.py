@@ -0,0 +1,141 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class MemoryBudget:
+    """
+    bytes of page data a pipeline may hold in memory. `acquire` blocks while the
+    budget is used up, which applies backpressure on the stages producing pages.
+    A single item bigger than the whole budget is let through once the budget is free.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n_bytes):
+        with self._cond:
+            while self.used and self.used + n_bytes > self.max_bytes:
+                self._cond.wait()
+            self.used += n_bytes
+
+    def release(self, n_bytes):
+        with self._cond:
+            self.used -= n_bytes
+            self._cond.notify_all()
+
+    def resize(self, reserved, n_bytes):
+        """
+        change a reservation of `reserved` bytes, estimated before the item was loaded,
+        to its actual `n_bytes` without blocking.
+        return: n_bytes, the new reservation
+        """
+        with self._cond:
+            self.used += n_bytes - reserved
+            self._cond.notify_all()
+        return n_bytes
+
+
+class AdaptiveLimiter:
+    """
+    concurrency limit of a pipeline stage, tuned by AIMD from what the stage observes.
+    The limit grows by one after `limit` calls at normal latency, while callers are
+    queued for it, and is multiplied by `backoff` on an error or when the smoothed
+    latency goes over `tolerance` times the baseline latency. The baseline is the best
+    latency seen, drifting by `baseline_decay` of the gap towards the current latency
+    on every call, so a lasting change of the service latency becomes the new normal
+    instead of keeping the limit down. It stays in [min_limit, max_limit].
+    Use as `with limiter(): ...`.
+    """
+
+    def __init__(
+        self,
+        name,
+        initial=4,
+        min_limit=1,
+        max_limit=64,
+        tolerance=2.0,
+        backoff=0.7,
+        smoothing=0.1,
+        baseline_decay=0.01,
+    ):
+        self.name = name
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.baseline_decay = baseline_decay
+        self.in_flight = 0
+        self.waiting = 0
+        self.latency = None
+        self.best_latency = None
+        self.errors = 0
+        self._calls = 0
+        self._since_decrease = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            self.waiting += 1
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.waiting -= 1
+            self.in_flight += 1
+
+    def release(self, latency, error=False):
+        with self._cond:
+            self.in_flight -= 1
+            self._update(latency, error)
+            self._cond.notify_all()
+
+    def _update(self, latency, error):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+        if self.best_latency is None or self.latency < self.best_latency:
+            self.best_latency = self.latency
+        else:
+            self.best_latency += self.baseline_decay * (self.latency - self.best_latency)
+        self._since_decrease += 1
+
+        congested = error or self.latency > self.tolerance * self.best_latency
+        if congested:
+            self.errors += error
+            # at most one decrease per window of calls, the calls in flight at the
+            # decrease were started with the old limit
+            if self._since_decrease >= self.limit:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._since_decrease = 0
+                self._calls = 0
+            return
+
+        self._calls += 1
+        if self._calls >= self.limit:
+            self._calls = 0
+            if self.waiting:
+                self.limit = min(self.max_limit, self.limit + 1)
+
+    @contextmanager
+    def __call__(self):
+        self.acquire()
+        start = time.time()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.release(time.time() - start, error)
+
+    def __str__(self):
+        latency = f"{self.latency:.3f}s" if self.latency is not None else "-"
+        return (
+            f"{self.name}: limit {int(self.limit)}, latency {latency}, "
+            f"{self.errors} errors"
+        )
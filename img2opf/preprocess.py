@@ -0,0 +1,161 @@
+import io
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from . import config
+
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def to_grayscale(arr):
+    """
+    arr: HxW or HxWxC uint8 array
+    return: HxW uint8 luminance array
+    """
+    if arr.ndim == 2:
+        return arr
+    return (arr[..., :3].astype(np.float32) @ LUMA_WEIGHTS).astype(np.uint8)
+
+
+def _content_span(profile, min_ink, max_ink):
+    """
+    first and last index of the projection profile which looks like page content,
+    that is neither blank margin (< min_ink) nor solid scanner border (> max_ink).
+    """
+    content = np.flatnonzero((profile > min_ink) & (profile < max_ink))
+    if not content.size:
+        return 0, len(profile)
+    return int(content[0]), int(content[-1]) + 1
+
+
+def find_content_box(
+    gray,
+    ink_threshold=config.PREPROCESS_INK_THRESHOLD,
+    min_ink=config.PREPROCESS_MIN_INK,
+    max_ink=config.PREPROCESS_MAX_INK,
+    pad=config.PREPROCESS_PAD,
+    max_iterations=4,
+):
+    """
+    locate the text area of a page with row and column projection profiles.
+    The rows are profiled within the columns found and the other way around, until
+    the box is stable: a border along one side would otherwise look like content in
+    every line across it.
+    return: (left, top, right, bottom) in pixel of `gray`
+    """
+    ink = gray < ink_threshold
+    height, width = gray.shape
+    box = (0, 0, width, height)
+    for _ in range(max_iterations):
+        left, top, right, bottom = box
+        row_start, row_end = _content_span(
+            ink[top:bottom, left:right].mean(axis=1), min_ink, max_ink
+        )
+        top, bottom = top + row_start, top + row_end
+        col_start, col_end = _content_span(
+            ink[top:bottom, left:right].mean(axis=0), min_ink, max_ink
+        )
+        left, right = left + col_start, left + col_end
+        if (left, top, right, bottom) == box:
+            break
+        box = (left, top, right, bottom)
+    return (
+        max(left - pad, 0),
+        max(top - pad, 0),
+        min(right + pad, width),
+        min(bottom + pad, height),
+    )
+
+
+def preprocess_image(
+    image,
+    trim=True,
+    grayscale=True,
+    max_long_edge=config.PREPROCESS_MAX_LONG_EDGE,
+):
+    """
+    image: file_path, image bytes or PIL image
+    return: (png bytes to send to OCR, transform to map the OCR response back)
+    """
+    if isinstance(image, (str, Path)):
+        img = Image.open(image)
+    elif isinstance(image, bytes):
+        img = Image.open(io.BytesIO(image))
+    else:
+        img = image
+    orig_width, orig_height = img.size
+
+    if img.mode not in ("1", "L", "RGB", "RGBA"):
+        img = img.convert("RGB")
+
+    left, top = 0, 0
+    if trim or grayscale:
+        gray = to_grayscale(np.asarray(img.convert("L") if img.mode == "1" else img))
+        if trim:
+            left, top, right, bottom = find_content_box(gray)
+            gray = gray[top:bottom, left:right]
+            img = img.crop((left, top, right, bottom))
+        if grayscale and img.mode != "1":
+            img = Image.fromarray(gray)
+
+    scale = 1.0
+    if max_long_edge and max(img.size) > max_long_edge:
+        scale = max_long_edge / max(img.size)
+        if img.mode == "1":
+            img = img.convert("L")
+        img = img.resize(
+            (max(round(img.width * scale), 1), max(round(img.height * scale), 1)),
+            Image.LANCZOS,
+        )
+
+    out = io.BytesIO()
+    img.save(out, format="png", optimize=True)
+    transform = {
+        "offset": (left, top),
+        "scale": scale,
+        "size": (orig_width, orig_height),
+    }
+    return out.getvalue(), transform
+
+
+def get_resize_transform(size, orig_size):
+    """
+    transform to map the OCR response of an image resized to `size`, eg: by the IIIF
+    server, back to the original image of `orig_size`, both (width, height)
+    """
+    return {"offset": (0, 0), "scale": size[0] / orig_size[0], "size": tuple(orig_size)}
+
+
+def _map_vertex(vertex, transform):
+    left, top = transform["offset"]
+    scale = transform["scale"]
+    return {
+        "x": round(vertex.get("x", 0) / scale + left),
+        "y": round(vertex.get("y", 0) / scale + top),
+    }
+
+
+def _map_node(node, transform):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "vertices":
+                node[key] = [_map_vertex(vertex, transform) for vertex in value]
+            else:
+                _map_node(value, transform)
+    elif isinstance(node, list):
+        for item in node:
+            _map_node(item, transform)
+
+
+def map_response_to_original(response, transform):
+    """
+    rewrite in place all the bounding box vertices of a google ocr response made on a
+    preprocessed image so that they refer to the original image, like the stored responses.
+    """
+    _map_node(response, transform)
+    width, height = transform["size"]
+    for page in response.get("fullTextAnnotation", {}).get("pages", []):
+        page["width"], page["height"] = width, height
+    return response
@@ -0,0 +1,114 @@
+import cProfile
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def get_folded_stack(frame):
+    """
+    return: stack of the frame as "file:function;file:function", outermost call first
+    """
+    stack = []
+    while frame:
+        code = frame.f_code
+        stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def iter_thread_stacks(exclude=None):
+    """
+    yield (thread name, frame) of the running threads
+    """
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    for thread_id, frame in sys._current_frames().items():
+        if thread_id != exclude:
+            yield names.get(thread_id, str(thread_id)), frame
+
+
+class StackSampler:
+    """
+    samples the stacks of all threads every `interval` seconds in a background thread.
+    Samples are written as folded stacks, "thread;file:function;... count", the input
+    of flamegraph.pl, inferno and speedscope. Unlike cProfile, it sees the worker
+    threads of the pipeline.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for name, frame in iter_thread_stacks(exclude=self._thread.ident):
+                self.counts[f"{name};{get_folded_stack(frame)}"] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, fn):
+        with open(fn, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profiled(output_base, interval=0.005):
+    """
+    profile the block with cProfile, calling thread only, in output_base.prof (pstats,
+    snakeviz, flameprof) and with a StackSampler, all threads, in output_base.folded
+    """
+    output_base = Path(output_base)
+    output_base.parent.mkdir(exist_ok=True, parents=True)
+    profiler = cProfile.Profile()
+    sampler = StackSampler(interval)
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        profiler.dump_stats(f"{output_base}.prof")
+        sampler.write(f"{output_base}.folded")
+
+
+def dump_state(output_dir, top_n=25):
+    """
+    write the current stack of every thread, as text and folded stacks, and the top_n
+    lines allocating memory. Start tracemalloc with the run to see all its allocations,
+    else it is started at the first dump and the next dumps show the allocations since.
+    return: base path of the dump files
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True, parents=True)
+    base = output_dir / f"dump-{time.strftime('%Y%m%d-%H%M%S')}"
+    stacks = list(iter_thread_stacks())
+    with open(f"{base}-stacks.txt", "w") as f:
+        for name, frame in stacks:
+            f.write(f"Thread {name}:\n{''.join(traceback.format_stack(frame))}\n")
+    with open(f"{base}.folded", "w") as f:
+        for name, frame in stacks:
+            f.write(f"{name};{get_folded_stack(frame)} 1\n")
+
+    with open(f"{base}-memory.txt", "w") as f:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            f.write("tracemalloc started, allocations are shown from the next dump\n")
+        else:
+            current, peak = tracemalloc.get_traced_memory()
+            f.write(f"traced: {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB\n")
+            for stat in tracemalloc.take_snapshot().statistics("lineno")[:top_n]:
+                f.write(f"{stat}\n")
+    return base
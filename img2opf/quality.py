@@ -0,0 +1,63 @@
+import gzip
+import json
+
+import numpy as np
+
+from . import config
+from .layout import iter_words
+
+
+def get_word_confidences(response):
+    return np.array(
+        [word.get("confidence", 0.0) for word in iter_words(response)], dtype=np.float32
+    )
+
+
+def scan_confidences(output_fns, low_word_confidence=config.QUALITY_LOW_WORD_CONFIDENCE):
+    """
+    read the word confidences of the ocr outputs (.json.gz) into one flat array and
+    reduce them per page in one pass.
+    return: dict of per page arrays: n_words, mean (word confidence) and weak (fraction of
+    words under low_word_confidence), in the order of output_fns
+    """
+    confidences, n_words = [], []
+    for fn in output_fns:
+        with gzip.open(fn) as f:
+            page_confidences = get_word_confidences(json.load(f))
+        confidences.append(page_confidences)
+        n_words.append(len(page_confidences))
+
+    n_words = np.array(n_words, dtype=np.int64)
+    confidences = np.concatenate(confidences) if confidences else np.zeros(0, np.float32)
+    offsets = np.concatenate([[0], np.cumsum(n_words)[:-1]]).astype(np.int64)
+    nonempty = n_words > 0
+    sums = np.zeros(len(n_words))
+    weak = np.zeros(len(n_words))
+    if nonempty.any():
+        # reduceat on the offsets of the non empty pages only, empty slices are not reduced
+        sums[nonempty] = np.add.reduceat(confidences, offsets[nonempty])
+        weak[nonempty] = np.add.reduceat(
+            (confidences < low_word_confidence).astype(np.float32), offsets[nonempty]
+        )
+    denominators = np.maximum(n_words, 1)
+    return {"n_words": n_words, "mean": sums / denominators, "weak": weak / denominators}
+
+
+def flag_weak_pages(
+    scores, threshold=None, percentile=None, min_words=config.QUALITY_MIN_WORDS
+):
+    """
+    flag pages whose mean word confidence is under `threshold` and/or in the lowest
+    `percentile` % of the scanned pages. Pages with less than min_words words are
+    never flagged, they are mostly blank pages.
+    return: boolean mask over the pages of `scores`
+    """
+    scored = scores["n_words"] >= min_words
+    flagged = np.zeros(len(scores["mean"]), dtype=bool)
+    if not scored.any():
+        return flagged
+    if threshold is not None:
+        flagged |= scores["mean"] < threshold
+    if percentile is not None:
+        flagged |= scores["mean"] <= np.percentile(scores["mean"][scored], percentile)
+    return flagged & scored
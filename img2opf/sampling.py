@@ -0,0 +1,44 @@
+import random
+
+
+def count_items(strata):
+    if isinstance(strata, dict):
+        return sum(count_items(sub_strata) for sub_strata in strata.values())
+    return len(strata)
+
+
+def allocate(total, capacities, rng=random):
+    """
+    split `total` as evenly as possible between strata of `capacities` items, the share
+    a small stratum cannot take goes to the others.
+    return: number of items to sample in each stratum
+    """
+    counts = [0] * len(capacities)
+    remaining = min(total, sum(capacities))
+    # smallest strata first, ties in random order, so the rounding is not biased
+    order = sorted(range(len(capacities)), key=lambda i: (capacities[i], rng.random()))
+    for n_left, i in zip(range(len(order), 0, -1), order):
+        counts[i] = min(capacities[i], -(-remaining // n_left))
+        remaining -= counts[i]
+    return counts
+
+
+def stratified_sample(strata, total, seed=0):
+    """
+    strata: nested dicts of strata, eg: {script: {work: {volume: [pages]}}}
+    return: `total` items, split evenly at every level of the strata, the same for a seed
+    """
+    rng = random.Random(seed)
+
+    def sample(strata, total):
+        if not isinstance(strata, dict):
+            return rng.sample(sorted(strata), min(total, len(strata)))
+        keys = sorted(strata)
+        counts = allocate(total, [count_items(strata[key]) for key in keys], rng)
+        items = []
+        for key, count in zip(keys, counts):
+            if count:
+                items += sample(strata[key], count)
+        return items
+
+    return sample(strata, total)
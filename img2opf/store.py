@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+from . import config
+
+
+class PageStore:
+    """
+    sqlite database of the gzipped ocr outputs of a host, keyed by (work, imagegroup, page),
+    and of the pipeline state as key/value. It replaces one .json.gz file per page, files
+    are only exported when a tool needs them, like the OPF formatter.
+    The store can be shared by threads.
+    """
+
+    def __init__(self, path=config.PAGE_STORE_PATH):
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "work TEXT, imagegroup TEXT, page TEXT, output BLOB, "
+                "PRIMARY KEY (work, imagegroup, page)) WITHOUT ROWID"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    def exists(self, work, imagegroup, page):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM pages WHERE work=? AND imagegroup=? AND page=?",
+                (work, imagegroup, page),
+            ).fetchone()
+        return row is not None
+
+    def pages(self, work, imagegroup):
+        """
+        return: set of the pages of the volume in the store
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT page FROM pages WHERE work=? AND imagegroup=?",
+                (work, imagegroup),
+            ).fetchall()
+        return {page for page, in rows}
+
+    def get(self, work, imagegroup, page):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT output FROM pages WHERE work=? AND imagegroup=? AND page=?",
+                (work, imagegroup, page),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, work, imagegroup, page, output):
+        self.put_many([(work, imagegroup, page, output)])
+
+    def put_many(self, rows):
+        """
+        rows: (work, imagegroup, page, gzipped ocr output), written in one transaction
+        """
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", rows
+            )
+
+    def iter_volume(self, work, imagegroup):
+        """
+        yield (page, gzipped ocr output) of the volume in page order
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT page, output FROM pages WHERE work=? AND imagegroup=? ORDER BY page",
+                (work, imagegroup),
+            ).fetchall()
+        yield from rows
+
+    def imagegroups(self, work):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT imagegroup FROM pages WHERE work=?", (work,)
+            ).fetchall()
+        return [imagegroup for imagegroup, in rows]
+
+    def export_work(self, work, output_base_dir):
+        """
+        write the pages of the work as output_base_dir/work/imagegroup/page.json.gz
+        """
+        for imagegroup in self.imagegroups(work):
+            vol_dir = Path(output_base_dir) / work / imagegroup
+            vol_dir.mkdir(exist_ok=True, parents=True)
+            for page, output in self.iter_volume(work, imagegroup):
+                (vol_dir / f"{page}.json.gz").write_bytes(output)
+
+    def delete_work(self, work):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM pages WHERE work=?", (work,))
+
+    def get_state(self, key, default=None):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM state WHERE key=?", (key,)
+            ).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key, value):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (key, value))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,158 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import grpc
+from google.api_core import exceptions
+from google.cloud import vision
+
+from . import config
+
+# errors after which a request is sent to another client
+QUOTA_ERRORS = (exceptions.ResourceExhausted,)
+TRANSIENT_ERRORS = (
+    exceptions.ServiceUnavailable,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+)
+
+
+class PoolMember:
+    """
+    a vision client with its quota budget, requests per minute over a sliding window,
+    and health: after an error it is not used until `available_at`.
+    """
+
+    def __init__(self, name, client, quota_per_minute=config.VISION_QUOTA_PER_MINUTE):
+        self.name = name
+        self.client = client
+        self.quota_per_minute = quota_per_minute
+        self.requests = deque()
+        self.in_flight = 0
+        self.available_at = 0
+        self.failures = 0
+
+    def usable_at(self, now):
+        """
+        return: time from which the member can take a request
+        """
+        while self.requests and self.requests[0] <= now - 60:
+            self.requests.popleft()
+        quota_at = (
+            self.requests[0] + 60
+            if self.quota_per_minute and len(self.requests) >= self.quota_per_minute
+            else now
+        )
+        return max(self.available_at, quota_at)
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.in_flight} in flight, {len(self.requests)} requests/min, "
+            f"{self.failures} failures"
+        )
+
+
+class VisionClientPool:
+    """
+    spreads the requests over clients of several credentials or endpoints, each with
+    its own quota. A request goes to the usable client with the least requests in
+    flight. On quota exhaustion a client rests for `cooldown` seconds, on transient
+    errors for an exponential backoff, and the request fails over to another client.
+    """
+
+    def __init__(
+        self,
+        members,
+        cooldown=config.VISION_COOLDOWN,
+        backoff=config.VISION_BACKOFF,
+        max_attempts=None,
+    ):
+        self.members = members
+        self.cooldown = cooldown
+        self.backoff = backoff
+        self.max_attempts = max_attempts or 2 * len(members)
+        self._cond = threading.Condition()
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                now = time.time()
+                usable = [m for m in self.members if m.usable_at(now) <= now]
+                if usable:
+                    member = min(usable, key=lambda m: m.in_flight)
+                    member.in_flight += 1
+                    member.requests.append(now)
+                    return member
+                wait_until = min(m.usable_at(now) for m in self.members)
+                self._cond.wait(max(wait_until - now, 0.01))
+
+    def _release(self, member, error=None):
+        with self._cond:
+            member.in_flight -= 1
+            if error is None:
+                member.failures = 0
+            elif isinstance(error, QUOTA_ERRORS):
+                member.failures += 1
+                member.available_at = time.time() + self.cooldown
+            else:
+                member.failures += 1
+                member.available_at = time.time() + self.backoff * 2 ** min(
+                    member.failures - 1, 6
+                )
+            self._cond.notify_all()
+
+    def document_text_detection(self, image, **kwargs):
+        for attempt in range(self.max_attempts):
+            member = self._acquire()
+            try:
+                response = member.client.document_text_detection(image=image, **kwargs)
+            except QUOTA_ERRORS + TRANSIENT_ERRORS as e:
+                self._release(member, e)
+                logging.warning(f"Vision client {member.name} failed: {e}")
+                if attempt == self.max_attempts - 1:
+                    raise
+                continue
+            except Exception:
+                self._release(member)
+                raise
+            self._release(member)
+            return response
+
+    def __str__(self):
+        return ", ".join(str(member) for member in self.members)
+
+
+def parse_spec(spec):
+    """
+    "path_or_endpoint" or "path_or_endpoint=quota per minute"
+    return: (path_or_endpoint, quota)
+    """
+    target, _, quota = spec.partition("=")
+    return target, int(quota) if quota else config.VISION_QUOTA_PER_MINUTE
+
+
+def get_vision_pool(credentials=None, endpoints=None):
+    """
+    pool of clients from service account files (VISION_CREDENTIALS) and plain grpc
+    endpoints, eg: local stand-ins (VISION_ENDPOINTS), both comma separated.
+    Without any, a single client with the default credentials.
+    """
+    if credentials is None:
+        credentials = [c for c in os.environ.get("VISION_CREDENTIALS", "").split(",") if c]
+    if endpoints is None:
+        endpoints = [e for e in os.environ.get("VISION_ENDPOINTS", "").split(",") if e]
+
+    members = []
+    for spec in credentials:
+        path, quota = parse_spec(spec)
+        client = vision.ImageAnnotatorClient.from_service_account_file(path)
+        members.append(PoolMember(os.path.basename(path), client, quota))
+    for spec in endpoints:
+        endpoint, quota = parse_spec(spec)
+        client = vision.ImageAnnotatorClient(channel=grpc.insecure_channel(endpoint))
+        members.append(PoolMember(endpoint, client, quota))
+    if not members:
+        members.append(PoolMember("default", vision.ImageAnnotatorClient()))
+    return VisionClientPool(members)
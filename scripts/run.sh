@@ -1,6 +1,11 @@
 # run OCR
 rm -rf output/
-python3 Google-OCR/usage/bdrc/bdrc_ocr.py
+python3 Google-OCR/usage/bdrc/catalog_worker.py &
+python3 Google-OCR/usage/bdrc/bdrc_ocr.py &
+OCR_PID=$!
+# forward the preemption SIGTERM so bdrc_ocr.py drains and hands off its volume
+trap 'kill -TERM $OCR_PID; wait $OCR_PID' TERM
+wait $OCR_PID
 
 # cmd
 # ( nohup sh run.sh 2>&1 | ts '[%Y-%m-%d %H:%M:%S]' ) >> nohup.log &
@@ -13,6 +13,9 @@ setup(
             "boto3==1.16.41",
             "slack-sdk==3.1.0",
             "Pillow==8.0.1",
+            "numpy",
+            "rdflib",
+            "requests",
         ]
     },
 )
@@ -0,0 +1,5 @@
+import os
+
+# img2opf.ocr creates its vision clients at import, a stand-in endpoint needs no
+# credentials and is never called by the tests, which stub google_ocr
+os.environ.setdefault("VISION_ENDPOINTS", "127.0.0.1:9")
@@ -0,0 +1,104 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from img2opf.iiif import fetch_iiif_image, get_iiif_session, get_iiif_url
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    stand-in IIIF server: the first `failures` requests of a path get a 503, paths
+    starting with /slow answer after `delay` seconds.
+    """
+
+    failures = 0
+    delay = 0
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path.startswith("/slow"):
+            time.sleep(self.delay)
+        if self.requests.count(self.path) <= self.failures:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = b"image of " + self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StandInHandler.failures = 0
+    StandInHandler.delay = 0
+    StandInHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_get_iiif_url():
+    url = get_iiif_url(
+        "bdr:V22084_I0886",
+        "I08860003.tif",
+        size="!2000,2000",
+        fmt="png",
+        base_url="https://iiif.example.org",
+    )
+    assert (
+        url
+        == "https://iiif.example.org/bdr:V22084_I0886::I08860003.tif/full/!2000,2000/0/default.png"
+    )
+
+
+def test_get_iiif_url_defaults():
+    url = get_iiif_url("bdr:V22084_I0886", "I08860003.tif")
+    assert url == (
+        "https://iiif.bdrc.io/bdr:V22084_I0886::I08860003.tif/full/!3000,3000/0/default.jpg"
+    )
+
+
+def test_fetch_iiif_image(server):
+    url = get_iiif_url("bdr:V1_I1", "I1.tif", base_url=server)
+    content = fetch_iiif_image(get_iiif_session(), url)
+    assert content == f"image of {StandInHandler.requests[0]}".encode()
+    assert StandInHandler.requests == ["/bdr:V1_I1::I1.tif/full/!3000,3000/0/default.jpg"]
+
+
+def test_fetch_iiif_image_retries_server_errors(server):
+    StandInHandler.failures = 2
+    url = get_iiif_url("bdr:V1_I1", "I1.tif", base_url=server)
+    content = fetch_iiif_image(get_iiif_session(retries=3), url)
+    assert content.startswith(b"image of ")
+    assert len(StandInHandler.requests) == 3
+
+
+def test_fetch_iiif_image_gives_up_after_retries(server):
+    StandInHandler.failures = 10
+    url = get_iiif_url("bdr:V1_I1", "I1.tif", base_url=server)
+    with pytest.raises(requests.RequestException):
+        fetch_iiif_image(get_iiif_session(retries=1), url)
+    assert len(StandInHandler.requests) == 2
+
+
+def test_fetch_iiif_image_timeout(server):
+    StandInHandler.delay = 2
+    url = get_iiif_url("bdr:V1_I1", "I1.tif", base_url=f"{server}/slow")
+    start = time.time()
+    with pytest.raises(requests.RequestException):
+        fetch_iiif_image(get_iiif_session(retries=0), url, timeout=0.2)
+    assert time.time() - start < 1.5
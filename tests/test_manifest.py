@@ -0,0 +1,84 @@
+import gzip
+
+from img2opf.manifest import build_manifest, get_changed_pages, get_md5
+
+
+def get_outputs(texts, ocr_timestamp="2021-01-01T00:00:00"):
+    return [(page, gzip.compress(text.encode()), ocr_timestamp) for page, text in texts]
+
+
+def test_build_manifest():
+    outputs = get_outputs([("I0001", "a"), ("I0002", "b")])
+    manifest = build_manifest(
+        "W1", "I1", outputs, "prefix/output", "vision", timestamp="2021-02-01T00:00:00"
+    )
+    assert manifest["work"] == "W1"
+    assert manifest["imagegroup"] == "I1"
+    assert manifest["timestamp"] == "2021-02-01T00:00:00"
+    assert manifest["pages"]["I0001"] == {
+        "key": "prefix/output/I0001.json.gz",
+        "size": len(outputs[0][1]),
+        "md5": get_md5(outputs[0][1]),
+        "ocr_timestamp": "2021-01-01T00:00:00",
+        "engine": "vision",
+    }
+    assert list(manifest["pages"]) == ["I0001", "I0002"]
+
+
+def test_build_manifest_unknown_ocr_timestamp():
+    outputs = get_outputs([("I0001", "a")], ocr_timestamp=None)
+    manifest = build_manifest("W1", "I1", outputs, "p", "vision", "2021-02-01T00:00:00")
+    assert manifest["pages"]["I0001"]["ocr_timestamp"] == "2021-02-01T00:00:00"
+
+
+def test_build_manifest_keeps_unchanged_pages():
+    previous = build_manifest(
+        "W1", "I1", get_outputs([("I0001", "a"), ("I0002", "b")]), "p", "old", "t0"
+    )
+    outputs = get_outputs([("I0001", "a"), ("I0002", "b2")], "2021-03-01T00:00:00")
+    manifest = build_manifest("W1", "I1", outputs, "p", "new", "t1", previous=previous)
+    assert manifest["pages"]["I0001"] == previous["pages"]["I0001"]
+    assert manifest["pages"]["I0002"]["engine"] == "new"
+    assert manifest["pages"]["I0002"]["ocr_timestamp"] == "2021-03-01T00:00:00"
+    assert manifest["pages"]["I0002"]["md5"] == get_md5(outputs[1][1])
+
+
+def test_get_changed_pages(tmp_path):
+    outputs = get_outputs([("I0001", "a"), ("I0002", "b"), ("I0003", "c")])
+    manifest = build_manifest("W1", "I1", outputs, "p", "vision", "t")
+    (tmp_path / "I0001.json.gz").write_bytes(outputs[0][1])
+    changed = gzip.compress(b"b changed")
+    (tmp_path / "I0002.json.gz").write_bytes(changed)
+    assert get_changed_pages(manifest, tmp_path) == {
+        "I0002": get_md5(changed),
+        "I0003": None,
+    }
+
+
+def test_get_changed_pages_in_sync(tmp_path):
+    outputs = get_outputs([("I0001", "a")])
+    manifest = build_manifest("W1", "I1", outputs, "p", "vision", "t")
+    (tmp_path / "I0001.json.gz").write_bytes(outputs[0][1])
+    assert get_changed_pages(manifest, tmp_path) == {}
+
+
+def test_build_manifest_partial_volume():
+    previous = build_manifest(
+        "W1", "I1", get_outputs([("p1", "a"), ("p2", "b"), ("p3", "c")]), "p", "v", "t0"
+    )
+    outputs = get_outputs([("p3", "c2")])
+    manifest = build_manifest("W1", "I1", outputs, "p", "v", "t1", previous=previous)
+    assert list(manifest["pages"]) == ["p1", "p2", "p3"]
+    assert manifest["pages"]["p1"] == previous["pages"]["p1"]
+    assert manifest["pages"]["p3"]["md5"] == get_md5(outputs[0][1])
+
+
+def test_build_manifest_drops_pages_not_archived():
+    previous = build_manifest(
+        "W1", "I1", get_outputs([("p1", "a"), ("p2", "b"), ("p3", "c")]), "p", "v", "t0"
+    )
+    outputs = get_outputs([("p3", "c")])
+    manifest = build_manifest(
+        "W1", "I1", outputs, "p", "v", "t1", previous=previous, archived={"p1", "p3"}
+    )
+    assert list(manifest["pages"]) == ["p1", "p3"]
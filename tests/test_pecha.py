@@ -0,0 +1,150 @@
+import gzip
+import io
+import json
+import threading
+import time
+
+from PIL import Image
+
+from img2opf import pecha
+from img2opf.pecha import IIIFSource, LocalPecha, LocalSink, LocalSource, Volume
+
+
+def get_png(width, height):
+    out = io.BytesIO()
+    Image.new("L", (width, height), 255).save(out, format="png")
+    return out.getvalue()
+
+
+def get_response(x, y):
+    return {
+        "textAnnotations": [
+            {"description": "text", "boundingPoly": {"vertices": [{"x": x, "y": y}]}}
+        ],
+        "fullTextAnnotation": {"pages": [{"width": 0, "height": 0}]},
+    }
+
+
+class MemorySink:
+    def __init__(self):
+        self.saved = {}
+
+    def exists(self, filename):
+        return filename in self.saved
+
+    def save(self, filename, response, image=None):
+        self.saved[filename] = (response, image)
+
+    def close(self):
+        pass
+
+
+def test_iiif_responses_in_original_pixels(monkeypatch):
+    monkeypatch.setattr(pecha, "fetch_iiif_image", lambda session, url: get_png(100, 50))
+    monkeypatch.setattr(pecha, "google_ocr", lambda image: get_response(10, 20))
+    source = IIIFSource(
+        "bdr:V1_I1",
+        ["I0001.tif", "I0002.tif"],
+        session=object(),
+        orig_sizes={"I0001.tif": (200, 100), "I0002.tif": (100, 50)},
+    )
+    sink = MemorySink()
+    with pecha.ThreadPoolExecutor(max_workers=2) as executor:
+        assert Volume("I1", source, sink).ocr(executor) == 2
+
+    response, image = sink.saved["I0001.jpg"]
+    assert response["textAnnotations"][0]["boundingPoly"]["vertices"] == [
+        {"x": 20, "y": 40}
+    ]
+    assert response["fullTextAnnotation"]["pages"][0]["width"] == 200
+    assert response["fullTextAnnotation"]["pages"][0]["height"] == 100
+    # a resized page image is not archived
+    assert image is None
+
+    # a page served at its original size is kept as is
+    response, image = sink.saved["I0002.jpg"]
+    assert response["textAnnotations"][0]["boundingPoly"]["vertices"] == [
+        {"x": 10, "y": 20}
+    ]
+    assert image == get_png(100, 50)
+
+
+def save_pages(path, names):
+    path.mkdir(parents=True)
+    for name in names:
+        (path / f"{name}.png").write_bytes(get_png(10, 10))
+
+
+def read_output(path):
+    return json.loads(gzip.decompress(path.read_bytes()))
+
+
+def test_local_volume_skips_existing_outputs(tmp_path, monkeypatch):
+    save_pages(tmp_path / "images", ["I0001", "I0002"])
+    sink = LocalSink(tmp_path / "output")
+    sink.save("I0001.png", {"old": True})
+    calls = []
+
+    def ocr(image):
+        calls.append(image)
+        return get_response(1, 1)
+
+    monkeypatch.setattr(pecha, "google_ocr", ocr)
+    volume = Volume("images", LocalSource(tmp_path / "images"), sink)
+    with pecha.ThreadPoolExecutor(max_workers=2) as executor:
+        assert volume.ocr(executor) == 1
+    assert len(calls) == 1
+    assert read_output(tmp_path / "output" / "I0001.json.gz") == {"old": True}
+    assert "textAnnotations" in read_output(tmp_path / "output" / "I0002.json.gz")
+
+
+def test_local_volume_page_errors_are_isolated(tmp_path, monkeypatch):
+    save_pages(tmp_path / "images", ["I0001", "I0002", "I0003"])
+    failing_page = get_png(20, 20)
+    (tmp_path / "images" / "I0002.png").write_bytes(failing_page)
+
+    def ocr(image):
+        if image == failing_page:
+            raise ValueError("vision error")
+        return get_response(1, 1)
+
+    monkeypatch.setattr(pecha, "google_ocr", ocr)
+    volume = Volume(
+        "images", LocalSource(tmp_path / "images"), LocalSink(tmp_path / "output")
+    )
+    with pecha.ThreadPoolExecutor(max_workers=2) as executor:
+        assert volume.ocr(executor) == 2
+    # a failed page has no output and is OCRed again by the next run
+    assert sorted(fn.name for fn in (tmp_path / "output").iterdir()) == [
+        "I0001.json.gz",
+        "I0003.json.gz",
+    ]
+
+
+def test_local_pecha_volumes_share_the_executor(tmp_path, monkeypatch):
+    for vol in ["I1", "I2", "I3"]:
+        save_pages(tmp_path / "images" / vol, ["I0001", "I0002"])
+    lock = threading.Lock()
+    running, max_running = [0], [0]
+
+    def ocr(image):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return get_response(1, 1)
+
+    monkeypatch.setattr(pecha, "google_ocr", ocr)
+    n_pages = LocalPecha(
+        images_dir=tmp_path / "images",
+        output_dir=tmp_path / "output",
+        parallelism=3,
+        ocr_workers=2,
+    ).ocr()
+    assert n_pages == {"I1": 2, "I2": 2, "I3": 2}
+    # the 3 volumes run at once but their pages share the 2 ocr workers
+    assert max_running[0] == 2
+    for vol in ["I1", "I2", "I3"]:
+        assert len(list((tmp_path / "output" / vol).glob("*.json.gz"))) == 2
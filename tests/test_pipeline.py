@@ -0,0 +1,45 @@
+from img2opf.pipeline import AdaptiveLimiter
+
+
+def run_calls(limiter, n_calls, latency, error=False):
+    for _ in range(n_calls):
+        limiter.acquire()
+        limiter.release(latency, error)
+
+
+def get_limiter():
+    limiter = AdaptiveLimiter("test", initial=8, max_limit=16)
+    # callers are always queued, the limit may grow
+    limiter.waiting = 1
+    return limiter
+
+
+def test_limit_grows_at_normal_latency():
+    limiter = get_limiter()
+    run_calls(limiter, 200, 0.1)
+    assert limiter.limit == 16
+
+
+def test_limit_decreases_on_errors():
+    limiter = get_limiter()
+    run_calls(limiter, 50, 0.1, error=True)
+    assert limiter.limit == 1
+    assert limiter.errors == 50
+
+
+def test_limit_recovers_after_latency_shift():
+    limiter = get_limiter()
+    run_calls(limiter, 200, 0.1)
+    run_calls(limiter, 50, 0.35)
+    assert limiter.limit < 16
+    # the slower latency becomes the baseline and the limit grows again
+    run_calls(limiter, 500, 0.35)
+    assert limiter.limit == 16
+    assert limiter.best_latency > 0.35 / limiter.tolerance
+
+
+def test_limit_recovers_after_errors():
+    limiter = get_limiter()
+    run_calls(limiter, 50, 0.1, error=True)
+    run_calls(limiter, 500, 0.1)
+    assert limiter.limit == 16
@@ -0,0 +1,34 @@
+import numpy as np
+
+from img2opf.preprocess import find_content_box
+
+
+def get_page(width=400, height=300):
+    """
+    white page with a block of text-like ink in (100, 100, 300, 200)
+    """
+    gray = np.full((height, width), 255, dtype=np.uint8)
+    block = gray[100:200, 100:300]
+    block[::2, ::2] = 0
+    return gray
+
+
+def test_find_content_box():
+    assert find_content_box(get_page(), pad=0) == (100, 100, 299, 199)
+
+
+def test_find_content_box_vertical_border():
+    gray = get_page()
+    gray[:, :20] = 0
+    assert find_content_box(gray, pad=0) == (100, 100, 299, 199)
+
+
+def test_find_content_box_horizontal_border():
+    gray = get_page()
+    gray[-20:] = 0
+    assert find_content_box(gray, pad=0) == (100, 100, 299, 199)
+
+
+def test_find_content_box_blank_page():
+    gray = np.full((300, 400), 255, dtype=np.uint8)
+    assert find_content_box(gray) == (0, 0, 400, 300)
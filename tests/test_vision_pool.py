@@ -0,0 +1,178 @@
+import threading
+import time
+from concurrent import futures
+
+import grpc
+import pytest
+from google.api_core import exceptions
+from google.cloud.vision import types
+from google.cloud.vision_v1.proto import image_annotator_pb2
+
+from img2opf.vision_pool import PoolMember, VisionClientPool, get_vision_pool, parse_spec
+
+
+class FakeClient:
+    """
+    vision client raising the given errors in turn, then answering with its name
+    """
+
+    def __init__(self, name, errors=(), delay=0):
+        self.name = name
+        self.errors = list(errors)
+        self.delay = delay
+        self.calls = 0
+
+    def document_text_detection(self, image, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.name
+
+
+def get_pool(*clients, quota_per_minute=None, **kwargs):
+    members = [PoolMember(client.name, client, quota_per_minute) for client in clients]
+    return VisionClientPool(members, **kwargs)
+
+
+def test_failover_on_quota_exhausted():
+    a = FakeClient("a", [exceptions.ResourceExhausted("quota")])
+    b = FakeClient("b")
+    pool = get_pool(a, b, cooldown=60)
+    start = time.time()
+    assert pool.document_text_detection(image=None) == "b"
+    member_a = pool.members[0]
+    assert member_a.failures == 1
+    assert member_a.available_at >= start + 60
+    # a rests for its cooldown, the next requests go to b
+    assert pool.document_text_detection(image=None) == "b"
+    assert a.calls == 1 and b.calls == 2
+
+
+def test_failover_on_service_unavailable_with_backoff():
+    a = FakeClient("a", [exceptions.ServiceUnavailable("503")] * 2)
+    b = FakeClient("b")
+    pool = get_pool(a, b, backoff=2)
+    start = time.time()
+    assert pool.document_text_detection(image=None) == "b"
+    member_a = pool.members[0]
+    assert start + 2 <= member_a.available_at < start + 3
+
+    # the backoff doubles with the consecutive failures
+    member_a.available_at = 0
+    pool.members[1].in_flight = 1
+    start = time.time()
+    assert pool.document_text_detection(image=None) == "b"
+    assert member_a.failures == 2
+    assert start + 4 <= member_a.available_at < start + 5
+
+
+def test_single_client_retried_after_cooldown():
+    a = FakeClient("a", [exceptions.ResourceExhausted("quota")])
+    pool = get_pool(a, cooldown=0.2)
+    start = time.time()
+    assert pool.document_text_detection(image=None) == "a"
+    assert time.time() - start >= 0.2
+    assert a.calls == 2
+    assert pool.members[0].failures == 0
+
+
+def test_gives_up_after_max_attempts():
+    a = FakeClient("a", [exceptions.ServiceUnavailable("503")] * 3)
+    pool = get_pool(a, backoff=0.01, max_attempts=2)
+    with pytest.raises(exceptions.ServiceUnavailable):
+        pool.document_text_detection(image=None)
+    assert a.calls == 2
+    assert pool.members[0].in_flight == 0
+
+
+def test_other_errors_are_not_retried():
+    a = FakeClient("a", [exceptions.InvalidArgument("bad image")])
+    b = FakeClient("b")
+    pool = get_pool(a, b)
+    with pytest.raises(exceptions.InvalidArgument):
+        pool.document_text_detection(image=None)
+    assert b.calls == 0
+    assert pool.members[0].in_flight == 0
+    assert pool.members[0].available_at == 0
+
+
+def test_least_loaded_member():
+    a = FakeClient("a")
+    b = FakeClient("b")
+    pool = get_pool(a, b)
+    pool.members[0].in_flight = 2
+    pool.members[1].in_flight = 1
+    assert pool.document_text_detection(image=None) == "b"
+    pool.members[0].in_flight = 0
+    assert pool.document_text_detection(image=None) == "a"
+
+
+def test_concurrent_requests_spread_over_members():
+    clients = [FakeClient(name, delay=0.1) for name in "abc"]
+    pool = get_pool(*clients)
+    threads = [
+        threading.Thread(target=pool.document_text_detection, kwargs={"image": None})
+        for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [client.calls for client in clients] == [2, 2, 2]
+
+
+def test_quota_per_minute():
+    a = FakeClient("a")
+    b = FakeClient("b")
+    pool = get_pool(a, b, quota_per_minute=2)
+    results = [pool.document_text_detection(image=None) for _ in range(4)]
+    assert sorted(results) == ["a", "a", "b", "b"]
+    now = time.time()
+    assert all(member.usable_at(now) > now + 59 for member in pool.members)
+
+
+def test_parse_spec():
+    assert parse_spec("project-a.json=600") == ("project-a.json", 600)
+    assert parse_spec("localhost:50051")[0] == "localhost:50051"
+
+
+class StandInImageAnnotator(grpc.GenericRpcHandler):
+    """
+    stand-in vision endpoint answering every page with the text "stand-in"
+    """
+
+    method = "/google.cloud.vision.v1.ImageAnnotator/BatchAnnotateImages"
+
+    def service(self, handler_call_details):
+        if handler_call_details.method != self.method:
+            return None
+        return grpc.unary_unary_rpc_method_handler(
+            self.annotate,
+            request_deserializer=image_annotator_pb2.BatchAnnotateImagesRequest.FromString,
+            response_serializer=image_annotator_pb2.BatchAnnotateImagesResponse.SerializeToString,
+        )
+
+    def annotate(self, request, context):
+        response = image_annotator_pb2.BatchAnnotateImagesResponse()
+        for _ in request.requests:
+            page = response.responses.add()
+            page.full_text_annotation.text = "stand-in"
+        return response
+
+
+@pytest.fixture
+def endpoint():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    server.add_generic_rpc_handlers([StandInImageAnnotator()])
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    yield f"127.0.0.1:{port}"
+    server.stop(None)
+
+
+def test_pool_of_stand_in_endpoint(endpoint):
+    pool = get_vision_pool(credentials=[], endpoints=[f"{endpoint}=10"])
+    assert [(m.name, m.quota_per_minute) for m in pool.members] == [(endpoint, 10)]
+    response = pool.document_text_detection(image=types.Image(content=b"image"))
+    assert response.full_text_annotation.text == "stand-in"
@@ -4,34 +4,59 @@ import faulthandler
 faulthandler.enable()
 
 import gzip
-import hashlib
 import io
 import json
 import logging
 import os
 import shutil
+import signal
 import socket
 import sys
+import threading
+import time
 import traceback
-from collections import defaultdict
+import tracemalloc
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager, nullcontext
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 
 import boto3
 import botocore
 import pytz
-import rdflib
 import requests
-from github.GithubException import GithubException
-# from img2opf.notifier import slack_notifier
-from img2opf.ocr import google_ocr
+from img2opf.bdrc import (
+    ARCHIVE_BUCKET,
+    BATCH_PREFIX,
+    IMAGES,
+    INFO_FN,
+    OCR_OUTPUT_BUCKET,
+    OUTPUT,
+    PAGE_INDEX,
+    SERVICE,
+    get_s3_image_list,
+    get_s3_prefix_path,
+    get_volume_infos,
+)
+from img2opf.iiif import fetch_iiif_image, get_iiif_session, get_iiif_url
+from img2opf.layout import PageIndex
+from img2opf.manifest import MANIFEST_FN, build_manifest, get_changed_pages, get_md5
+from img2opf.notifier import BatchNotifier, start_queue_logging
+from img2opf.ocr import OCR_ENGINE, google_ocr
+from img2opf.pipeline import AdaptiveLimiter, MemoryBudget
+from img2opf.preprocess import (
+    get_resize_transform,
+    map_response_to_original,
+    preprocess_image,
+)
+from img2opf.profiling import dump_state, profiled
+from img2opf.store import PageStore
 from openpecha.catalog.manager import CatalogManager
 from openpecha.formatters import GoogleOCRFormatter
-from openpecha.github_utils import delete_repo
 from PIL import Image as PillowImage
 from PIL import ImageOps
-from rdflib import URIRef
-from rdflib.namespace import Namespace, NamespaceManager
 from wand.image import Image as WandImage
 
 # Host config
@@ -39,30 +64,23 @@ HOSTNAME = socket.gethostname()
 
 # S3 config
 os.environ["AWS_SHARED_CREDENTIALS_FILE"] = "~/.aws/credentials"
-ARCHIVE_BUCKET = "archive.tbrc.org"
-OCR_OUTPUT_BUCKET = "ocr.bdrc.io"
 S3 = boto3.resource("s3")
 S3_client = boto3.client("s3")
 archive_bucket = S3.Bucket(ARCHIVE_BUCKET)
 ocr_output_bucket = S3.Bucket(OCR_OUTPUT_BUCKET)
 
-# URI config
-BDR = Namespace("http://purl.bdrc.io/resource/")
-NSM = NamespaceManager(rdflib.Graph())
-NSM.bind("bdr", BDR)
-
-# s3 bucket directory config
-SERVICE = "vision"
-BATCH_PREFIX = "batch"
-IMAGES = "images"
-OUTPUT = "output"
-INFO_FN = "info.json"
-
 # local directory config
 DATA_PATH = Path("./archive")
 IMAGES_BASE_DIR = DATA_PATH / IMAGES
 OCR_BASE_DIR = DATA_PATH / OUTPUT
 CHECK_POINT_FN = DATA_PATH / "checkpoint.json"
+CATALOG_QUEUE_DIR = DATA_PATH / "catalog_queue"
+CATALOG_FAILED_DIR = CATALOG_QUEUE_DIR / "failed"
+METADATA_CACHE_DIR = DATA_PATH / "cache"
+INDEX_BASE_DIR = DATA_PATH / PAGE_INDEX
+PROGRESS_FN = "progress.json"
+RATES_FN = DATA_PATH / "rates.jsonl"
+PROFILE_DIR = DATA_PATH / "profiles"
 
 # Checkpoint config
 CHECK_POINT = defaultdict(list)
@@ -72,106 +90,184 @@ VOL = "imagegroup"
 last_work = None
 last_vol = None
 
-# notifier config
-# notifier = slack_notifier
+# notifier config, messages are batched and posted to slack in the background
+NOTIFIER = {"status": False}
+slack_notifier = None
 
 # openpecha opf setup
 catalog = CatalogManager(formatter=GoogleOCRFormatter())
 
-# logging config
-logging.basicConfig(
-    filename="bdrc_ocr.log",
-    format="%(asctime)s, %(levelname)s: %(message)s",
-    datefmt="%m/%d/%Y %I:%M:%S %p",
-    level=logging.INFO,
+# logging config, when run as a script records are written to the file by a listener
+# thread. Scripts importing this module, which may fork worker processes, write directly.
+log_handler = logging.FileHandler("bdrc_ocr.log")
+log_handler.setFormatter(
+    logging.Formatter(
+        "%(asctime)s, %(levelname)s: %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p"
+    )
 )
+logging.basicConfig(handlers=[log_handler], level=logging.INFO)
+log_listener = None
 
 # Debug config
 DEBUG = {"status": False}
 
+# Image source config, "s3" for the masters of the archive bucket or "iiif" for
+# images resized by the IIIF server
+IMAGE_SOURCE = {"name": "s3", "size": "!3000,3000", "format": "jpg", "workers": 16}
+iiif_session = get_iiif_session(IMAGE_SOURCE["workers"])
 
-def notifier(msg):
-    logging.info(msg)
+# Page store config, ocr outputs and checkpoint are kept in a sqlite database
+# instead of one file per page
+PAGE_STORE = {"status": False, "path": DATA_PATH / "pages.sqlite", "batch_size": 50}
+page_store = None
 
+# Layout index config, a word box index is saved with every ocr output
+INDEX = {"status": False}
 
-def get_value(json_node):
-    if json_node["type"] == "literal":
-        return json_node["value"]
-    else:
-        return NSM.qname(URIRef(json_node["value"]))
+# Streaming config, pages go from s3 through google vision back to s3 in memory
+STREAM = {
+    "status": False,
+    "workers": 16,
+    "memory_budget": 512 * 1024 ** 2,
+    "page_estimate": 8 * 1024 ** 2,
+}
+
+# Adaptive concurrency config, in --stream mode each stage of a page gets its own
+# limit tuned from its latency and errors, up to `max_limit`. The stream workers are
+# then as many as `max_limit`, the limits decide how many of them are busy in a stage.
+ADAPTIVE = {"status": False, "initial": 4, "max_limit": 64}
+STAGES = ["get", "convert", "ocr", "put"]
+limiters = {}
 
 
-def get_s3_image_list(volume_prefix_url):
+def stage(name):
     """
-    returns the content of the dimension.json file for a volume ID, accessible at:
-    https://iiifpres.bdrc.io/il/v:bdr:V22084_I0888 for volume ID bdr:V22084_I0888
+    return: context in which a page runs the stage `name` under its adaptive limit
     """
-    r = requests.get(f"https://iiifpres.bdrc.io/il/v:{volume_prefix_url}")
-    if r.status_code != 200:
-        logging.error(
-            f"Volume Images list Error: No images found for volume {volume_prefix_url}: status code: {r.status_code}"
-        )
-        return {}
-    return r.json()
+    if name in limiters:
+        return limiters[name]()
+    return nullcontext()
+
+# Preprocessing config, pages are trimmed, grayscaled and downscaled before OCR
+PREPROCESS = {"status": False, "trim": True, "grayscale": True, "max_long_edge": 3000}
 
 
-def get_volume_infos(work_prefix_url):
+def notifier(msg):
+    logging.info(msg)
+    if slack_notifier:
+        slack_notifier.notify(msg)
+
+
+# Profiling config, every Nth volume is profiled in PROFILE_DIR and SIGUSR1 dumps
+# the stacks and top allocations there, without stopping the run
+PROFILE = {"every": 0, "volumes": 0, "active": False, "dump_requested": False}
+profile_lock = threading.Lock()
+
+
+def profile_volume(work_local_id, imagegroup):
     """
-    the input is something like bdr:W22084, the output is a list like:
-    [
-      {
-        "vol_num": 1,
-        "volume_prefix_url": "bdr:V22084_I0886",
-        "imagegroup": "I0886"
-      },
-      ...
-    ]
+    return: context profiling the volume if it is an Nth one. In the page queue the
+    volumes overlap, an Nth volume starting while another one is profiled is not.
     """
-    r = requests.get(
-        f"http://purl.bdrc.io/query/table/volumesForWork?R_RES={work_prefix_url}&format=json&pageSize=500"
-    )
-    if r.status_code != 200:
-        logging.error(
-            f"Volume Info Error: No info found for Work {work_prefix_url}: status code: {r.status_code}"
-        )
-        return
-    # the result of the query is already in ascending volume order
-    res = r.json()
-    for b in res["results"]["bindings"]:
-        volume_prefix_url = NSM.qname(URIRef(b["volid"]["value"]))
-        yield {
-            "vol_num": get_value(b["volnum"]),
-            "volume_prefix_url": volume_prefix_url,
-            "imagegroup": volume_prefix_url[4:],
-        }
+    PROFILE["volumes"] += 1
+    if PROFILE["active"]:
+        return nullcontext()
+    if PROFILE["every"] and PROFILE["volumes"] % PROFILE["every"] == 0:
+        return profiled_volume(PROFILE_DIR / f"{work_local_id}-{imagegroup}")
+    return nullcontext()
+
+
+@contextmanager
+def profiled_volume(output_base):
+    # a single cProfile profiler can be enabled at a time
+    PROFILE["active"] = True
+    try:
+        with profiled(output_base):
+            yield
+    finally:
+        PROFILE["active"] = False
 
 
-def get_s3_prefix_path(
-    work_local_id, imagegroup, service=None, batch_prefix=None, data_types=None
-):
+def request_dump(signum, frame):
+    # only set the flag, the dump is written by the polling thread, see request_shutdown
+    PROFILE["dump_requested"] = True
+
+
+def dump_if_requested():
+    with profile_lock:
+        requested, PROFILE["dump_requested"] = PROFILE["dump_requested"], False
+    if requested:
+        base = dump_state(PROFILE_DIR)
+        logging.info(f"Stacks and memory dumped in {base}*")
+
+
+# Shutdown config, on SIGTERM no new page is started and the pages in flight have
+# `deadline` seconds to finish before the progress of the volume is handed off
+SHUTDOWN = {"requested": None, "deadline": 25, "notified": False}
+shutdown_lock = threading.Lock()
+
+
+class Shutdown(Exception):
+    pass
+
+
+def request_shutdown(signum, frame):
+    # only set the flag, logging or notifying here could deadlock on a lock held by
+    # the interrupted thread
+    if SHUTDOWN["requested"] is None:
+        SHUTDOWN["requested"] = time.time()
+
+
+def is_shutting_down():
+    # polled by every loop of the run, a requested dump is written from here too
+    dump_if_requested()
+    if SHUTDOWN["requested"] is None:
+        return False
+    with shutdown_lock:
+        notify, SHUTDOWN["notified"] = not SHUTDOWN["notified"], True
+    if notify:
+        notifier(f"`[OCR-{HOSTNAME}]` shutdown requested, draining ...")
+    return True
+
+
+def drain_time_left():
+    return max(SHUTDOWN["requested"] + SHUTDOWN["deadline"] - time.time(), 0)
+
+
+def exit_gracefully():
+    notifier(f"`[OCR-{HOSTNAME}]` stopped, progress handed off")
+    if slack_notifier:
+        slack_notifier.close()
+    if log_listener:
+        log_listener.stop()
+    # worker threads still waiting on google vision past the deadline are not joined
+    os._exit(0)
+
+
+def _cached_json(cache_fn, fetch):
+    if cache_fn.is_file():
+        return json.loads(cache_fn.read_text())
+    value = fetch()
+    if value:
+        cache_fn.parent.mkdir(exist_ok=True, parents=True)
+        cache_fn.write_text(json.dumps(value))
+    return value
+
+
+def get_cached_image_list(volume_prefix_url, cache_dir=METADATA_CACHE_DIR):
     """
-    the input is like W22084, I0886. The output is an s3 prefix ("folder"), the function
-    can be inspired from
-    https://github.com/buda-base/volume-manifest-tool/blob/f8b495d908b8de66ef78665f1375f9fed13f6b9c/manifestforwork.py#L94
-    which is documented
+    get_s3_image_list cached on disk, image lists of scanned volumes do not change.
     """
-    md5 = hashlib.md5(str.encode(work_local_id))
-    two = md5.hexdigest()[:2]
+    cache_fn = cache_dir / "imagelists" / f"{volume_prefix_url.replace(':', '_')}.json"
+    return _cached_json(cache_fn, lambda: get_s3_image_list(volume_prefix_url))
 
-    pre, rest = imagegroup[0], imagegroup[1:]
-    if pre == "I" and rest.isdigit() and len(rest) == 4:
-        suffix = rest
-    else:
-        suffix = imagegroup
 
-    base_dir = f"Works/{two}/{work_local_id}"
-    if service:
-        batch_dir = f"{base_dir}/{service}/{batch_prefix}001"
-        paths = {BATCH_PREFIX: batch_dir}
-        for dt in data_types:
-            paths[dt] = f"{batch_dir}/{dt}/{work_local_id}-{suffix}"
-        return paths
-    return f"{base_dir}/images/{work_local_id}-{suffix}"
+def get_cached_volume_infos(work_prefix_url, cache_dir=METADATA_CACHE_DIR):
+    """
+    list of get_volume_infos cached on disk.
+    """
+    cache_fn = cache_dir / "volumes" / f"{work_prefix_url.replace(':', '_')}.json"
+    return _cached_json(cache_fn, lambda: list(get_volume_infos(work_prefix_url)))
 
 
 def get_s3_bits(s3path, bucket):
@@ -189,47 +285,60 @@ def get_s3_bits(s3path, bucket):
             raise
     return
 
-def save_with_wand(bits, output_fn):
+def get_output_filename(origfilename):
+    if Path(origfilename).suffix in [".tif", ".tiff", ".TIF"]:
+        return f'{origfilename.split(".")[0]}.png'
+    return origfilename
+
+
+def convert_with_wand(bits, output_filename):
     try:
         with WandImage(blob=bits.getvalue()) as img:
             img.format = "png"
-            img.save(filename=str(output_fn))
+            return img.make_blob()
     except Exception as e:
-        logging.error(
-            f"Error in saving: {output_fn} : origfilename: {output_fn.name}"
-        )
+        logging.error(f"Error in saving: {output_filename}")
         logging.error(e)
 
 
-def save_file(bits, origfilename, imagegroup_output_dir):
+def convert_image(bits, output_filename):
     """
-    uses pillow to interpret the bits as an image and save as a format
+    uses pillow to interpret the bits as an image and returns it encoded in a format
     that is appropriate for Google Vision (png instead of tiff for instance).
     This may also apply some automatic treatment
     """
-    imagegroup_output_dir.mkdir(exist_ok=True, parents=True)
-    output_fn = imagegroup_output_dir / origfilename
-    if Path(origfilename).suffix in [".tif", ".tiff", ".TIF"]:
-        output_fn = imagegroup_output_dir / f'{origfilename.split(".")[0]}.png'
-    if output_fn.is_file():
-        return
     try:
         img = PillowImage.open(bits)
         if len(img.size) > 2:
             img = ImageOps.autocontrast(img, cutoff=0.5)
     except Exception as e:
         if bits.getvalue():
-            save_with_wand(bits, output_fn)
-        else:
-            logging.error(f"Empty image: {output_fn}")
-            logging.error(e)
+            return convert_with_wand(bits, output_filename)
+        logging.error(f"Empty image: {output_filename}")
+        logging.error(e)
         return
 
+    out = io.BytesIO()
     try:
-        img.save(str(output_fn))
+        suffix = Path(output_filename).suffix.lower()
+        img.save(out, format=PillowImage.registered_extensions().get(suffix, "PNG"))
     except:
         del img
-        save_with_wand(bits, output_fn)
+        return convert_with_wand(bits, output_filename)
+    return out.getvalue()
+
+
+def save_file(bits, origfilename, imagegroup_output_dir):
+    """
+    converts the bits with `convert_image` and saves them in imagegroup_output_dir
+    """
+    imagegroup_output_dir.mkdir(exist_ok=True, parents=True)
+    output_fn = imagegroup_output_dir / get_output_filename(origfilename)
+    if output_fn.is_file():
+        return
+    content = convert_image(bits, output_fn.name)
+    if content:
+        output_fn.write_bytes(content)
 
 
 def image_exists_locally(origfilename, imagegroup_output_dir):
@@ -252,23 +361,71 @@ def image_exists_locally(origfilename, imagegroup_output_dir):
     return False
 
 
-def save_images_for_vol(volume_prefix_url, work_local_id, imagegroup, images_base_dir):
+def get_image_bits(volume_prefix_url, s3prefix, filename):
+    """
+    get an image of a volume from the configured image source.
+    return: (filename to save the image as, bits)
+    """
+    if IMAGE_SOURCE["name"] == "iiif":
+        url = get_iiif_url(
+            volume_prefix_url,
+            filename,
+            size=IMAGE_SOURCE["size"],
+            fmt=IMAGE_SOURCE["format"],
+        )
+        try:
+            content = fetch_iiif_image(iiif_session, url)
+        except requests.RequestException as e:
+            logging.error(f"IIIF error: {url}: {e}")
+            return filename, None
+        return f'{filename.split(".")[0]}.{IMAGE_SOURCE["format"]}', io.BytesIO(content)
+    return filename, get_s3_bits(s3prefix + "/" + filename, archive_bucket)
+
+
+def save_image(volume_prefix_url, s3prefix, filename, imagegroup_output_dir):
+    if is_shutting_down():
+        return
+    if IMAGE_SOURCE["name"] == "iiif":
+        local_filename = f'{filename.split(".")[0]}.{IMAGE_SOURCE["format"]}'
+    else:
+        local_filename = filename
+    if image_exists_locally(local_filename, imagegroup_output_dir):
+        return
+    if DEBUG["status"]:
+        print(f"\t- downloading {filename}")
+    filename, filebits = get_image_bits(volume_prefix_url, s3prefix, filename)
+    if filebits:
+        save_file(filebits, filename, imagegroup_output_dir)
+
+
+def save_images_for_vol(
+    volume_prefix_url, work_local_id, imagegroup, images_base_dir, filenames=None
+):
     """
-    this function gets the list of images of a volume and download all the images from s3.
+    this function gets the list of images of a volume and download all the images from s3,
+    or from the IIIF server, concurrently, if it is the configured image source.
     The output directory is output_base_dir/work_local_id/imagegroup
+    If `filenames` is given, only these images of the volume are downloaded.
     """
     s3prefix = get_s3_prefix_path(work_local_id, imagegroup)
-    for imageinfo in get_s3_image_list(volume_prefix_url):
-        # if DEBUG['status'] and not imageinfo['filename'].split('.')[0] == 'I1KG35630002': continue
-        imagegroup_output_dir = images_base_dir / work_local_id / imagegroup
-        if image_exists_locally(imageinfo["filename"], imagegroup_output_dir):
-            continue
-        s3path = s3prefix + "/" + imageinfo["filename"]
-        if DEBUG["status"]:
-            print(f'\t- downloading {imageinfo["filename"]}')
-        filebits = get_s3_bits(s3path, archive_bucket)
-        if filebits:
-            save_file(filebits, imageinfo["filename"], imagegroup_output_dir)
+    imagegroup_output_dir = images_base_dir / work_local_id / imagegroup
+    done = page_store.pages(work_local_id, imagegroup) if page_store else set()
+    workers = IMAGE_SOURCE["workers"] if IMAGE_SOURCE["name"] == "iiif" else 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                save_image,
+                volume_prefix_url,
+                s3prefix,
+                imageinfo["filename"],
+                imagegroup_output_dir,
+            )
+            for imageinfo in get_s3_image_list(volume_prefix_url)
+            if (filenames is None or imageinfo["filename"] in filenames)
+            and imageinfo["filename"].split(".")[0] not in done
+        ]
+        for future in futures:
+            future.result()
 
 
 def gzip_str(string_):
@@ -282,28 +439,157 @@ def gzip_str(string_):
     return bytes_obj
 
 
-def apply_ocr_on_folder(images_base_dir, work_local_id, imagegroup, ocr_base_dir):
+def ocr_image(image, stats=None, lang_hints=None, orig_size=None):
+    """
+    OCR a single image (file path or bytes), preprocessing it first if enabled.
+    The bounding boxes of the response always refer to the original image.
+    orig_size: (width, height) of the original image if `image` was resized by the
+    image source
+    """
+    if isinstance(image, Path):
+        image = image.read_bytes()
+
+    transform = None
+    content = image
+    if PREPROCESS["status"]:
+        content, transform = preprocess_image(
+            image,
+            trim=PREPROCESS["trim"],
+            grayscale=PREPROCESS["grayscale"],
+            max_long_edge=PREPROCESS["max_long_edge"],
+        )
+
+    start = time.time()
+    result = google_ocr(content, lang_hints=lang_hints)
+    if stats is not None:
+        stats["ocr_time"] += time.time() - start
+        stats["orig_bytes"] += len(image)
+        stats["sent_bytes"] += len(content)
+        stats["pages"] += 1
+
+    if transform:
+        result = map_response_to_original(result, transform)
+    if orig_size:
+        size = PillowImage.open(io.BytesIO(image)).size
+        if size != tuple(orig_size):
+            result = map_response_to_original(
+                result, get_resize_transform(size, orig_size)
+            )
+    return result
+
+
+def get_orig_size(imageinfo):
+    """
+    return: (width, height) of the original image of an image list entry if the image
+    source resizes it, else None
+    """
+    if IMAGE_SOURCE["name"] == "iiif" and "width" in imageinfo:
+        return imageinfo["width"], imageinfo["height"]
+    return None
+
+
+def log_ocr_stats(work_local_id, imagegroup, stats):
+    if not stats["pages"]:
+        return
+    saved = stats["orig_bytes"] - stats["sent_bytes"]
+    logging.info(
+        f"OCR stats {work_local_id}-{imagegroup}: {stats['pages']} pages, "
+        f"sent {stats['sent_bytes']} of {stats['orig_bytes']} bytes "
+        f"({saved} bytes, {saved / max(stats['orig_bytes'], 1):.1%} saved), "
+        f"mean latency {stats['ocr_time'] / stats['pages']:.3f}s/page, "
+        f"preprocess={PREPROCESS['status']}"
+    )
+
+
+def apply_ocr_on_folder(
+    images_base_dir, work_local_id, imagegroup, ocr_base_dir, volume_prefix_url=None
+):
     """
     This function goes through all the images of imagesfolder, passes them to the Google Vision API
     and saves the output files to ocr_base_dir/work_local_id/imagegroup/filename.json.gz
+    volume_prefix_url: to get the original image sizes when the image source resizes them
+    return: ocr stats of the volume
     """
     images_dir = images_base_dir / work_local_id / imagegroup
     ocr_output_dir = ocr_base_dir / work_local_id / imagegroup
-    ocr_output_dir.mkdir(exist_ok=True, parents=True)
+    if not page_store:
+        ocr_output_dir.mkdir(exist_ok=True, parents=True)
+    stats = defaultdict(float)
     if not images_dir.is_dir():
-        return
+        return stats
+    done = page_store.pages(work_local_id, imagegroup) if page_store else set()
+    orig_sizes = {}
+    if volume_prefix_url and IMAGE_SOURCE["name"] == "iiif":
+        orig_sizes = {
+            imageinfo["filename"].split(".")[0]: get_orig_size(imageinfo)
+            for imageinfo in get_cached_image_list(volume_prefix_url)
+        }
+    rows = []
     for img_fn in images_dir.iterdir():
+        if is_shutting_down():
+            break
         result_fn = ocr_output_dir / f"{img_fn.stem}.json.gz"
-        if result_fn.is_file():
+        if img_fn.stem in done or result_fn.is_file():
             continue
         try:
-            result = google_ocr(str(img_fn))
+            result = ocr_image(img_fn, stats, orig_size=orig_sizes.get(img_fn.stem))
         except:
             logging.error(f"Google OCR issue: {result_fn}")
             continue
+        if INDEX["status"]:
+            save_page_index(ocr_output_dir, img_fn.stem, result)
         result = json.dumps(result)
         gzip_result = gzip_str(result)
-        result_fn.write_bytes(gzip_result)
+        if page_store:
+            rows.append((work_local_id, imagegroup, img_fn.stem, gzip_result))
+            if len(rows) >= PAGE_STORE["batch_size"]:
+                page_store.put_many(rows)
+                rows = []
+        else:
+            result_fn.write_bytes(gzip_result)
+    if rows:
+        page_store.put_many(rows)
+    log_ocr_stats(work_local_id, imagegroup, stats)
+    return stats
+
+
+def save_page_index(ocr_output_dir, page, result):
+    """
+    save the word box index of an ocr output in INDEX_BASE_DIR/work_local_id/imagegroup/page.npz
+    """
+    index_dir = INDEX_BASE_DIR / ocr_output_dir.parent.name / ocr_output_dir.name
+    index_dir.mkdir(exist_ok=True, parents=True)
+    try:
+        PageIndex.from_response(result).save(index_dir / f"{page}.npz")
+    except Exception as e:
+        logging.error(f"Index error: {ocr_output_dir / page}: {e}")
+
+
+def archive_page_indexes(work_local_id, imagegroup, s3_paths):
+    """
+    upload the word box indexes of the volume next to its ocr output, they are deleted
+    locally by clean_up with the volume
+    """
+    index_dir = INDEX_BASE_DIR / work_local_id / imagegroup
+    if not index_dir.is_dir():
+        return
+    for index_fn in index_dir.iterdir():
+        ocr_output_bucket.put_object(
+            Key=f"{s3_paths[PAGE_INDEX]}/{index_fn.name}", Body=index_fn.read_bytes()
+        )
+
+
+def ocr_output_exists(ocr_output_dir, page):
+    if page_store:
+        return page_store.exists(ocr_output_dir.parent.name, ocr_output_dir.name, page)
+    return (ocr_output_dir / f"{page}.json.gz").is_file()
+
+
+def save_ocr_output(ocr_output_dir, page, gzip_result):
+    if page_store:
+        page_store.put(ocr_output_dir.parent.name, ocr_output_dir.name, page, gzip_result)
+    else:
+        (ocr_output_dir / f"{page}.json.gz").write_bytes(gzip_result)
 
 
 def get_info_json():
@@ -326,6 +612,20 @@ def is_archived(key):
     return True
 
 
+def archive_output(key, output):
+    """
+    upload an ocr output unless the archived one is the same, its ETag is the md5 of
+    the object uploaded in one PUT. The archive then always matches the manifest.
+    """
+    try:
+        etag = S3_client.head_object(Bucket=OCR_OUTPUT_BUCKET, Key=key)["ETag"]
+    except botocore.errorfactory.ClientError:
+        etag = None
+    if etag and etag.strip('"') == get_md5(output):
+        return
+    ocr_output_bucket.put_object(Key=key, Body=output)
+
+
 def archive_on_s3(images_base_dir, ocr_base_dir, work_local_id, imagegroup, s3_paths):
     """
     This function uploads the images on s3, according to the schema set up by BDRC, see documentation
@@ -337,37 +637,397 @@ def archive_on_s3(images_base_dir, ocr_base_dir, work_local_id, imagegroup, s3_p
         Key=s3_ocr_info_path, Body=(bytes(json.dumps(info_json).encode("UTF-8")))
     )
 
-    # archive images
+    # archive images, when draining only the ones of the pages which are done
     images_dir = images_base_dir / work_local_id / imagegroup
+    ocr_output_dir = ocr_base_dir / work_local_id / imagegroup
     if images_dir.is_dir():
         for img_fn in images_dir.iterdir():
+            if is_shutting_down() and not ocr_output_exists(ocr_output_dir, img_fn.stem):
+                continue
             s3_image_path = f"{s3_paths[IMAGES]}/{img_fn.name}"
             if is_archived(s3_image_path):
                 continue
             ocr_output_bucket.put_object(Key=s3_image_path, Body=img_fn.read_bytes())
 
     # archive ocr output
-    ocr_output_dir = ocr_base_dir / work_local_id / imagegroup
-    if ocr_output_dir.is_dir():
+    if page_store:
+        for page, output in page_store.iter_volume(work_local_id, imagegroup):
+            archive_output(f"{s3_paths[OUTPUT]}/{page}.json.gz", output)
+    elif ocr_output_dir.is_dir():
         for out_fn in ocr_output_dir.iterdir():
-            s3_output_path = f"{s3_paths[OUTPUT]}/{out_fn.name}"
-            if is_archived(s3_output_path):
-                continue
-            ocr_output_bucket.put_object(Key=s3_output_path, Body=out_fn.read_bytes())
+            archive_output(f"{s3_paths[OUTPUT]}/{out_fn.name}", out_fn.read_bytes())
+
+    archive_page_indexes(work_local_id, imagegroup, s3_paths)
+    publish_manifest(work_local_id, imagegroup, s3_paths)
+
+
+def iter_volume_outputs(work_local_id, imagegroup):
+    """
+    yield (page, gzipped ocr output, ocr timestamp) of the volume, from the page store or
+    OCR_BASE_DIR. The ocr timestamp is the time the output file was written, the page
+    store keeps none.
+    """
+    if page_store:
+        for page, output in page_store.iter_volume(work_local_id, imagegroup):
+            yield page, output, None
+        return
+    ocr_output_dir = OCR_BASE_DIR / work_local_id / imagegroup
+    for out_fn in sorted(ocr_output_dir.glob("*.json.gz")):
+        yield out_fn.name.split(".")[0], out_fn.read_bytes(), get_file_timestamp(out_fn)
+
+
+def get_file_timestamp(path):
+    """
+    return: modification time of the file, in the format of the info.json timestamp
+    """
+    mtime = datetime.fromtimestamp(path.stat().st_mtime, pytz.utc)
+    return mtime.isoformat().split(".")[0]
+
+
+def get_s3_json(key):
+    """
+    return: the json object at key in the ocr output bucket, None if there is none
+    """
+    try:
+        response = S3_client.get_object(Bucket=OCR_OUTPUT_BUCKET, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ["NoSuchKey", "404"]:
+            return None
+        raise
+    return json.loads(response["Body"].read())
+
+
+def list_archived_pages(output_prefix):
+    """
+    return: pages of the ocr outputs archived under output_prefix
+    """
+    return {
+        obj["Key"].split("/")[-1].split(".")[0]
+        for page in S3_client.get_paginator("list_objects_v2").paginate(
+            Bucket=OCR_OUTPUT_BUCKET, Prefix=output_prefix + "/"
+        )
+        for obj in page.get("Contents", [])
+    }
+
+
+def publish_manifest(work_local_id, imagegroup, s3_paths):
+    """
+    publish {batch_prefix}/manifest.json, listing the key, size, md5, ocr timestamp and
+    engine of every archived page of the volume, for readers to sync in one request.
+    Pages which are not local, eg: on a resume, keep their entry of the previous one.
+    """
+    manifest_key = f"{s3_paths[BATCH_PREFIX]}/{MANIFEST_FN}"
+    manifest = build_manifest(
+        work_local_id,
+        imagegroup,
+        iter_volume_outputs(work_local_id, imagegroup),
+        output_prefix=s3_paths[OUTPUT],
+        engine=OCR_ENGINE,
+        timestamp=get_info_json()["timestamp"],
+        previous=get_s3_json(manifest_key),
+        archived=list_archived_pages(s3_paths[OUTPUT]),
+    )
+    if not manifest["pages"]:
+        return
+    ocr_output_bucket.put_object(
+        Key=manifest_key, Body=(bytes(json.dumps(manifest).encode("UTF-8")))
+    )
+
+
+def get_volume_manifest(
+    work_local_id, imagegroup, s3_paths, cache_dir=METADATA_CACHE_DIR
+):
+    """
+    return: the manifest of the volume, None if it has none. The manifest is cached
+    with its ETag and only downloaded again when it changed.
+    """
+    manifest_key = f"{s3_paths[BATCH_PREFIX]}/{MANIFEST_FN}"
+    cache_fn = cache_dir / "manifests" / f"{work_local_id}-{imagegroup}.json"
+    cached = json.loads(cache_fn.read_text()) if cache_fn.is_file() else None
+    kwargs = {"IfNoneMatch": cached["etag"]} if cached else {}
+    try:
+        response = S3_client.get_object(
+            Bucket=OCR_OUTPUT_BUCKET, Key=manifest_key, **kwargs
+        )
+    except botocore.exceptions.ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code in ["304", "NotModified"]:
+            return cached["manifest"]
+        if code in ["NoSuchKey", "404"]:
+            return None
+        raise
+    manifest = json.loads(response["Body"].read())
+    cache_fn.parent.mkdir(exist_ok=True, parents=True)
+    cache_fn.write_text(json.dumps({"etag": response["ETag"], "manifest": manifest}))
+    return manifest
+
+
+def download_changed_output(key, output_fn, local_md5=None):
+    """
+    GET an ocr output unless it matches the local one (If-None-Match on its md5).
+    return: 1 if the output was downloaded
+    """
+    kwargs = {"IfNoneMatch": f'"{local_md5}"'} if local_md5 else {}
+    try:
+        response = S3_client.get_object(Bucket=OCR_OUTPUT_BUCKET, Key=key, **kwargs)
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] not in ["304", "NotModified"]:
+            logging.error(f"The object does not exist, {key}")
+        return 0
+    tmp_fn = output_fn.with_name(f".{output_fn.name}.tmp")
+    tmp_fn.write_bytes(response["Body"].read())
+    tmp_fn.replace(output_fn)
+    return 1
+
+
+def sync_volume_outputs(work_local_id, imagegroup, s3_paths, ocr_output_dir, executor):
+    """
+    download the pages of the volume which are new or changed according to its
+    manifest, concurrently with `executor`.
+    return: futures of the downloads, None if the volume has no manifest
+    """
+    manifest = get_volume_manifest(work_local_id, imagegroup, s3_paths)
+    if manifest is None:
+        return None
+    ocr_output_dir.mkdir(exist_ok=True, parents=True)
+    return [
+        executor.submit(
+            download_changed_output,
+            manifest["pages"][page]["key"],
+            ocr_output_dir / f"{page}.json.gz",
+            local_md5,
+        )
+        for page, local_md5 in get_changed_pages(manifest, ocr_output_dir).items()
+    ]
+
+
+def stream_page(
+    imageinfo, volume_prefix_url, s3prefix, s3_paths, ocr_output_dir, budget
+):
+    """
+    download, convert, OCR and archive one page in memory. The memory of the download
+    is reserved in `budget` before the request, from an estimate of the image size.
+    return: ocr stats of the page, stats["failed"] is 1 if the page has no ocr output
+    """
+    stats = defaultdict(float)
+    page = imageinfo["filename"].split(".")[0]
+    result_fn = ocr_output_dir / f"{page}.json.gz"
+    s3_output_path = f"{s3_paths[OUTPUT]}/{result_fn.name}"
+    if is_shutting_down() or ocr_output_exists(ocr_output_dir, page):
+        return stats
+    if is_archived(s3_output_path):
+        # only the ocr output is needed locally, for the OPF
+        filebits = get_s3_bits(s3_output_path, ocr_output_bucket)
+        if filebits:
+            save_ocr_output(ocr_output_dir, page, filebits.getvalue())
+        else:
+            stats["failed"] += 1
+        return stats
+
+    reserved = estimate_image_bytes(imageinfo)
+    budget.acquire(reserved)
+    try:
+        with stage("get"):
+            filename, filebits = get_image_bits(
+                volume_prefix_url, s3prefix, imageinfo["filename"]
+            )
+        if not filebits:
+            stats["failed"] += 1
+            return stats
+        output_filename = get_output_filename(filename)
+        # a page bigger than its estimate is accounted without waiting, it is
+        # already in memory
+        reserved = budget.resize(reserved, len(filebits.getvalue()))
+        with stage("convert"):
+            content = convert_image(filebits, output_filename)
+    finally:
+        filebits = None
+        budget.release(reserved)
+    if not content:
+        stats["failed"] += 1
+        return stats
+
+    budget.acquire(len(content))
+    try:
+        s3_image_path = f"{s3_paths[IMAGES]}/{output_filename}"
+        with stage("put"):
+            ocr_output_bucket.put_object(Key=s3_image_path, Body=content)
+        try:
+            with stage("ocr"):
+                result = ocr_image(content, stats, orig_size=get_orig_size(imageinfo))
+        except:
+            logging.error(f"Google OCR issue: {result_fn}")
+            stats["failed"] += 1
+            return stats
+        if INDEX["status"]:
+            save_page_index(ocr_output_dir, page, result)
+        gzip_result = gzip_str(json.dumps(result))
+        with stage("put"):
+            ocr_output_bucket.put_object(Key=s3_output_path, Body=gzip_result)
+        save_ocr_output(ocr_output_dir, page, gzip_result)
+    finally:
+        budget.release(len(content))
+    return stats
+
+
+def estimate_image_bytes(imageinfo):
+    """
+    return: estimate of the bytes of a page image before it is downloaded, its size in
+    the image list if it is there, else one byte per pixel, else STREAM["page_estimate"]
+    """
+    if imageinfo.get("size"):
+        return imageinfo["size"]
+    if imageinfo.get("width") and imageinfo.get("height"):
+        return imageinfo["width"] * imageinfo["height"]
+    return STREAM["page_estimate"]
+
+
+def start_stream_volume(work_local_id, imagegroup, ocr_base_dir, s3_paths):
+    """
+    archive the info.json of the volume.
+    return: (s3 prefix of the volume images, ocr output dir)
+    """
+    info_json = get_info_json()
+    ocr_output_bucket.put_object(
+        Key=f"{s3_paths[BATCH_PREFIX]}/{INFO_FN}",
+        Body=(bytes(json.dumps(info_json).encode("UTF-8"))),
+    )
+
+    s3prefix = get_s3_prefix_path(work_local_id, imagegroup)
+    ocr_output_dir = ocr_base_dir / work_local_id / imagegroup
+    if not page_store:
+        ocr_output_dir.mkdir(exist_ok=True, parents=True)
+    return s3prefix, ocr_output_dir
+
+
+def stream_volume(volume_prefix_url, work_local_id, imagegroup, ocr_base_dir, s3_paths):
+    """
+    same as save_images_for_vol, apply_ocr_on_folder and archive_on_s3 but the images
+    never touch the disk, only the ocr output is written in ocr_base_dir for the OPF.
+    Pages held in memory are bounded by STREAM["memory_budget"] bytes, a page may
+    only go over it when it is bigger than its estimate.
+    On shutdown, the pages in flight are waited for until the drain deadline.
+    return: ocr stats of the volume, stats["failed"] counts the pages without output
+    """
+    s3prefix, ocr_output_dir = start_stream_volume(
+        work_local_id, imagegroup, ocr_base_dir, s3_paths
+    )
+    budget = MemoryBudget(STREAM["memory_budget"])
+    stats = defaultdict(float)
+    executor = ThreadPoolExecutor(max_workers=STREAM["workers"])
+    pending = {
+        executor.submit(
+            stream_page,
+            imageinfo,
+            volume_prefix_url,
+            s3prefix,
+            s3_paths,
+            ocr_output_dir,
+            budget,
+        )
+        for imageinfo in get_s3_image_list(volume_prefix_url)
+    }
+    while pending:
+        timeout = drain_time_left() if is_shutting_down() else 1
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                page_stats = future.result()
+            except Exception as ex:
+                logging.error(f"Streaming issue in {work_local_id}-{imagegroup}: {ex}")
+                page_stats = {"failed": 1}
+            for key, value in page_stats.items():
+                stats[key] += value
+        if pending and is_shutting_down() and not drain_time_left():
+            logging.warning(
+                f"Drain deadline: {len(pending)} pages of {work_local_id}-{imagegroup} abandoned"
+            )
+            break
+    executor.shutdown(wait=not is_shutting_down(), cancel_futures=True)
+    log_ocr_stats(work_local_id, imagegroup, stats)
+    archive_page_indexes(work_local_id, imagegroup, s3_paths)
+    publish_manifest(work_local_id, imagegroup, s3_paths)
+    if limiters:
+        logging.info(
+            f"Concurrency {work_local_id}-{imagegroup}: "
+            + ", ".join(str(limiter) for limiter in limiters.values())
+        )
+    return stats
+
+
+def load_progress(s3_paths):
+    """
+    return: pages of the volume done by an interrupted host, empty if there is none
+    """
+    progress_path = f"{s3_paths[BATCH_PREFIX]}/{PROGRESS_FN}"
+    if not is_archived(progress_path):
+        return set()
+    filebits = get_s3_bits(progress_path, ocr_output_bucket)
+    return set(json.loads(filebits.getvalue())["pages"]) if filebits else set()
+
+
+def save_progress(work_local_id, imagegroup, s3_paths):
+    """
+    record the pages of the interrupted volume whose ocr output is archived, for the
+    host which resumes it.
+    """
+    ocr_output_dir = OCR_BASE_DIR / work_local_id / imagegroup
+    if page_store:
+        pages = page_store.pages(work_local_id, imagegroup)
+    elif ocr_output_dir.is_dir():
+        pages = {fn.name.split(".")[0] for fn in ocr_output_dir.glob("*.json.gz")}
+    else:
+        pages = set()
+    progress = {
+        "host": HOSTNAME,
+        "timestamp": get_info_json()["timestamp"],
+        "pages": sorted(pages),
+    }
+    ocr_output_bucket.put_object(
+        Key=f"{s3_paths[BATCH_PREFIX]}/{PROGRESS_FN}",
+        Body=(bytes(json.dumps(progress).encode("UTF-8"))),
+    )
+    notifier(
+        f"`[Handoff-{HOSTNAME}]` {work_local_id}-{imagegroup}: {len(pages)} pages done"
+    )
+
+
+def restore_outputs(work_local_id, imagegroup, s3_paths, pages):
+    """
+    download the archived ocr outputs of the pages done by an interrupted host, they
+    are needed for the OPF and their images are not downloaded again.
+    """
+    ocr_output_dir = OCR_BASE_DIR / work_local_id / imagegroup
+    if not page_store:
+        ocr_output_dir.mkdir(exist_ok=True, parents=True)
+
+    def restore_output(page):
+        if ocr_output_exists(ocr_output_dir, page):
+            return
+        filebits = get_s3_bits(f"{s3_paths[OUTPUT]}/{page}.json.gz", ocr_output_bucket)
+        if filebits:
+            save_ocr_output(ocr_output_dir, page, filebits.getvalue())
+
+    with ThreadPoolExecutor(max_workers=STREAM["workers"]) as executor:
+        for _ in executor.map(restore_output, pages):
+            pass
 
 
 def clean_up(data_path, work_local_id=None, imagegroup=None):
     """
-    delete all the images and output of the archived volume (imagegroup)
+    delete all the images and page indexes of the archived volume (imagegroup), or
+    the output and page indexes of the work
     """
     if imagegroup:
-        vol_image_path = data_path / IMAGES / work_local_id / imagegroup
-        if vol_image_path.is_dir():
-            shutil.rmtree(str(vol_image_path))
+        for data_type in [IMAGES, PAGE_INDEX]:
+            vol_path = data_path / data_type / work_local_id / imagegroup
+            if vol_path.is_dir():
+                shutil.rmtree(str(vol_path))
     elif work_local_id:
-        work_output_path = data_path / OUTPUT / work_local_id
-        if work_output_path.is_dir():
-            shutil.rmtree(str(work_output_path))
+        for data_type in [OUTPUT, PAGE_INDEX]:
+            work_path = data_path / data_type / work_local_id
+            if work_path.is_dir():
+                shutil.rmtree(str(work_path))
     else:
         for path in data_path.iterdir():
             shutil.rmtree(str(path))
@@ -384,6 +1044,163 @@ class OPFError(Exception):
     pass
 
 
+def enqueue_catalog_item(work_local_id):
+    """
+    add the ocr output of a work to the durable catalog queue, one json file per work.
+    The ocr output stays in OCR_BASE_DIR until catalog_worker.py has processed it.
+    """
+    CATALOG_QUEUE_DIR.mkdir(exist_ok=True, parents=True)
+    job = {
+        "work": work_local_id,
+        "path": str(OCR_BASE_DIR / work_local_id),
+        "attempts": 0,
+        "next_try": 0,
+    }
+    job_fn = CATALOG_QUEUE_DIR / f"{work_local_id}.json"
+    tmp_fn = CATALOG_QUEUE_DIR / f"{work_local_id}.tmp"
+    tmp_fn.write_text(json.dumps(job))
+    tmp_fn.replace(job_fn)
+
+
+def process_volume(work_local_id, vol_info):
+    """
+    OCR a volume and archive its images and ocr output on s3. The ocr output is kept
+    in OCR_BASE_DIR for the OPF of the work.
+    return: True if the volume is complete
+    """
+    # get s3 paths to save images and ocr output
+    s3_ocr_paths = get_s3_prefix_path(
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+        service=SERVICE,
+        batch_prefix=BATCH_PREFIX,
+        data_types=[IMAGES, OUTPUT, PAGE_INDEX],
+    )
+
+    # resume a volume handed off by an interrupted host
+    done_pages = load_progress(s3_ocr_paths)
+    if done_pages:
+        logging.info(
+            f"Resuming {work_local_id}-{vol_info['imagegroup']}: {len(done_pages)} pages done"
+        )
+
+    start = time.time()
+    if STREAM["status"]:
+        stats = stream_volume(
+            volume_prefix_url=vol_info["volume_prefix_url"],
+            work_local_id=work_local_id,
+            imagegroup=vol_info["imagegroup"],
+            ocr_base_dir=OCR_BASE_DIR,
+            s3_paths=s3_ocr_paths,
+        )
+        times = {"stream": time.time() - start}
+        clean_up(
+            DATA_PATH, work_local_id=work_local_id, imagegroup=vol_info["imagegroup"]
+        )
+        save_volume_rates(work_local_id, vol_info["imagegroup"], stats, times)
+        return finish_volume(
+            work_local_id,
+            vol_info["imagegroup"],
+            s3_ocr_paths,
+            done_pages,
+            failed=stats["failed"],
+        )
+
+    if done_pages:
+        restore_outputs(
+            work_local_id, vol_info["imagegroup"], s3_ocr_paths, done_pages
+        )
+
+    # save all the images for a given vol
+    save_images_for_vol(
+        volume_prefix_url=vol_info["volume_prefix_url"],
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+        images_base_dir=IMAGES_BASE_DIR,
+    )
+    times = {"download": time.time() - start}
+
+    # apply ocr on the vol images
+    start = time.time()
+    stats = apply_ocr_on_folder(
+        images_base_dir=IMAGES_BASE_DIR,
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+        ocr_base_dir=OCR_BASE_DIR,
+        volume_prefix_url=vol_info["volume_prefix_url"],
+    )
+    times["ocr"] = time.time() - start
+    start = time.time()
+
+    # save image and ocr output at ocr.bdrc.org bucket
+    archive_on_s3(
+        images_base_dir=IMAGES_BASE_DIR,
+        ocr_base_dir=OCR_BASE_DIR,
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+        s3_paths=s3_ocr_paths,
+    )
+
+    times["archive"] = time.time() - start
+
+    # delete the volume
+    clean_up(
+        DATA_PATH,
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+    )
+    save_volume_rates(work_local_id, vol_info["imagegroup"], stats, times)
+    return finish_volume(work_local_id, vol_info["imagegroup"], s3_ocr_paths, done_pages)
+
+
+def save_volume_rates(work_local_id, imagegroup, stats, times):
+    """
+    append the time spent in each stage for the pages OCRed in the volume to
+    RATES_FN, work_planner.py --plan estimates the ETA of new batches from it.
+    """
+    if not stats["pages"]:
+        return
+    rates = {
+        "work": work_local_id,
+        "imagegroup": imagegroup,
+        "host": HOSTNAME,
+        "pages": stats["pages"],
+        "bytes": stats["orig_bytes"],
+        "times": times,
+    }
+    with RATES_FN.open("a") as f:
+        f.write(json.dumps(rates) + "\n")
+
+
+def finish_volume(work_local_id, imagegroup, s3_paths, done_pages, failed=0):
+    """
+    hand off the volume if it was interrupted, else remove the progress record of a
+    resumed volume. A volume with failed pages is left incomplete, its work is not
+    checkpointed and it is processed again by the next run.
+    return: True if the volume is complete
+    """
+    if is_shutting_down():
+        save_progress(work_local_id, imagegroup, s3_paths)
+        raise Shutdown
+    if failed:
+        notify_incomplete(work_local_id, imagegroup, failed)
+        return False
+    clear_progress(s3_paths, done_pages)
+    return True
+
+
+def notify_incomplete(work_local_id, imagegroup, failed):
+    notifier(
+        f"`[Volume-{HOSTNAME}]` {work_local_id}-{imagegroup}: "
+        f"{int(failed)} pages failed, left incomplete"
+    )
+
+
+def clear_progress(s3_paths, done_pages):
+    if done_pages:
+        ocr_output_bucket.Object(f"{s3_paths[BATCH_PREFIX]}/{PROGRESS_FN}").delete()
+
+
 def process_work(work):
     global last_work, last_vol
 
@@ -393,6 +1210,7 @@ def process_work(work):
 
     is_work_empty = True
     is_start_work = True
+    is_work_complete = True
     for i, vol_info in enumerate(get_volume_infos(work)):
         if (
             last_work == work_local_id
@@ -403,6 +1221,10 @@ def process_work(work):
 
         is_work_empty = False
 
+        if is_shutting_down():
+            save_check_point(imagegroup=f"{work_local_id}-{vol_info['imagegroup']}")
+            raise Shutdown
+
         # log work info at 1st vol
         if is_start_work and not DEBUG["status"]:
             notifier(f"`[Work-{HOSTNAME}]` _Work {work} processing ...._")
@@ -413,65 +1235,190 @@ def process_work(work):
                 f'* `[Volume-{HOSTNAME}]` {vol_info["imagegroup"]} processing ....'
             )
         try:
-            # save all the images for a given vol
-            save_images_for_vol(
-                volume_prefix_url=vol_info["volume_prefix_url"],
-                work_local_id=work_local_id,
-                imagegroup=vol_info["imagegroup"],
-                images_base_dir=IMAGES_BASE_DIR,
-            )
+            with profile_volume(work_local_id, vol_info["imagegroup"]):
+                if not process_volume(work_local_id, vol_info):
+                    is_work_complete = False
+        except Shutdown:
+            save_check_point(imagegroup=f"{work_local_id}-{vol_info['imagegroup']}")
+            raise
+        except:
+            # create checkpoint
+            save_check_point(imagegroup=f"{work_local_id}-{vol_info['imagegroup']}")
+            raise RuntimeError
 
-            # apply ocr on the vol images
-            apply_ocr_on_folder(
-                images_base_dir=IMAGES_BASE_DIR,
-                work_local_id=work_local_id,
-                imagegroup=vol_info["imagegroup"],
-                ocr_base_dir=OCR_BASE_DIR,
-            )
+    if is_work_empty:
+        logging.warning(f"Empty work: {work_local_id}")
+    elif is_work_complete:
+        complete_work(work_local_id)
+    else:
+        logging.warning(f"Incomplete work: {work_local_id}")
+
+
+def complete_work(work_local_id):
+    if page_store:
+        # the OPF formatter reads files
+        page_store.export_work(work_local_id, OCR_BASE_DIR)
+        page_store.delete_work(work_local_id)
+    # OPF formatting and catalog update are done by catalog_worker.py
+    enqueue_catalog_item(work_local_id)
+    save_check_point(work=work_local_id)
+
+
+def prefetch_works(work_ids, executor, ahead=4):
+    """
+    yield (work_local_id, [(vol_info, image list)]) of the works, the volumes and
+    image lists of the next `ahead` works are fetched meanwhile.
+    """
+
+    def resolve(work):
+        work_local_id, work = get_work_local_id(work)
+        return work_local_id, [
+            (vol_info, get_cached_image_list(vol_info["volume_prefix_url"]))
+            for vol_info in get_cached_volume_infos(work)
+        ]
+
+    work_ids = iter(work_ids)
+    pending = deque(executor.submit(resolve, work) for work in islice(work_ids, ahead))
+    while pending:
+        for work in islice(work_ids, 1):
+            pending.append(executor.submit(resolve, work))
+        try:
+            yield pending.popleft().result()
+        except Exception as ex:
+            show_error(ex)
 
-            # get s3 paths to save images and ocr output
-            s3_ocr_paths = get_s3_prefix_path(
+
+def iter_page_tasks(work_ids, executor):
+    """
+    yield (volume, imageinfo) of every page of the works, volume is the dict tracking
+    the pages left in the volume and the volumes left in its work. An empty volume
+    yields a single None page.
+    """
+    for work_local_id, vols in prefetch_works(work_ids, executor):
+        if not vols:
+            logging.warning(f"Empty work: {work_local_id}")
+            continue
+        notifier(f"`[Work-{HOSTNAME}]` _Work {work_local_id} processing ...._")
+        work = {"work": work_local_id, "remaining": len(vols), "incomplete": False}
+        for vol_info, imagelist in vols:
+            imagegroup = vol_info["imagegroup"]
+            s3_paths = get_s3_prefix_path(
                 work_local_id=work_local_id,
-                imagegroup=vol_info["imagegroup"],
+                imagegroup=imagegroup,
                 service=SERVICE,
                 batch_prefix=BATCH_PREFIX,
-                data_types=[IMAGES, OUTPUT],
+                data_types=[IMAGES, OUTPUT, PAGE_INDEX],
             )
-
-            # save image and ocr output at ocr.bdrc.org bucket
-            archive_on_s3(
-                images_base_dir=IMAGES_BASE_DIR,
-                ocr_base_dir=OCR_BASE_DIR,
-                work_local_id=work_local_id,
-                imagegroup=vol_info["imagegroup"],
-                s3_paths=s3_ocr_paths,
+            s3prefix, ocr_output_dir = start_stream_volume(
+                work_local_id, imagegroup, OCR_BASE_DIR, s3_paths
             )
+            volume = {
+                "work": work,
+                "imagegroup": imagegroup,
+                "volume_prefix_url": vol_info["volume_prefix_url"],
+                "s3prefix": s3prefix,
+                "s3_paths": s3_paths,
+                "ocr_output_dir": ocr_output_dir,
+                "done_pages": load_progress(s3_paths),
+                "remaining": max(len(imagelist), 1),
+                "stats": defaultdict(float),
+                # profiles the volume from its first page to its last one
+                "profile": ExitStack(),
+            }
+            volume["profile"].enter_context(profile_volume(work_local_id, imagegroup))
+            for imageinfo in imagelist or [None]:
+                yield volume, imageinfo
+
+
+def page_done(volume, page_stats, active_volumes):
+    """
+    count a page of the volume as done, the volume is finished with its last page and
+    the work with its last volume.
+    """
+    for key, value in page_stats.items():
+        volume["stats"][key] += value
+    volume["remaining"] -= 1
+    if volume["remaining"]:
+        return
+    work = volume["work"]
+    volume["profile"].close()
+    active_volumes.pop((work["work"], volume["imagegroup"]), None)
+    log_ocr_stats(work["work"], volume["imagegroup"], volume["stats"])
+    archive_page_indexes(work["work"], volume["imagegroup"], volume["s3_paths"])
+    publish_manifest(work["work"], volume["imagegroup"], volume["s3_paths"])
+    clean_up(DATA_PATH, work_local_id=work["work"], imagegroup=volume["imagegroup"])
+    # not finish_volume, which raises on shutdown while the other volumes drain
+    if volume["stats"]["failed"]:
+        notify_incomplete(work["work"], volume["imagegroup"], volume["stats"]["failed"])
+        work["incomplete"] = True
+    else:
+        clear_progress(volume["s3_paths"], volume["done_pages"])
+    work["remaining"] -= 1
+    if not work["remaining"]:
+        if work["incomplete"]:
+            logging.warning(f"Incomplete work: {work['work']}")
+        else:
+            complete_work(work["work"])
 
-            # delete the volume
-            clean_up(
-                DATA_PATH,
-                work_local_id=work_local_id,
-                imagegroup=vol_info["imagegroup"],
-            )
-        except:
-            # create checkpoint
-            save_check_point(imagegroup=f"{work_local_id}-{vol_info['imagegroup']}")
-            raise RuntimeError
 
-    if not is_work_empty:
-        try:
-            catalog.add_ocr_item(OCR_BASE_DIR / work_local_id)
-            clean_up(DATA_PATH, work_local_id=work_local_id)
-            clean_up(Path("./output"))
-            save_check_point(work=work_local_id)
-        except GithubException as ex:
-            save_check_point(imagegroup=f"{work_local_id}-{vol_info['imagegroup']}")
-            raise GithubException(ex.status, ex.data)
-        except GeneratorExit:
-            save_check_point(imagegroup=f"{work_local_id}-{vol_info['imagegroup']}")
-            raise OPFError
-    else:
-        logging.warning(f"Empty work: {work_local_id}")
+def stream_works(work_ids):
+    """
+    OCR the works as a single stream of pages in --stream mode, instead of volume by
+    volume: the pages of the next volumes and works keep the workers busy while the
+    last pages of a volume are processed. A volume is finished when its last page
+    lands and a work is enqueued for the catalog with its last volume.
+    At most 2 * STREAM["workers"] pages are submitted ahead.
+    """
+    budget = MemoryBudget(STREAM["memory_budget"])
+    window = STREAM["workers"] * 2
+    active_volumes = {}
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=STREAM["workers"])
+    with ThreadPoolExecutor(max_workers=4) as metadata_executor:
+        tasks = iter_page_tasks(work_ids, metadata_executor)
+        while True:
+            if not is_shutting_down():
+                for volume, imageinfo in islice(tasks, window - len(pending)):
+                    work_local_id = volume["work"]["work"]
+                    active_volumes[(work_local_id, volume["imagegroup"])] = volume
+                    if imageinfo is None:
+                        page_done(volume, {}, active_volumes)
+                        continue
+                    future = executor.submit(
+                        stream_page,
+                        imageinfo,
+                        volume["volume_prefix_url"],
+                        volume["s3prefix"],
+                        volume["s3_paths"],
+                        volume["ocr_output_dir"],
+                        budget,
+                    )
+                    pending[future] = volume
+            if not pending:
+                break
+
+            timeout = drain_time_left() if is_shutting_down() else 1
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                volume = pending.pop(future)
+                try:
+                    page_stats = future.result()
+                except Exception as ex:
+                    vol_name = f"{volume['work']['work']}-{volume['imagegroup']}"
+                    logging.error(f"Streaming issue in {vol_name}: {ex}")
+                    page_stats = {"failed": 1}
+                page_done(volume, page_stats, active_volumes)
+            if pending and is_shutting_down() and not drain_time_left():
+                logging.warning(f"Drain deadline: {len(pending)} pages abandoned")
+                break
+    executor.shutdown(wait=not is_shutting_down(), cancel_futures=True)
+
+    if is_shutting_down():
+        for (work_local_id, imagegroup), volume in active_volumes.items():
+            volume["profile"].close()
+            archive_page_indexes(work_local_id, imagegroup, volume["s3_paths"])
+            save_progress(work_local_id, imagegroup, volume["s3_paths"])
+        raise Shutdown
 
 
 def get_work_ids(fn):
@@ -483,7 +1430,14 @@ def get_work_ids(fn):
 
 def load_check_point():
     global last_work, last_vol
-    check_point = json.load(CHECK_POINT_FN.open())
+    if page_store:
+        check_point = json.loads(page_store.get_state("checkpoint", "{}"))
+        if not check_point:
+            return
+    elif CHECK_POINT_FN.is_file():
+        check_point = json.load(CHECK_POINT_FN.open())
+    else:
+        return
     CHECK_POINT[WORK] = check_point[WORK]
     CHECK_POINT[VOL] = check_point[VOL]
 
@@ -496,7 +1450,10 @@ def save_check_point(work=None, imagegroup=None):
         CHECK_POINT[WORK].append(work)
     if imagegroup:
         CHECK_POINT[VOL] = imagegroup
-    json.dump(CHECK_POINT, CHECK_POINT_FN.open("w"))
+    if page_store:
+        page_store.set_state("checkpoint", json.dumps(CHECK_POINT))
+    else:
+        json.dump(CHECK_POINT, CHECK_POINT_FN.open("w"))
 
 
 def show_error(ex, ex_type="ocr"):
@@ -516,42 +1473,154 @@ if __name__ == "__main__":
         default="./usage/bdrc/input",
         help="path with work ids text files",
     )
+    ap.add_argument(
+        "--preprocess",
+        action="store_true",
+        help="trim margins, grayscale and downscale pages before OCR",
+    )
+    ap.add_argument(
+        "--max_long_edge",
+        type=int,
+        default=PREPROCESS["max_long_edge"],
+        help="max pixels of the long edge of preprocessed pages",
+    )
+    ap.add_argument(
+        "--stream",
+        action="store_true",
+        help="process pages in memory, without saving images locally",
+    )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=STREAM["workers"],
+        help="number of pages processed concurrently in --stream mode",
+    )
+    ap.add_argument(
+        "--memory_budget",
+        type=int,
+        default=STREAM["memory_budget"] // 1024 ** 2,
+        help="MB of page data held in memory in --stream mode",
+    )
+    ap.add_argument(
+        "--image_source",
+        choices=["s3", "iiif"],
+        default=IMAGE_SOURCE["name"],
+        help="get the images from the archive bucket or from the IIIF server",
+    )
+    ap.add_argument(
+        "--iiif_size",
+        default=IMAGE_SOURCE["size"],
+        help="IIIF size of the requested images, eg: max, !3000,3000, pct:50",
+    )
+    ap.add_argument(
+        "--page_store",
+        action="store_true",
+        help="keep ocr outputs and checkpoint in a sqlite page store",
+    )
+    ap.add_argument(
+        "--index",
+        action="store_true",
+        help="save a word box index of every page, archived on s3 next to the output",
+    )
+    ap.add_argument(
+        "--notify",
+        action="store_true",
+        help="post progress to slack, batched every few seconds",
+    )
+    ap.add_argument(
+        "--drain_deadline",
+        type=int,
+        default=SHUTDOWN["deadline"],
+        help="seconds given to the pages in flight on SIGTERM",
+    )
+    ap.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="tune the concurrency of each stage in --stream mode, up to --max_workers",
+    )
+    ap.add_argument(
+        "--max_workers",
+        type=int,
+        default=ADAPTIVE["max_limit"],
+        help="max concurrency of each stage with --adaptive, replaces --workers",
+    )
+    ap.add_argument(
+        "--page_queue",
+        action="store_true",
+        help="stream the pages of all the works through one queue, implies --stream",
+    )
+    ap.add_argument(
+        "--profile_every",
+        type=int,
+        default=0,
+        help="profile every Nth volume with cProfile and a stack sampler, also with "
+        "--page_queue, and trace the memory allocations for the SIGUSR1 dumps",
+    )
     args = ap.parse_args()
+    logging.getLogger().removeHandler(log_handler)
+    log_listener = start_queue_logging(log_handler)
+    SHUTDOWN["deadline"] = args.drain_deadline
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGUSR1, request_dump)
+    PROFILE["every"] = args.profile_every
+    if PROFILE["every"]:
+        # the SIGUSR1 dumps show the allocations since the start of the run
+        tracemalloc.start()
+    INDEX["status"] = args.index
+    if args.notify:
+        NOTIFIER["status"] = True
+        slack_notifier = BatchNotifier()
+    if args.page_store:
+        PAGE_STORE["status"] = True
+        page_store = PageStore(PAGE_STORE["path"])
+    IMAGE_SOURCE["name"] = args.image_source
+    IMAGE_SOURCE["size"] = args.iiif_size
+    PREPROCESS["status"] = args.preprocess
+    STREAM["status"] = args.stream or args.page_queue
+    STREAM["workers"] = args.workers
+    STREAM["memory_budget"] = args.memory_budget * 1024 ** 2
+    if args.adaptive:
+        ADAPTIVE["status"] = True
+        ADAPTIVE["max_limit"] = args.max_workers
+        STREAM["workers"] = ADAPTIVE["max_limit"]
+        limiters = {
+            name: AdaptiveLimiter(
+                name, initial=ADAPTIVE["initial"], max_limit=ADAPTIVE["max_limit"]
+            )
+            for name in STAGES
+        }
+    PREPROCESS["max_long_edge"] = args.max_long_edge
 
     notifier(f"`[OCR-{HOSTNAME}]` *Google OCR is running* ...")
-    if CHECK_POINT_FN.is_file():
-        load_check_point()
+    load_check_point()
     for workids_path in Path(args.input_path).iterdir():
+        if args.page_queue:
+            work_ids = [
+                work_id
+                for work_id in get_work_ids(workids_path)
+                if work_id not in CHECK_POINT[WORK]
+            ]
+            try:
+                stream_works(work_ids)
+            except Shutdown:
+                exit_gracefully()
+            except Exception as ex:
+                show_error(ex)
+                sys.exit()
+            notifier(f"[INFO] Completed {workids_path.name}")
+            continue
+
         for i, work_id in enumerate(get_work_ids(workids_path)):
             if CHECK_POINT[WORK] and work_id in CHECK_POINT[WORK]:
                 continue
+            if is_shutting_down():
+                exit_gracefully()
             try:
                 process_work(work_id)
-            except GithubException as ex:
-                show_error(ex, ex_type="github")
-                error_work = catalog.batch.pop()
-                if catalog.batch:
-                    catalog.update()
-                if error_work:
-                    delete_repo(error_work[0][1:8])
-                # slack_notifier(f"`[Restart]` *{HOSTNAME}* ...")
-                os.execv(f'{shutil.which("nohup")}', ["nohup", "sh", "run.sh", "&"])
-            except OPFError:
-                if catalog.batch:
-                    catalog.update()
-                # slack_notifier(f"`[Restart]` *{HOSTNAME}* ...")
-                os.execv(f'{shutil.which("nohup")}', ["nohup", "sh", "run.sh", "&"])
+            except Shutdown:
+                exit_gracefully()
             except Exception as ex:
                 show_error(ex)
-                if catalog.batch:
-                    catalog.update()
                 sys.exit()
 
-            # update catalog every after 5 pecha
-            if len(catalog.batch) == 5:
-                catalog.update()
-
         notifier(f"[INFO] Completed {workids_path.name}")
-
-    if catalog.batch:
-        catalog.update()
@@ -0,0 +1,82 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from img2opf import config
+from img2opf.iiif import fetch_iiif_image, get_iiif_session, get_iiif_url
+
+from bdrc_ocr import (
+    archive_bucket,
+    get_s3_bits,
+    get_s3_image_list,
+    get_s3_prefix_path,
+    get_volume_infos,
+    get_work_local_id,
+)
+
+
+def fetch_s3(work_local_id, vol_info, filenames, workers):
+    s3prefix = get_s3_prefix_path(work_local_id, vol_info["imagegroup"])
+
+    def fetch(filename):
+        filebits = get_s3_bits(f"{s3prefix}/{filename}", archive_bucket)
+        return len(filebits.getvalue()) if filebits else 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(fetch, filenames))
+
+
+def fetch_iiif(vol_info, filenames, workers, size, fmt, base_url):
+    session = get_iiif_session(workers)
+
+    def fetch(filename):
+        url = get_iiif_url(vol_info["volume_prefix_url"], filename, size, fmt, base_url)
+        return len(fetch_iiif_image(session, url))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(fetch, filenames))
+
+
+def benchmark(args):
+    """
+    fetch the first `n_images` images of every volume from s3 and from IIIF and
+    report bytes transferred and time per volume.
+    """
+    work_local_id, work = get_work_local_id(args.work)
+    for vol_info in get_volume_infos(work):
+        filenames = [
+            imageinfo["filename"]
+            for imageinfo in get_s3_image_list(vol_info["volume_prefix_url"])
+        ][: args.n_images]
+        if not filenames:
+            continue
+        print(f"[INFO] {vol_info['imagegroup']}: {len(filenames)} images")
+
+        start = time.time()
+        n_bytes = fetch_s3(work_local_id, vol_info, filenames, args.workers)
+        s3_time = time.time() - start
+        print(f"\t  s3: {n_bytes / 1e6:8.1f} MB {s3_time:6.1f}s")
+
+        start = time.time()
+        n_bytes = fetch_iiif(
+            vol_info, filenames, args.workers, args.size, args.format, args.iiif_base_url
+        )
+        iiif_time = time.time() - start
+        print(f"\tiiif: {n_bytes / 1e6:8.1f} MB {iiif_time:6.1f}s")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Compare s3 and IIIF image fetching")
+    ap.add_argument("work")
+    ap.add_argument("--n_images", type=int, default=50, help="images per volume")
+    ap.add_argument("--workers", type=int, default=16, help="concurrent requests")
+    ap.add_argument("--size", default=config.IIIF_SIZE, help="IIIF size parameter")
+    ap.add_argument("--format", default=config.IIIF_FORMAT, help="IIIF image format")
+    ap.add_argument(
+        "--iiif_base_url",
+        default=config.IIIF_BASE_URL,
+        help="IIIF server, eg: a local stand-in server",
+    )
+    args = ap.parse_args()
+
+    benchmark(args)
@@ -0,0 +1,84 @@
+import argparse
+import gzip
+import json
+import random
+import time
+from pathlib import Path
+
+from img2opf.layout import PageIndex, get_box, iter_words
+
+
+def naive_query(fn, region):
+    """
+    load the ocr output and walk the whole page tree to find the words in the region
+    """
+    x0, y0, x1, y1 = region
+    response = json.loads(gzip.open(fn).read())
+    words = []
+    for word in iter_words(response):
+        wx0, wy0, wx1, wy1 = get_box(word.get("boundingBox", {}))
+        if wx0 <= x1 and wx1 >= x0 and wy0 <= y1 and wy1 >= y0:
+            words.append("".join(s.get("text", "") for s in word.get("symbols", [])))
+    return words
+
+
+def index_query(fn, region):
+    index = PageIndex.load(fn)
+    return index.words_text(index.query_region(*region))
+
+
+def benchmark(vol_path, index_path, n_queries, region_size):
+    """
+    build the index of every page of a volume (ocr output dir) and compare a region
+    query on a page, from disk, with the index and with the json output.
+    """
+    index_path.mkdir(exist_ok=True, parents=True)
+    output_fns = sorted(vol_path.glob("*.json.gz"))
+    index_fns = []
+    start = time.time()
+    for fn in output_fns:
+        index_fn = index_path / f"{fn.name.split('.')[0]}.npz"
+        if not index_fn.is_file():
+            response = json.loads(gzip.open(fn).read())
+            PageIndex.from_response(response).save(index_fn)
+        index_fns.append(index_fn)
+    print(f"[INFO] {len(output_fns)} page indexes built in {time.time() - start:.1f}s")
+
+    queries = []
+    for _ in range(n_queries):
+        page = random.randrange(len(output_fns))
+        x, y = random.randrange(3000), random.randrange(3000)
+        queries.append((page, (x, y, x + region_size, y + region_size)))
+
+    for name, query, fns in [
+        ("json", naive_query, output_fns),
+        ("index", index_query, index_fns),
+    ]:
+        start = time.time()
+        for page, region in queries:
+            query(fns[page], region)
+        elapsed = (time.time() - start) / n_queries * 1000
+        print(f"\t{name:>6}: {elapsed:8.3f} ms/query (load + query)")
+
+    # queries on a page already in memory
+    index = PageIndex.load(index_fns[0])
+    start = time.time()
+    for _, region in queries:
+        index.query_region(*region)
+    elapsed = (time.time() - start) / n_queries * 1000
+    print(f"\t{'loaded':>6}: {elapsed:8.3f} ms/query")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Region queries with the layout index")
+    ap.add_argument("vol_path", help="ocr output dir of a volume")
+    ap.add_argument("--index_path", help="index dir, default: <vol_path>_index")
+    ap.add_argument("--queries", type=int, default=1000)
+    ap.add_argument("--region_size", type=int, default=300)
+    args = ap.parse_args()
+
+    vol_path = Path(args.vol_path)
+    index_path = (
+        Path(args.index_path) if args.index_path else vol_path.parent / f"{vol_path.name}_index"
+    )
+    benchmark(vol_path, index_path, args.queries, args.region_size)
@@ -0,0 +1,187 @@
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+from github.GithubException import GithubException
+from openpecha.github_utils import delete_repo
+
+from bdrc_ocr import (
+    CATALOG_FAILED_DIR,
+    CATALOG_QUEUE_DIR,
+    DATA_PATH,
+    catalog,
+    clean_up,
+    show_error,
+)
+
+# worker config
+BATCH_SIZE = 5
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 60  # seconds, doubled after every failed attempt
+POLL_INTERVAL = 30
+
+# state of the catalog batch commit, retried with the same delays as the jobs
+BATCH = {"attempts": 0, "next_try": 0}
+
+
+def write_job(job_fn, job):
+    tmp_fn = job_fn.parent / f"{job_fn.stem}.tmp"
+    tmp_fn.write_text(json.dumps(job))
+    tmp_fn.replace(job_fn)
+
+
+def get_due_jobs(queue_dir):
+    now = time.time()
+    for job_fn in sorted(queue_dir.glob("*.json")):
+        job = json.loads(job_fn.read_text())
+        if job["next_try"] <= now:
+            yield job_fn, job
+
+
+def retry_later(job_fn, job):
+    job["attempts"] += 1
+    if job["attempts"] >= MAX_ATTEMPTS:
+        logging.error(f"Catalog: giving up on {job['work']} after {job['attempts']} attempts")
+        CATALOG_FAILED_DIR.mkdir(exist_ok=True, parents=True)
+        write_job(CATALOG_FAILED_DIR / job_fn.name, job)
+        job_fn.unlink()
+        return
+    job["next_try"] = time.time() + RETRY_DELAY * 2 ** (job["attempts"] - 1)
+    write_job(job_fn, job)
+
+
+def get_item_work(item):
+    """
+    return: local id of the work of a catalog batch item, its last column is the bdrc
+    work id, with or without the bdr: prefix
+    """
+    return item[-1].split(":")[-1]
+
+
+def add_item(job_fn, job):
+    """
+    format the ocr output of the job's work to OPF and add it to the catalog batch.
+    return: True if the item was added
+    """
+    n_items = len(catalog.batch)
+    try:
+        catalog.add_ocr_item(Path(job["path"]))
+    except GithubException as ex:
+        show_error(ex, ex_type="github")
+        # the pecha repo is only created once the item is in the batch, the items of
+        # the works already added must be kept
+        added = len(catalog.batch) > n_items
+        if added and get_item_work(catalog.batch[-1]) == job["work"]:
+            error_work = catalog.batch.pop()
+            delete_repo(error_work[0][1:8])
+        retry_later(job_fn, job)
+        return False
+    except (GeneratorExit, Exception) as ex:
+        show_error(ex)
+        retry_later(job_fn, job)
+        return False
+    return True
+
+
+def give_up_batch(added):
+    """
+    move the jobs of a batch which could not be committed to CATALOG_FAILED_DIR, with
+    their catalog item, their pecha repos are already published.
+    """
+    logging.error(
+        f"Catalog: giving up on a batch of {len(added)} works after "
+        f"{BATCH['attempts']} attempts"
+    )
+    items = {get_item_work(item): item for item in catalog.batch}
+    CATALOG_FAILED_DIR.mkdir(exist_ok=True, parents=True)
+    for job_fn, job in added:
+        job["catalog_item"] = items.get(job["work"])
+        write_job(CATALOG_FAILED_DIR / job_fn.name, job)
+        job_fn.unlink()
+    catalog.batch.clear()
+    added.clear()
+    BATCH.update(attempts=0, next_try=0)
+
+
+def flush(added):
+    """
+    commit the catalog batch, the jobs are only removed from the queue once committed.
+    A failed commit is retried after RETRY_DELAY, doubled after every failed attempt,
+    and the batch is given up after MAX_ATTEMPTS.
+    return: True if the batch is committed
+    """
+    if time.time() < BATCH["next_try"]:
+        return False
+    try:
+        catalog.update()
+    except (GeneratorExit, Exception) as ex:
+        if isinstance(ex, GithubException):
+            show_error(ex, ex_type="github")
+        else:
+            show_error(ex)
+        BATCH["attempts"] += 1
+        if BATCH["attempts"] >= MAX_ATTEMPTS:
+            give_up_batch(added)
+        else:
+            BATCH["next_try"] = time.time() + RETRY_DELAY * 2 ** (BATCH["attempts"] - 1)
+        return False
+
+    for job_fn, job in added:
+        clean_up(DATA_PATH, work_local_id=job["work"])
+        job_fn.unlink()
+    if Path("./output").is_dir():
+        clean_up(Path("./output"))
+    logging.info(f"Catalog: committed {len(added)} works")
+    added.clear()
+    BATCH.update(attempts=0, next_try=0)
+    return True
+
+
+def run(queue_dir, poll_interval=POLL_INTERVAL, once=False):
+    added = []
+    while True:
+        for job_fn, job in get_due_jobs(queue_dir):
+            # no item is added to a full batch until it is committed
+            if len(added) >= BATCH_SIZE and not flush(added):
+                break
+            if any(job_fn == added_fn for added_fn, _ in added):
+                continue
+            if add_item(job_fn, job):
+                added.append((job_fn, job))
+
+        if added:
+            flush(added)
+        if once:
+            # the batch is committed or given up before exiting
+            while added:
+                time.sleep(max(BATCH["next_try"] - time.time(), 0))
+                flush(added)
+            break
+        time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(
+        description="Format queued works to OPF and update the catalog in background"
+    )
+    ap.add_argument(
+        "--queue_dir",
+        default=str(CATALOG_QUEUE_DIR),
+        help="directory of the catalog queue",
+    )
+    ap.add_argument(
+        "--poll_interval",
+        type=int,
+        default=POLL_INTERVAL,
+        help="seconds to wait between queue scans",
+    )
+    ap.add_argument(
+        "--once", action="store_true", help="drain the queue once and exit"
+    )
+    args = ap.parse_args()
+
+    queue_dir = Path(args.queue_dir)
+    queue_dir.mkdir(exist_ok=True, parents=True)
+    run(queue_dir, poll_interval=args.poll_interval, once=args.once)
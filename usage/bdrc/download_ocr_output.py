@@ -1,6 +1,7 @@
 import argparse
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Mapping
 
@@ -16,6 +17,7 @@ from bdrc_ocr import (
     get_work_local_id,
     ocr_output_bucket,
     save_file,
+    sync_volume_outputs,
 )
 
 logging.basicConfig(
@@ -41,8 +43,27 @@ def save_file(bits, fn, imagegroup_output_dir):
 
 
 def download_ocr_result_for_vol(
-    volume_prefix_url, work_local_id, imagegroup, output_base_dir, s3_ocr_paths
+    volume_prefix_url,
+    work_local_id,
+    imagegroup,
+    output_base_dir,
+    s3_ocr_paths,
+    workers=16,
 ):
+    # volumes with a manifest only download their new or changed pages
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = sync_volume_outputs(
+            work_local_id,
+            imagegroup,
+            s3_ocr_paths,
+            output_base_dir / work_local_id / imagegroup,
+            executor,
+        )
+        if futures is not None:
+            for future in futures:
+                future.result()
+            return
+
     imagegroup_s3prefix = s3_ocr_paths[OUTPUT]
     for imageinfo in get_s3_image_list(volume_prefix_url):
         imagegroup_output_dir = output_base_dir / work_local_id / imagegroup
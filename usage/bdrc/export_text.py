@@ -0,0 +1,117 @@
+import argparse
+import gzip
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from img2opf.export import export_volume_text, read_page_text, write_volume_text
+
+from bdrc_ocr import (
+    BATCH_PREFIX,
+    OUTPUT,
+    SERVICE,
+    get_s3_bits,
+    get_s3_image_list,
+    get_s3_prefix_path,
+    get_volume_infos,
+    get_work_ids,
+    get_work_local_id,
+    ocr_output_bucket,
+)
+
+logging.basicConfig(
+    filename=f"{__file__}.log",
+    format="%(asctime)s, %(levelname)s: %(message)s",
+    datefmt="%m/%d/%Y %I:%M:%S %p",
+    level=logging.INFO,
+)
+
+
+def get_s3_page_texts(work_local_id, vol_info):
+    s3_ocr_paths = get_s3_prefix_path(
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+        service=SERVICE,
+        batch_prefix=BATCH_PREFIX,
+        data_types=[OUTPUT],
+    )
+    for imageinfo in get_s3_image_list(vol_info["volume_prefix_url"]):
+        page_name = imageinfo["filename"].split(".")[0]
+        filebits = get_s3_bits(
+            f"{s3_ocr_paths[OUTPUT]}/{page_name}.json.gz", ocr_output_bucket
+        )
+        if not filebits:
+            continue
+        filebits.seek(0)
+        with gzip.GzipFile(fileobj=filebits) as f:
+            yield page_name, read_page_text(f)
+
+
+def export_s3_volume(work_local_id, vol_info, output_dir, per_page):
+    return write_volume_text(
+        get_s3_page_texts(work_local_id, vol_info),
+        vol_info["imagegroup"],
+        output_dir / work_local_id,
+        per_page=per_page,
+    )
+
+
+def iter_local_tasks(input_dir, output_dir, per_page):
+    for work_dir in sorted(input_dir.iterdir()):
+        if not work_dir.is_dir():
+            continue
+        for vol_dir in sorted(work_dir.iterdir()):
+            if vol_dir.is_dir():
+                yield export_volume_text, (vol_dir, output_dir / work_dir.name, per_page)
+
+
+def iter_s3_tasks(works_fn, output_dir, per_page):
+    for work in get_work_ids(works_fn):
+        work_local_id, work = get_work_local_id(work)
+        for vol_info in get_volume_infos(work):
+            yield export_s3_volume, (work_local_id, vol_info, output_dir, per_page)
+
+
+def export(tasks, workers):
+    start = time.time()
+    n_pages = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fn, *args): args for fn, args in tasks}
+        for future in as_completed(futures):
+            try:
+                n_pages += future.result()
+            except Exception as ex:
+                logging.error(f"Text export failed for {futures[future][:2]}: {ex}")
+    elapsed = time.time() - start
+    print(
+        f"[INFO] Exported {n_pages} pages in {elapsed:.1f}s "
+        f"({n_pages / max(elapsed, 1e-6):.1f} pages/s)"
+    )
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Export plain text from stored OCR outputs")
+    source = ap.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--input_dir", help="local ocr output dir, eg: ./archive/output"
+    )
+    source.add_argument(
+        "--works", help="file with work ids to export from the ocr.bdrc.io bucket"
+    )
+    ap.add_argument("--output_dir", "-o", default="./text", help="text output dir")
+    ap.add_argument(
+        "--per_page", action="store_true", help="write one text file per page"
+    )
+    ap.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="number of processes"
+    )
+    args = ap.parse_args()
+
+    output_dir = Path(args.output_dir)
+    if args.input_dir:
+        tasks = iter_local_tasks(Path(args.input_dir), output_dir, args.per_page)
+    else:
+        tasks = iter_s3_tasks(Path(args.works), output_dir, args.per_page)
+    export(tasks, args.workers)
@@ -0,0 +1,145 @@
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from bdrc_ocr import (
+    BATCH_PREFIX,
+    OCR_OUTPUT_BUCKET,
+    OUTPUT,
+    S3_client,
+    SERVICE,
+    get_cached_image_list,
+    get_cached_volume_infos,
+    get_s3_prefix_path,
+    get_work_ids,
+    get_work_local_id,
+)
+
+logging.basicConfig(
+    filename=f"{__file__}.log",
+    format="%(asctime)s, %(levelname)s: %(message)s",
+    datefmt="%m/%d/%Y %I:%M:%S %p",
+    level=logging.INFO,
+)
+
+
+def list_s3_keys(bucket, prefix):
+    paginator = S3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield obj["Key"]
+
+
+def find_missing_pages(work_local_id, vol_info):
+    """
+    return: image filenames of the volume which have no ocr output in the ocr bucket
+    """
+    image_list = get_cached_image_list(vol_info["volume_prefix_url"])
+    if not image_list:
+        # get_s3_image_list logs and returns nothing on errors, the gaps are unknown
+        raise ValueError(f"no image list for {vol_info['volume_prefix_url']}")
+    s3_ocr_paths = get_s3_prefix_path(
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+        service=SERVICE,
+        batch_prefix=BATCH_PREFIX,
+        data_types=[OUTPUT],
+    )
+    output_prefix = s3_ocr_paths[OUTPUT] + "/"
+    done = {
+        key[len(output_prefix) :]
+        for key in list_s3_keys(OCR_OUTPUT_BUCKET, output_prefix)
+    }
+    return [
+        imageinfo["filename"]
+        for imageinfo in image_list
+        if f"{imageinfo['filename'].split('.')[0]}.json.gz" not in done
+    ]
+
+
+def find_gaps(work_ids, workers, unknown=None):
+    """
+    yield one job per volume with missing ocr outputs:
+    {"work": .., "imagegroup": .., "volume_prefix_url": .., "pages": [filenames]}
+    unknown: list extended with the works and volumes which could not be checked
+    """
+    if unknown is None:
+        unknown = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        vol_futures = {
+            executor.submit(get_cached_volume_infos, work): get_work_local_id(work)[0]
+            for work in (get_work_local_id(work_id)[1] for work_id in work_ids)
+        }
+        gap_futures = {}
+        for future in as_completed(vol_futures):
+            work_local_id = vol_futures[future]
+            try:
+                vol_infos = future.result()
+            except Exception as ex:
+                logging.error(f"Gap finder: volumes of {work_local_id} failed: {ex}")
+                unknown.append(work_local_id)
+                continue
+            if not vol_infos:
+                # get_volume_infos logs and yields nothing on errors
+                logging.error(f"Gap finder: no volumes found for {work_local_id}")
+                unknown.append(work_local_id)
+                continue
+            for vol_info in vol_infos:
+                gap_future = executor.submit(find_missing_pages, work_local_id, vol_info)
+                gap_futures[gap_future] = (work_local_id, vol_info)
+
+        for future in as_completed(gap_futures):
+            work_local_id, vol_info = gap_futures[future]
+            try:
+                pages = future.result()
+            except Exception as ex:
+                logging.error(
+                    f"Gap finder: {work_local_id}-{vol_info['imagegroup']} failed: {ex}"
+                )
+                unknown.append(f"{work_local_id}-{vol_info['imagegroup']}")
+                continue
+            if pages:
+                yield {
+                    "work": work_local_id,
+                    "imagegroup": vol_info["imagegroup"],
+                    "volume_prefix_url": vol_info["volume_prefix_url"],
+                    "pages": pages,
+                }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(
+        description="Find pages without ocr output, the report is a job list for ocr_missing_imagegroup.py --jobs"
+    )
+    ap.add_argument(
+        "--works", default="./usage/bdrc/openworks.txt", help="file with work ids"
+    )
+    ap.add_argument(
+        "--output", "-o", default="./missing.jsonl", help="missing pages report"
+    )
+    ap.add_argument(
+        "--workers", type=int, default=64, help="number of concurrent requests"
+    )
+    args = ap.parse_args()
+
+    start = time.time()
+    n_vols, n_pages = 0, 0
+    unknown = []
+    work_ids = list(get_work_ids(Path(args.works)))
+    with Path(args.output).open("w") as f:
+        for job in find_gaps(work_ids, args.workers, unknown):
+            f.write(json.dumps(job) + "\n")
+            n_vols += 1
+            n_pages += len(job["pages"])
+    print(
+        f"[INFO] {len(work_ids)} works scanned in {time.time() - start:.0f}s: "
+        f"{n_pages} missing pages in {n_vols} volumes, saved at {args.output}"
+    )
+    if unknown:
+        print(
+            f"[ERROR] {len(unknown)} works or volumes could not be checked, "
+            f"their gaps are unknown: {', '.join(unknown)}"
+        )
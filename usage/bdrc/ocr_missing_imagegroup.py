@@ -1,8 +1,11 @@
 import argparse
+import json
 import logging
+from pathlib import Path
 
 from bdrc_ocr import (
     BATCH_PREFIX,
+    DATA_PATH,
     IMAGES,
     IMAGES_BASE_DIR,
     OCR_BASE_DIR,
@@ -11,6 +14,7 @@ from bdrc_ocr import (
     apply_ocr_on_folder,
     archive_on_s3,
     catalog,
+    clean_up,
     get_s3_prefix_path,
     get_volume_infos,
     get_work_local_id,
@@ -25,49 +29,79 @@ logging.basicConfig(
 )
 
 
+def process_volume(work_local_id, vol_info, filenames=None):
+    save_images_for_vol(
+        volume_prefix_url=vol_info["volume_prefix_url"],
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+        images_base_dir=IMAGES_BASE_DIR,
+        filenames=filenames,
+    )
+
+    apply_ocr_on_folder(
+        images_base_dir=IMAGES_BASE_DIR,
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+        ocr_base_dir=OCR_BASE_DIR,
+        volume_prefix_url=vol_info["volume_prefix_url"],
+    )
+
+    # get s3 paths to save images and ocr output
+    s3_ocr_paths = get_s3_prefix_path(
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+        service=SERVICE,
+        batch_prefix=BATCH_PREFIX,
+        data_types=[IMAGES, OUTPUT],
+    )
+
+    # save image and ocr output at ocr.bdrc.org bucket
+    archive_on_s3(
+        images_base_dir=IMAGES_BASE_DIR,
+        ocr_base_dir=OCR_BASE_DIR,
+        work_local_id=work_local_id,
+        imagegroup=vol_info["imagegroup"],
+        s3_paths=s3_ocr_paths,
+    )
+
+
 def process(args):
-    work_local_id, _ = get_work_local_id(args.work)
-    for vol_info in get_volume_infos(work_local_id, imagegroup=args.imagegroup):
+    work_local_id, work = get_work_local_id(args.work)
+    for vol_info in get_volume_infos(work):
+        if args.imagegroup and vol_info["imagegroup"] != args.imagegroup:
+            continue
         print(f"[INFO] Processing {vol_info['imagegroup']} ....")
-        save_images_for_vol(
-            imagelist=vol_info["imagelist"],
-            work_local_id=work_local_id,
-            imagegroup=vol_info["imagegroup"],
-            images_base_dir=IMAGES_BASE_DIR,
-        )
-
-        apply_ocr_on_folder(
-            images_base_dir=IMAGES_BASE_DIR,
-            work_local_id=work_local_id,
-            imagegroup=vol_info["imagegroup"],
-            ocr_base_dir=OCR_BASE_DIR,
-        )
+        process_volume(work_local_id, vol_info)
 
-        # get s3 paths to save images and ocr output
-        s3_ocr_paths = get_s3_prefix_path(
-            work_local_id=work_local_id,
-            imagegroup=vol_info["imagegroup"],
-            service=SERVICE,
-            batch_prefix=BATCH_PREFIX,
-            data_types=[IMAGES, OUTPUT],
-        )
+    catalog.ocr_to_opf(OCR_BASE_DIR / work_local_id)
 
-        # save image and ocr output at ocr.bdrc.org bucket
-        archive_on_s3(
-            images_base_dir=IMAGES_BASE_DIR,
-            ocr_base_dir=OCR_BASE_DIR,
-            work_local_id=work_local_id,
-            imagegroup=vol_info["imagegroup"],
-            s3_paths=s3_ocr_paths,
-        )
 
-        catalog.ocr_to_opf(OCR_BASE_DIR / work_local_id)
+def process_jobs(jobs_fn):
+    """
+    OCR only the missing pages listed in a find_missing_ocr.py report
+    """
+    for line in jobs_fn.read_text().splitlines():
+        if not line:
+            continue
+        job = json.loads(line)
+        print(f"[INFO] Processing {job['work']}-{job['imagegroup']}: {len(job['pages'])} pages ....")
+        try:
+            process_volume(job["work"], job, filenames=set(job["pages"]))
+        except Exception as ex:
+            logging.error(f"Missing pages job {job['work']}-{job['imagegroup']} failed: {ex}")
+            continue
+        clean_up(DATA_PATH, work_local_id=job["work"], imagegroup=job["imagegroup"])
+        clean_up(DATA_PATH, work_local_id=job["work"])
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("work")
-    parser.add_argument("--imagegroup", "-img", default=chr(0), help="start imagegroup")
+    parser.add_argument("work", nargs="?")
+    parser.add_argument("--imagegroup", "-img", default=None, help="imagegroup to process")
+    parser.add_argument("--jobs", help="missing pages report of find_missing_ocr.py")
     args = parser.parse_args()
 
-    process(args)
+    if args.jobs:
+        process_jobs(Path(args.jobs))
+    else:
+        process(args)
@@ -1,10 +1,25 @@
+import argparse
+import gzip
+import json
 import logging
+import os
 import shutil
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from itertools import islice
 from pathlib import Path
 
-from bdrc_ocr import (get_s3_bits, get_s3_image_list, get_s3_prefix_path,
-                      get_volume_infos, get_work_local_id,
-                      image_exists_locally, save_file)
+from bdrc_ocr import (BATCH_PREFIX, OUTPUT, SERVICE, archive_bucket,
+                      get_cached_image_list, get_cached_volume_infos,
+                      get_s3_bits, get_s3_image_list, get_s3_prefix_path,
+                      get_volume_infos, get_work_ids, get_work_local_id,
+                      image_exists_locally, ocr_output_bucket, save_file)
+
+from img2opf.dataset import ShardWriter, crop_page
 
 logging.basicConfig(
     filename=f"{__file__}.log",
@@ -62,36 +77,168 @@ def rename():
         shutil.move(str(vol_path), str(dest_path))
 
 
-def resize(path):
+def resize_by_percent(img_fn, out_fn=None, scale_percent=60):
+    "Resize the image to given percent `scale_percent` of the image"
     import cv2
 
-    def resize_by_percent(img_fn, out_fn=None, scale_percent=60):
-        img = cv2.imread(str(img_fn))
-        "Resize the image to given percent `scale_percent` of the image"
-        width = int(img.shape[1] * scale_percent / 100)
-        height = int(img.shape[0] * scale_percent / 100)
-        dim = (width, height)
-        resized = cv2.resize(img, dim, interpolation=cv2.INTER_AREA)
-        if out_fn:
-            cv2.imwrite(str(out_fn), resized)
-        else:
-            return resized
+    img = cv2.imread(str(img_fn))
+    width = int(img.shape[1] * scale_percent / 100)
+    height = int(img.shape[0] * scale_percent / 100)
+    dim = (width, height)
+    resized = cv2.resize(img, dim, interpolation=cv2.INTER_AREA)
+    if out_fn:
+        cv2.imwrite(str(out_fn), resized)
+    else:
+        return resized
+
 
+def resize(path, processes=os.cpu_count()):
     path = Path(path)
     out_path = path.parent / f"{path.name}-resized"
-    for vol_fn in path.iterdir():
-        print(f"[INFO] Processing {vol_fn.name} ...")
-        vol_out_path = out_path / vol_fn.name
-        vol_out_path.mkdir(exist_ok=True, parents=True)
-        for img_fn in vol_fn.iterdir():
-            img_out_fn = vol_out_path / img_fn.name
-            resize_by_percent(img_fn, out_fn=img_out_fn)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = []
+        for vol_fn in path.iterdir():
+            vol_out_path = out_path / vol_fn.name
+            vol_out_path.mkdir(exist_ok=True, parents=True)
+            for img_fn in vol_fn.iterdir():
+                futures.append(
+                    executor.submit(resize_by_percent, img_fn, vol_out_path / img_fn.name)
+                )
+        for future in futures:
+            future.result()
+
+
+def iter_pages(works):
+    """
+    yield (work_local_id, vol_info, imageinfo) of every page of the works
+    """
+    for work in works:
+        work_local_id, work = get_work_local_id(work)
+        for vol_info in get_cached_volume_infos(work):
+            for imageinfo in get_cached_image_list(vol_info["volume_prefix_url"]):
+                yield work_local_id, vol_info, imageinfo
+
+
+def download_page(work_local_id, vol_info, imageinfo):
+    """
+    return: (work_local_id, imagegroup, page, image bytes, gzipped ocr output), None if
+    the page has no ocr output
+    """
+    imagegroup = vol_info["imagegroup"]
+    filename = imageinfo["filename"]
+    page = filename.split(".")[0]
+    s3_output_prefix = get_s3_prefix_path(
+        work_local_id,
+        imagegroup,
+        service=SERVICE,
+        batch_prefix=BATCH_PREFIX,
+        data_types=[OUTPUT],
+    )[OUTPUT]
+    output = get_s3_bits(f"{s3_output_prefix}/{page}.json.gz", ocr_output_bucket)
+    if not output:
+        return None
+    s3prefix = get_s3_prefix_path(work_local_id, imagegroup)
+    image = get_s3_bits(f"{s3prefix}/{filename}", archive_bucket)
+    if not image:
+        return None
+    return work_local_id, imagegroup, page, image.getvalue(), output.getvalue()
+
+
+def crop_downloaded_page(page, level, scale):
+    """
+    runs in a cropping process.
+    return: (key prefix, metadata, samples of crop_page)
+    """
+    work_local_id, imagegroup, page, image, output = page
+    response = json.loads(gzip.decompress(output))
+    meta = {"work": work_local_id, "imagegroup": imagegroup, "page": page}
+    return (
+        f"{work_local_id}-{imagegroup}-{page}",
+        meta,
+        crop_page(image, response, level=level, scale=scale),
+    )
+
+
+def export_training_data(
+    works, output_dir, level, scale, shard_size, download_workers, processes
+):
+    """
+    download the images and ocr outputs of the works, crop their lines or words in
+    `processes` processes and write the crops into tar shards with an index.
+    Pages downloaded but not cropped yet are bounded by 4 * processes.
+    """
+    pages = iter_pages(works)
+    window = processes * 4
+    downloads, crops = set(), set()
+    writer = ShardWriter(output_dir, prefix=level, shard_size=shard_size)
+    n_pages = 0
+    with ThreadPoolExecutor(
+        max_workers=download_workers
+    ) as downloaders, ProcessPoolExecutor(max_workers=processes) as croppers:
+        while True:
+            for page in islice(pages, window - len(downloads) - len(crops)):
+                downloads.add(downloaders.submit(download_page, *page))
+            if not downloads and not crops:
+                break
+
+            done, _ = wait(downloads | crops, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as ex:
+                    logging.error(f"Training data error: {ex}")
+                    downloads.discard(future)
+                    crops.discard(future)
+                    continue
+                if future in downloads:
+                    downloads.remove(future)
+                    if result:
+                        crops.add(
+                            croppers.submit(crop_downloaded_page, result, level, scale)
+                        )
+                    continue
+
+                crops.remove(future)
+                key_prefix, meta, samples = result
+                for i, (image, text, box) in enumerate(samples):
+                    writer.write(f"{key_prefix}-{i:04}", image, text, box=box, **meta)
+                n_pages += 1
+                if n_pages % 1000 == 0:
+                    print(f"[INFO] {n_pages} pages, {writer.n_samples} {level} images")
+    writer.close()
+    print(f"[INFO] {n_pages} pages, {writer.n_samples} {level} images in {output_dir}")
 
 
 if __name__ == "__main__":
-    work = "W22083"
-    filters = {"type": "", "till": "Z", "skip": []}
+    ap = argparse.ArgumentParser(description="Prepare training data from the ocr outputs")
+    ap.add_argument("works", nargs="?", help="file with work ids, for --export")
+    ap.add_argument(
+        "--export",
+        action="store_true",
+        help="export line or word images with their text in tar shards",
+    )
+    ap.add_argument("--output", default="./training_data", help="shards directory")
+    ap.add_argument("--level", choices=["line", "word"], default="line")
+    ap.add_argument("--scale", type=float, default=1.0, help="resize factor of the crops")
+    ap.add_argument("--shard_size", type=int, default=10000, help="images per shard")
+    ap.add_argument("--download_workers", type=int, default=32)
+    ap.add_argument("--processes", type=int, default=os.cpu_count())
+    args = ap.parse_args()
+
+    if args.export:
+        export_training_data(
+            get_work_ids(Path(args.works)),
+            Path(args.output),
+            args.level,
+            args.scale,
+            args.shard_size,
+            args.download_workers,
+            args.processes,
+        )
+    else:
+        work = "W22083"
+        filters = {"type": "", "till": "Z", "skip": []}
 
-    process_work(work, filters)
-    # rename()
-    # resize('./publication/W1KG13607')
+        process_work(work, filters)
+        # rename()
+        # resize('./publication/W1KG13607')
@@ -0,0 +1,188 @@
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from bdrc_ocr import (
+    BATCH_PREFIX,
+    OCR_BASE_DIR,
+    OUTPUT,
+    PREPROCESS,
+    SERVICE,
+    convert_image,
+    get_cached_image_list,
+    get_cached_volume_infos,
+    get_image_bits,
+    get_output_filename,
+    get_s3_prefix_path,
+    get_work_local_id,
+    gzip_str,
+    ocr_image,
+    ocr_output_bucket,
+    publish_manifest,
+)
+from s3_to_opf import download_ocr_output_for_vol
+
+from img2opf.quality import flag_weak_pages, get_word_confidences, scan_confidences
+
+logging.basicConfig(
+    filename=f"{__file__}.log",
+    format="%(asctime)s, %(levelname)s: %(message)s",
+    datefmt="%m/%d/%Y %I:%M:%S %p",
+    level=logging.INFO,
+)
+
+
+def replace_output(output_fn, gzip_result):
+    """
+    write the new output next to the old one and rename it over, readers never see a
+    partial file.
+    """
+    tmp_fn = output_fn.with_name(f".{output_fn.name}.tmp")
+    tmp_fn.write_bytes(gzip_result)
+    os.replace(tmp_fn, output_fn)
+
+
+def reocr_page(volume_prefix_url, s3prefix, filename, lang_hints):
+    """
+    return: new ocr response of the page
+    """
+    filename, bits = get_image_bits(volume_prefix_url, s3prefix, filename)
+    if not bits:
+        raise ValueError(f"image not found: {filename}")
+    content = convert_image(bits, get_output_filename(filename))
+    if not content:
+        raise ValueError(f"image could not be converted: {filename}")
+    return ocr_image(content, lang_hints=lang_hints)
+
+
+def reocr_volume(work_local_id, vol_info, args, executor):
+    """
+    scan the ocr outputs of the volume and re-OCR its weak pages. A new output replaces
+    the old one, locally and on s3, only if its mean word confidence is higher.
+    return: report rows of the flagged pages
+    """
+    imagegroup = vol_info["imagegroup"]
+    volume_prefix_url = vol_info["volume_prefix_url"]
+    for future in download_ocr_output_for_vol(
+        volume_prefix_url, work_local_id, imagegroup, OCR_BASE_DIR, executor
+    ):
+        future.result()
+
+    ocr_output_dir = OCR_BASE_DIR / work_local_id / imagegroup
+    output_fns = sorted(ocr_output_dir.glob("*.json.gz"))
+    scores = scan_confidences(output_fns)
+    flagged = flag_weak_pages(scores, threshold=args.threshold, percentile=args.percentile)
+    print(
+        f"[INFO] {work_local_id}-{imagegroup}: {flagged.sum()} weak pages of {len(output_fns)}"
+    )
+
+    pages = {
+        output_fns[i].name.split(".")[0]: (i, output_fns[i])
+        for i in flagged.nonzero()[0]
+    }
+    reports = {
+        page: {
+            "work": work_local_id,
+            "imagegroup": imagegroup,
+            "page": page,
+            "confidence": float(scores["mean"][i]),
+            "weak_words": float(scores["weak"][i]),
+        }
+        for page, (i, _) in pages.items()
+    }
+    if args.dry_run or not pages:
+        return list(reports.values())
+
+    s3prefix = get_s3_prefix_path(work_local_id, imagegroup)
+    s3_paths = get_s3_prefix_path(
+        work_local_id,
+        imagegroup,
+        service=SERVICE,
+        batch_prefix=BATCH_PREFIX,
+        data_types=[OUTPUT],
+    )
+    futures = {
+        imageinfo["filename"].split(".")[0]: executor.submit(
+            reocr_page, volume_prefix_url, s3prefix, imageinfo["filename"], args.lang_hints
+        )
+        for imageinfo in get_cached_image_list(volume_prefix_url)
+        if imageinfo["filename"].split(".")[0] in pages
+    }
+    for page, future in futures.items():
+        report = reports[page]
+        try:
+            result = future.result()
+        except Exception as ex:
+            logging.error(f"Re-OCR failed: {work_local_id}-{imagegroup}-{page}: {ex}")
+            report["error"] = str(ex)
+            continue
+        confidences = get_word_confidences(result)
+        report["new_confidence"] = float(confidences.mean()) if len(confidences) else 0.0
+        report["replaced"] = report["new_confidence"] > report["confidence"]
+        if not report["replaced"]:
+            continue
+        gzip_result = gzip_str(json.dumps(result))
+        output_fn = pages[page][1]
+        replace_output(output_fn, gzip_result)
+        # a PUT replaces the s3 object atomically
+        ocr_output_bucket.put_object(
+            Key=f"{s3_paths[OUTPUT]}/{output_fn.name}", Body=gzip_result
+        )
+    if any(report.get("replaced") for report in reports.values()):
+        publish_manifest(work_local_id, imagegroup, s3_paths)
+    return list(reports.values())
+
+
+def process(args):
+    work_local_id, work = get_work_local_id(args.work)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, open(
+        args.report, "a"
+    ) as report_f:
+        for vol_info in get_cached_volume_infos(work):
+            if args.imagegroup and vol_info["imagegroup"] != args.imagegroup:
+                continue
+            try:
+                reports = reocr_volume(work_local_id, vol_info, args, executor)
+            except Exception as ex:
+                logging.error(f"{work_local_id}-{vol_info['imagegroup']} failed: {ex}")
+                continue
+            for report in reports:
+                report_f.write(json.dumps(report) + "\n")
+            report_f.flush()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Re-OCR the pages with a low confidence")
+    ap.add_argument("work")
+    ap.add_argument("--imagegroup", "-img", default=None, help="imagegroup to process")
+    ap.add_argument(
+        "--threshold", type=float, help="flag pages with a lower mean word confidence"
+    )
+    ap.add_argument(
+        "--percentile", type=float, help="flag the pages in this lowest percentile"
+    )
+    ap.add_argument(
+        "--lang_hints", type=lambda s: s.split(","), help="eg: bo or bo,zh"
+    )
+    ap.add_argument(
+        "--preprocess", action="store_true", help="trim and grayscale the pages"
+    )
+    ap.add_argument(
+        "--max_long_edge",
+        type=int,
+        default=0,
+        help="with --preprocess, downscale pages to this long edge, 0 keeps full size",
+    )
+    ap.add_argument("--workers", type=int, default=16)
+    ap.add_argument("--dry_run", action="store_true", help="only report the weak pages")
+    ap.add_argument("--report", default="reocr_report.jsonl")
+    args = ap.parse_args()
+    if args.threshold is None and args.percentile is None:
+        ap.error("give --threshold and/or --percentile")
+
+    PREPROCESS["status"] = args.preprocess
+    PREPROCESS["max_long_edge"] = args.max_long_edge or None
+
+    process(args)
@@ -1,32 +1,60 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from itertools import islice
+from pathlib import Path
+
 from bdrc_ocr import (
     BATCH_PREFIX,
-    DEBUG,
-    IMAGES_BASE_DIR,
+    DATA_PATH,
     OCR_BASE_DIR,
+    OCR_OUTPUT_BUCKET,
     OUTPUT,
     SERVICE,
+    S3_client,
     catalog,
-    get_s3_bits,
-    get_s3_image_list,
+    clean_up,
+    get_cached_image_list,
+    get_cached_volume_infos,
     get_s3_prefix_path,
-    get_volume_infos,
+    get_work_ids,
     get_work_local_id,
-    ocr_output_bucket,
-    save_images_for_vol,
+    show_error,
+    sync_volume_outputs,
 )
 
-DEBUG["status"] = True
+logging.basicConfig(
+    filename=f"{__file__}.log",
+    format="%(asctime)s, %(levelname)s: %(message)s",
+    datefmt="%m/%d/%Y %I:%M:%S %p",
+    level=logging.INFO,
+)
 
 
-def save_json_output(bits, fn, output_dir):
-    output_dir.mkdir(exist_ok=True, parents=True)
-    output_fn = output_dir / fn
-    output_fn.write_bytes(bits.getvalue())
+def download_ocr_output(s3path, output_fn):
+    try:
+        S3_client.download_file(OCR_OUTPUT_BUCKET, s3path, str(output_fn))
+    except Exception:
+        logging.error(f"The object does not exist, {s3path}")
+        return 0
+    return 1
 
 
 def download_ocr_output_for_vol(
-    volume_prefix_url, work_local_id, imagegroup, ocr_base_dir
+    volume_prefix_url, work_local_id, imagegroup, ocr_base_dir, executor
 ):
+    """
+    download the ocr output of every page of the volume, the images are not needed.
+    Volumes with a manifest only download their new or changed pages.
+    return: futures of the downloads
+    """
     s3prefix = get_s3_prefix_path(
         work_local_id,
         imagegroup,
@@ -34,49 +62,132 @@ def download_ocr_output_for_vol(
         batch_prefix=BATCH_PREFIX,
         data_types=[OUTPUT],
     )
+    ocr_output_dir = ocr_base_dir / work_local_id / imagegroup
+    futures = sync_volume_outputs(
+        work_local_id, imagegroup, s3prefix, ocr_output_dir, executor
+    )
+    if futures is not None:
+        return futures
+    ocr_output_dir.mkdir(exist_ok=True, parents=True)
 
-    for imageinfo in get_s3_image_list(volume_prefix_url):
-        ocr_output_dir = ocr_base_dir / work_local_id / imagegroup
+    futures = []
+    for imageinfo in get_cached_image_list(volume_prefix_url):
         ocr_json_fn = f"{imageinfo['filename'].split('.')[0]}.json.gz"
         if (ocr_output_dir / ocr_json_fn).is_file():
             continue
         s3path = s3prefix[OUTPUT] + "/" + ocr_json_fn
-        if DEBUG["status"]:
-            print(f"\t- downloading {ocr_json_fn}")
-        filebits = get_s3_bits(s3path, ocr_output_bucket)
-        if filebits:
-            save_json_output(filebits, ocr_json_fn, ocr_output_dir)
+        futures.append(
+            executor.submit(download_ocr_output, s3path, ocr_output_dir / ocr_json_fn)
+        )
+    return futures
 
 
-def process_work(work, vols=None):
+def download_work(work, executor, vols=None):
+    """
+    return: (work_local_id, number of pages downloaded)
+    """
     work_local_id, work = get_work_local_id(work)
-
-    is_work_empty = True
-    for vol_info in get_volume_infos(work):
-        is_work_empty = False
-        print(f'[INFO] {vol_info["imagegroup"]} processing ....')
-
+    futures = []
+    for vol_info in get_cached_volume_infos(work):
         if vols and vol_info["imagegroup"] not in vols:
             continue
-
-        save_images_for_vol(
-            volume_prefix_url=vol_info["volume_prefix_url"],
-            work_local_id=work_local_id,
-            imagegroup=vol_info["imagegroup"],
-            images_base_dir=IMAGES_BASE_DIR,
-        )
-
-        download_ocr_output_for_vol(
+        futures += download_ocr_output_for_vol(
             volume_prefix_url=vol_info["volume_prefix_url"],
             work_local_id=work_local_id,
             imagegroup=vol_info["imagegroup"],
             ocr_base_dir=OCR_BASE_DIR,
+            executor=executor,
         )
+    return work_local_id, sum(future.result() for future in futures)
 
-    # if not is_work_empty:
-    #    catalog.ocr_to_opf(OCR_BASE_DIR / work_local_id)
+
+def format_work(work_local_id):
+    """
+    runs in a formatter process.
+    return: the catalog batch items of the work, to be committed by the main process
+    """
+    catalog.batch.clear()
+    catalog.add_ocr_item(OCR_BASE_DIR / work_local_id)
+    items = list(catalog.batch)
+    catalog.batch.clear()
+    clean_up(DATA_PATH, work_local_id=work_local_id)
+    return items
+
+
+def regenerate(work_ids, download_workers, processes, batch_size):
+    """
+    download the ocr outputs of the works and format them in `processes` processes.
+    At most 2 * processes works are downloaded or formatted at a time, to bound the disk use.
+    """
+    start = time.time()
+    n_works, n_pages = 0, 0
+    window = processes * 2
+    works = iter(work_ids)
+    downloads, formats = {}, {}
+    with ThreadPoolExecutor(
+        max_workers=download_workers
+    ) as page_executor, ThreadPoolExecutor(
+        max_workers=window
+    ) as work_executor, ProcessPoolExecutor(
+        max_workers=processes
+    ) as formatters:
+        while True:
+            for work in islice(works, window - len(downloads) - len(formats)):
+                downloads[work_executor.submit(download_work, work, page_executor)] = work
+            if not downloads and not formats:
+                break
+
+            done, _ = wait(list(downloads) + list(formats), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in downloads:
+                    work = downloads.pop(future)
+                    try:
+                        work_local_id, work_pages = future.result()
+                    except Exception as ex:
+                        show_error(ex)
+                        continue
+                    n_pages += work_pages
+                    formats[formatters.submit(format_work, work_local_id)] = work_local_id
+                    continue
+
+                work_local_id = formats.pop(future)
+                try:
+                    catalog.batch.extend(future.result())
+                except Exception as ex:
+                    logging.error(f"OPF regeneration failed for {work_local_id}: {ex}")
+                    continue
+                n_works += 1
+                if len(catalog.batch) >= batch_size:
+                    catalog.update()
+
+    if catalog.batch:
+        catalog.update()
+
+    elapsed = time.time() - start
+    print(
+        f"[INFO] {n_works} OPFs regenerated in {elapsed:.0f}s "
+        f"({n_works / max(elapsed, 1e-6) * 3600:.0f} works/h, "
+        f"{n_pages / max(elapsed, 1e-6):.1f} pages/s downloaded)"
+    )
 
 
 if __name__ == "__main__":
-    # process_work('W1PD95844')
-    process_work("W1PD96682", ["I1PD96857"])
+    ap = argparse.ArgumentParser(description="Regenerate OPFs from the ocr outputs on s3")
+    ap.add_argument("works", help="file with work ids")
+    ap.add_argument(
+        "--download_workers", type=int, default=64, help="concurrent s3 downloads"
+    )
+    ap.add_argument(
+        "--processes", type=int, default=os.cpu_count(), help="formatter processes"
+    )
+    ap.add_argument(
+        "--batch_size", type=int, default=20, help="works per catalog commit"
+    )
+    args = ap.parse_args()
+
+    regenerate(
+        list(get_work_ids(Path(args.works))),
+        args.download_workers,
+        args.processes,
+        args.batch_size,
+    )
@@ -0,0 +1,161 @@
+import argparse
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from bdrc_ocr import (
+    BATCH_PREFIX,
+    IMAGE_SOURCE,
+    OUTPUT,
+    SERVICE,
+    get_cached_image_list,
+    get_cached_volume_infos,
+    get_image_bits,
+    get_s3_bits,
+    get_s3_prefix_path,
+    get_work_local_id,
+    ocr_output_bucket,
+    save_file,
+)
+
+from img2opf.sampling import stratified_sample
+
+logging.basicConfig(
+    filename=f"{__file__}.log",
+    format="%(asctime)s, %(levelname)s: %(message)s",
+    datefmt="%m/%d/%Y %I:%M:%S %p",
+    level=logging.INFO,
+)
+
+
+def get_works(fn):
+    """
+    works file with one work per line and optionally its script type, eg: W22084 dbu-can
+    return: (work, script type)
+    """
+    for line in fn.read_text().splitlines():
+        if not line.strip():
+            continue
+        work, *script = line.split()
+        yield work, script[0] if script else ""
+
+
+def get_strata(works, executor):
+    """
+    return: {script: {work_local_id: {imagegroup: [pages]}}} from the cached volume
+    infos and image lists, a page is (work_local_id, imagegroup, volume_prefix_url, filename)
+    """
+
+    def get_work_strata(work):
+        work_local_id, work = get_work_local_id(work)
+        work_strata = {}
+        for vol_info in get_cached_volume_infos(work):
+            work_strata[vol_info["imagegroup"]] = [
+                (
+                    work_local_id,
+                    vol_info["imagegroup"],
+                    vol_info["volume_prefix_url"],
+                    imageinfo["filename"],
+                )
+                for imageinfo in get_cached_image_list(vol_info["volume_prefix_url"])
+            ]
+        return work_local_id, work_strata
+
+    strata = {}
+    futures = [(script, executor.submit(get_work_strata, work)) for work, script in works]
+    for script, future in futures:
+        try:
+            work_local_id, work_strata = future.result()
+        except Exception as ex:
+            logging.error(f"Image lists not found: {ex}")
+            continue
+        strata.setdefault(script, {})[work_local_id] = work_strata
+    return strata
+
+
+def fetch_page(page, output_dir, with_ocr):
+    work_local_id, imagegroup, volume_prefix_url, filename = page
+    s3prefix = get_s3_prefix_path(work_local_id, imagegroup)
+    image_fn, filebits = get_image_bits(volume_prefix_url, s3prefix, filename)
+    if filebits:
+        save_file(filebits, image_fn, output_dir / "images" / work_local_id / imagegroup)
+    if not with_ocr:
+        return
+    s3_output_prefix = get_s3_prefix_path(
+        work_local_id,
+        imagegroup,
+        service=SERVICE,
+        batch_prefix=BATCH_PREFIX,
+        data_types=[OUTPUT],
+    )[OUTPUT]
+    ocr_json_fn = f"{filename.split('.')[0]}.json.gz"
+    filebits = get_s3_bits(f"{s3_output_prefix}/{ocr_json_fn}", ocr_output_bucket)
+    if filebits:
+        ocr_output_dir = output_dir / "output" / work_local_id / imagegroup
+        ocr_output_dir.mkdir(exist_ok=True, parents=True)
+        (ocr_output_dir / ocr_json_fn).write_bytes(filebits.getvalue())
+
+
+def sample(works_fn, total, seed, output_dir, with_ocr, workers):
+    """
+    sample `total` pages of the works, evenly split between script types, then works,
+    then volumes, and download only these pages.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        strata = get_strata(get_works(works_fn), executor)
+        pages = stratified_sample(strata, total, seed=seed)
+        print(f"[INFO] {len(pages)} pages sampled, downloading ...")
+
+        output_dir.mkdir(exist_ok=True, parents=True)
+        with (output_dir / "sample.jsonl").open("w") as f:
+            for work_local_id, imagegroup, _, filename in pages:
+                f.write(
+                    json.dumps(
+                        {
+                            "work": work_local_id,
+                            "imagegroup": imagegroup,
+                            "filename": filename,
+                            "seed": seed,
+                        }
+                    )
+                    + "\n"
+                )
+
+        futures = [
+            executor.submit(fetch_page, page, output_dir, with_ocr) for page in pages
+        ]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as ex:
+                logging.error(f"Sample page error: {ex}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Stratified random sample of pages")
+    ap.add_argument("works", help="file with a work id and optionally its script per line")
+    ap.add_argument("--total", type=int, default=10000, help="number of pages")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", default="./sample", help="output directory")
+    ap.add_argument(
+        "--ocr", action="store_true", help="also download the ocr output of the pages"
+    )
+    ap.add_argument("--workers", type=int, default=32)
+    ap.add_argument(
+        "--image_source",
+        choices=["s3", "iiif"],
+        default=IMAGE_SOURCE["name"],
+        help="get the images from the archive bucket or from the IIIF server",
+    )
+    args = ap.parse_args()
+    IMAGE_SOURCE["name"] = args.image_source
+
+    sample(
+        Path(args.works),
+        args.total,
+        args.seed,
+        Path(args.output),
+        args.ocr,
+        args.workers,
+    )
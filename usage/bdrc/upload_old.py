@@ -1,8 +1,13 @@
 import argparse
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
 from bdrc_ocr import save_images_for_vol, archive_on_s3, get_volume_infos, gzip_str, get_s3_prefix_path
+from bdrc_ocr import INFO_FN, OCR_OUTPUT_BUCKET, S3_client, get_file_timestamp, get_info_json, get_s3_image_list, get_s3_json
+
+from img2opf.manifest import MANIFEST_FN, build_manifest
 
 
 # s3 bucket directory config
@@ -16,6 +21,7 @@ DATA_PATH = Path('./archive')
 IMAGES_BASE_DIR = DATA_PATH/IMAGES
 OCR_BASE_DIR = DATA_PATH/OUTPUT
 CHECK_POINT_FN = DATA_PATH/'last_vol.cp'
+LEDGER_FN = DATA_PATH/'upload_old_ledger.txt'
 
 
 def convert_old_result(images_base_dir, work_path, work_local_id, imagegroup, ocr_base_dir):
@@ -39,6 +45,7 @@ def convert_old_result(images_base_dir, work_path, work_local_id, imagegroup, oc
 def process_work(work_path):
     work_local_id = work_path.name
     volume_prefix_url = f'bdr:{work_local_id}'
+    last_vol = None
     if CHECK_POINT_FN.is_file():
         last_vol = CHECK_POINT_FN.read_text().strip()
 
@@ -90,15 +97,119 @@ def process_work(work_path):
             break
 
 
+def convert_result(old_result_fn):
+    """
+    return: gzipped json of an old result file, None if it is not valid json
+    """
+    try:
+        result = json.dumps(json.load(old_result_fn.open()))
+    except:
+        return None
+    return gzip_str(result)
+
+
+def load_ledger():
+    if not LEDGER_FN.is_file():
+        return set()
+    return set(LEDGER_FN.read_text().split())
+
+
+def add_to_ledger(work_local_id, imagegroup):
+    LEDGER_FN.parent.mkdir(exist_ok=True, parents=True)
+    with LEDGER_FN.open('a') as f:
+        f.write(f'{work_local_id}-{imagegroup}\n')
+
+
+def migrate_volume(work_path, work_local_id, vol_info, converter, uploader):
+    """
+    pair the old results with the images of the volume image list by sort order,
+    convert them in `converter` processes and upload them with `uploader` threads.
+    Images are not downloaded, only the ocr output and info.json are archived.
+    A volume whose number of old results differs from its number of images can not be
+    paired safely, it is not migrated.
+    """
+    imagegroup = vol_info['imagegroup']
+    result_dir = work_path/f'V{work_local_id[1:]}_{imagegroup}'/'resources'
+    if not result_dir.is_dir():
+        return 0
+    filenames = sorted(imageinfo['filename'] for imageinfo in get_s3_image_list(vol_info['volume_prefix_url']))
+    old_result_fns = sorted(result_dir.iterdir())
+    if len(filenames) != len(old_result_fns):
+        raise ValueError(f'{len(filenames)} images but {len(old_result_fns)} old results, not migrated')
+
+    s3_ocr_paths = get_s3_prefix_path(
+        work_local_id=work_local_id,
+        imagegroup=imagegroup,
+        service=SERVICE,
+        batch_prefix=BATCH_PREFIX,
+        data_types=[OUTPUT]
+    )
+
+    def upload(key, body):
+        S3_client.put_object(Bucket=OCR_OUTPUT_BUCKET, Key=key, Body=body)
+
+    uploads = []
+    outputs = []
+    gzip_results = converter.map(convert_result, old_result_fns, chunksize=16)
+    for filename, old_result_fn, gzip_result in zip(filenames, old_result_fns, gzip_results):
+        if gzip_result is None:
+            continue
+        page = filename.split('.')[0]
+        s3_output_path = f"{s3_ocr_paths[OUTPUT]}/{page}.json.gz"
+        uploads.append(uploader.submit(upload, s3_output_path, gzip_result))
+        outputs.append((page, gzip_result, get_file_timestamp(old_result_fn)))
+    for future in uploads:
+        future.result()
+
+    info_json = get_info_json()
+    upload(f'{s3_ocr_paths[BATCH_PREFIX]}/{INFO_FN}', json.dumps(info_json).encode('UTF-8'))
+    manifest_key = f'{s3_ocr_paths[BATCH_PREFIX]}/{MANIFEST_FN}'
+    manifest = build_manifest(
+        work_local_id,
+        imagegroup,
+        outputs,
+        output_prefix=s3_ocr_paths[OUTPUT],
+        engine='google-vision-legacy',
+        timestamp=info_json['timestamp'],
+        previous=get_s3_json(manifest_key),
+    )
+    upload(manifest_key, json.dumps(manifest).encode('UTF-8'))
+    return len(uploads)
+
+
+def migrate_work(work_path, converter, uploader, ledger):
+    work_local_id = work_path.name
+    for vol_info in get_volume_infos(f'bdr:{work_local_id}'):
+        if f'{work_local_id}-{vol_info["imagegroup"]}' in ledger:
+            continue
+        try:
+            n_pages = migrate_volume(work_path, work_local_id, vol_info, converter, uploader)
+        except Exception as ex:
+            print(f'\t[ERROR] Error occured while migrating Volume {vol_info["imagegroup"]}: {ex}')
+            continue
+        add_to_ledger(work_local_id, vol_info['imagegroup'])
+        print(f'\t[INFO] Volume {vol_info["imagegroup"]}: {n_pages} results archived')
+
+
 if __name__ == "__main__":
-    # parser = argparse.ArgumentParser(description='Process some integers.')
-    # parser.add_argument('--output', '-o', help='path to workids file')
-    # args = parser.parse_args()
-    
-    # output_path = Path(args.output)
-    output_path = Path('usage/bdrc/output')
-
-    for work_path in output_path.iterdir():
-        print(f'[INFO] Work {work_path.name} processing ....')
-        process_work(work_path)
-        print(f'[INFO] Work {work_path.name} completed.')
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Archive old ocr results on s3')
+    parser.add_argument('--output', '-o', default='usage/bdrc/output', help='path to the old results works')
+    parser.add_argument('--download_images', action='store_true', help='download and archive the images too, one volume at a time')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of conversion processes')
+    parser.add_argument('--uploads', type=int, default=32, help='number of concurrent uploads')
+    args = parser.parse_args()
+
+    output_path = Path(args.output)
+
+    if args.download_images:
+        for work_path in output_path.iterdir():
+            print(f'[INFO] Work {work_path.name} processing ....')
+            process_work(work_path)
+            print(f'[INFO] Work {work_path.name} completed.')
+    else:
+        ledger = load_ledger()
+        with ProcessPoolExecutor(max_workers=args.processes) as converter, ThreadPoolExecutor(max_workers=args.uploads) as uploader:
+            for work_path in sorted(output_path.iterdir()):
+                print(f'[INFO] Work {work_path.name} migrating ....')
+                migrate_work(work_path, converter, uploader, ledger)
+                print(f'[INFO] Work {work_path.name} completed.')
\ No newline at end of file
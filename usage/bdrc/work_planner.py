@@ -0,0 +1,349 @@
+import argparse
+import heapq
+import json
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from bdrc_ocr import (
+    ARCHIVE_BUCKET,
+    RATES_FN,
+    S3_client,
+    get_cached_volume_infos,
+    get_s3_image_list,
+    get_s3_prefix_path,
+    get_volume_infos,
+    get_work_ids,
+    get_work_local_id,
+)
+from find_missing_ocr import find_missing_pages
+
+logging.basicConfig(
+    filename=f"{__file__}.log",
+    format="%(asctime)s, %(levelname)s: %(message)s",
+    datefmt="%m/%d/%Y %I:%M:%S %p",
+    level=logging.INFO,
+)
+
+# planner config
+CACHE_FN = Path("./archive/plan_cache.json")
+PAGES_PER_HOUR = 3000  # observed OCR throughput of one host
+POLICIES = ["file", "largest_first", "shortest_first"]
+VISION_USD_PER_1000_PAGES = 1.5  # document text detection, above the free tier
+
+
+def get_volume_cost(work_local_id, vol_info):
+    """
+    number of pages from the image list and bytes from the listing of the volume
+    images in the archive bucket.
+    """
+    image_list = get_s3_image_list(vol_info["volume_prefix_url"])
+    if not image_list:
+        # get_s3_image_list logs and returns nothing on errors, the cost is not cached
+        raise ValueError(f"no image list for {vol_info['volume_prefix_url']}")
+    n_pages = len(image_list)
+    prefix = get_s3_prefix_path(work_local_id, vol_info["imagegroup"])
+    n_bytes = sum(
+        obj["Size"]
+        for page in S3_client.get_paginator("list_objects_v2").paginate(
+            Bucket=ARCHIVE_BUCKET, Prefix=prefix + "/"
+        )
+        for obj in page.get("Contents", [])
+    )
+    return {"imagegroup": vol_info["imagegroup"], "pages": n_pages, "bytes": n_bytes}
+
+
+def get_work_cost(work, executor):
+    work_local_id, work = get_work_local_id(work)
+    vol_infos = list(get_volume_infos(work))
+    if not vol_infos:
+        raise ValueError("no volumes found")
+    volumes = list(
+        executor.map(lambda vol_info: get_volume_cost(work_local_id, vol_info), vol_infos)
+    )
+    return {
+        "work": work_local_id,
+        "volumes": volumes,
+        "pages": sum(vol["pages"] for vol in volumes),
+        "bytes": sum(vol["bytes"] for vol in volumes),
+    }
+
+
+def load_cache(cache_fn):
+    if not cache_fn.is_file():
+        return {}
+    return json.loads(cache_fn.read_text())
+
+
+def save_cache(cache, cache_fn):
+    cache_fn.parent.mkdir(exist_ok=True, parents=True)
+    cache_fn.write_text(json.dumps(cache))
+
+
+def get_work_costs(work_ids, cache_fn=CACHE_FN, workers=32):
+    """
+    return the cost of every work in `work_ids` order. Costs are cached in `cache_fn`
+    so only new works hit BDRC and s3.
+    """
+    cache = load_cache(cache_fn)
+    missing = [work for work in work_ids if get_work_local_id(work)[0] not in cache]
+    with ThreadPoolExecutor(max_workers=workers) as vol_executor, ThreadPoolExecutor(
+        max_workers=max(workers // 4, 1)
+    ) as work_executor:
+        futures = {
+            work: work_executor.submit(get_work_cost, work, vol_executor)
+            for work in missing
+        }
+        for work, future in futures.items():
+            try:
+                cost = future.result()
+            except Exception as ex:
+                logging.error(f"Planner: cost of {work} failed: {ex}")
+                continue
+            cache[cost["work"]] = cost
+    save_cache(cache, cache_fn)
+    return [
+        cache[get_work_local_id(work)[0]]
+        for work in work_ids
+        if get_work_local_id(work)[0] in cache
+    ]
+
+
+def order_works(costs, policy):
+    if policy == "largest_first":
+        return sorted(costs, key=lambda cost: cost["pages"], reverse=True)
+    if policy == "shortest_first":
+        return sorted(costs, key=lambda cost: cost["pages"])
+    return list(costs)
+
+
+def assign_works(costs, n_workers, policy):
+    """
+    spread the works over `n_workers` hosts. Works are taken in policy order and each
+    goes to the least loaded host, with largest_first this is the LPT bin packing.
+    """
+    bins = [[] for _ in range(n_workers)]
+    loads = [(0, i) for i in range(n_workers)]
+    for cost in order_works(costs, policy):
+        load, i = heapq.heappop(loads)
+        bins[i].append(cost)
+        heapq.heappush(loads, (load + cost["pages"], i))
+    return bins
+
+
+def format_eta(pages, pages_per_hour):
+    hours = pages / pages_per_hour
+    return f"{hours / 24:.1f} days" if hours >= 48 else f"{hours:.1f} hours"
+
+
+def write_plan(bins, output_dir, pages_per_hour):
+    """
+    write one work ids file per host, in output_dir/worker_XX/works.txt, usable
+    as --input_path of bdrc_ocr.py.
+    """
+    for i, costs in enumerate(bins):
+        worker_dir = output_dir / f"worker_{i:02}"
+        worker_dir.mkdir(exist_ok=True, parents=True)
+        (worker_dir / "works.txt").write_text(
+            "\n".join(cost["work"] for cost in costs) + "\n"
+        )
+        pages = sum(cost["pages"] for cost in costs)
+        n_bytes = sum(cost["bytes"] for cost in costs)
+        print(
+            f"[INFO] worker_{i:02}: {len(costs)} works, {pages} pages, "
+            f"{n_bytes / 1e9:.1f} GB, ETA {format_eta(pages, pages_per_hour)}"
+        )
+    total = sum(cost["pages"] for costs in bins for cost in costs)
+    makespan = max(sum(cost["pages"] for cost in costs) for costs in bins)
+    print(
+        f"[INFO] Total: {total} pages, fleet ETA {format_eta(makespan, pages_per_hour)}"
+    )
+
+
+def get_todo_pages(costs, workers=32):
+    """
+    return: ({work_local_id: number of pages without ocr output in the ocr bucket},
+    {work_local_id: number of volumes which could not be checked}). The pages of a
+    volume which could not be checked are all counted as todo.
+    """
+    todo = defaultdict(int)
+    unknown = defaultdict(int)
+    vol_pages = {
+        (cost["work"], vol["imagegroup"]): vol["pages"]
+        for cost in costs
+        for vol in cost["volumes"]
+    }
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(get_cached_volume_infos, f"bdr:{cost['work']}"): cost
+            for cost in costs
+        }
+        vol_futures = {}
+        for future, cost in futures.items():
+            work_local_id = cost["work"]
+            try:
+                vol_infos = future.result()
+                if not vol_infos:
+                    # get_volume_infos logs and yields nothing on errors
+                    raise ValueError("no volumes found")
+            except Exception as ex:
+                logging.error(f"Planner: volumes of {work_local_id} failed: {ex}")
+                todo[work_local_id] = cost["pages"]
+                unknown[work_local_id] = len(cost["volumes"])
+                continue
+            todo[work_local_id] = 0
+            for vol_info in vol_infos:
+                vol_future = executor.submit(find_missing_pages, work_local_id, vol_info)
+                vol_futures[vol_future] = (work_local_id, vol_info["imagegroup"])
+        for future, (work_local_id, imagegroup) in vol_futures.items():
+            try:
+                todo[work_local_id] += len(future.result())
+            except Exception as ex:
+                logging.error(
+                    f"Planner: missing pages of {work_local_id}-{imagegroup} failed: {ex}"
+                )
+                todo[work_local_id] += vol_pages.get((work_local_id, imagegroup), 0)
+                unknown[work_local_id] += 1
+    return todo, unknown
+
+
+def load_rates(rates_fn=RATES_FN):
+    """
+    return: seconds per page of each stage, over the volumes recorded by bdrc_ocr.py,
+    one rate for the file stages (download, ocr, archive) and one for --stream
+    """
+    if not rates_fn.is_file():
+        return {}
+    times, pages = defaultdict(float), defaultdict(float)
+    for line in rates_fn.read_text().splitlines():
+        if not line:
+            continue
+        rates = json.loads(line)
+        mode = "stream" if "stream" in rates["times"] else "files"
+        pages[mode] += rates["pages"]
+        for stage, stage_time in rates["times"].items():
+            times[stage] += stage_time
+    return {
+        stage: stage_time / pages["stream" if stage == "stream" else "files"]
+        for stage, stage_time in times.items()
+    }
+
+
+def get_seconds_per_page(rates, stream, pages_per_hour):
+    if stream and "stream" in rates:
+        return rates["stream"]
+    file_stages = [
+        rates[stage] for stage in ["download", "ocr", "archive"] if stage in rates
+    ]
+    if not stream and file_stages:
+        return sum(file_stages)
+    return 3600 / pages_per_hour
+
+
+def write_report(costs, todo, unknown, n_workers, seconds_per_page, output_fn):
+    """
+    print the pages, bytes, vision cost and ETA of every work, pages which already
+    have an ocr output are not counted. The volumes which could not be checked are
+    reported apart, all their pages are counted.
+    """
+    report = []
+    for cost in costs:
+        pages = todo.get(cost["work"], cost["pages"])
+        n_bytes = cost["bytes"] * pages / max(cost["pages"], 1)
+        report.append(
+            {
+                "work": cost["work"],
+                "pages": cost["pages"],
+                "todo_pages": pages,
+                "todo_bytes": int(n_bytes),
+                "unknown_volumes": unknown.get(cost["work"], 0),
+                "usd": pages / 1000 * VISION_USD_PER_1000_PAGES,
+                "hours": pages * seconds_per_page / 3600,
+            }
+        )
+        print(
+            f"[PLAN] {cost['work']}: {pages} of {cost['pages']} pages, "
+            f"{n_bytes / 1e9:.2f} GB, ${report[-1]['usd']:.2f}, "
+            f"ETA {format_eta(pages, 3600 / seconds_per_page)}"
+            + (
+                f", {report[-1]['unknown_volumes']} volumes unknown"
+                if report[-1]["unknown_volumes"]
+                else ""
+            )
+        )
+
+    pages = sum(work["todo_pages"] for work in report)
+    n_bytes = sum(work["todo_bytes"] for work in report)
+    usd = sum(work["usd"] for work in report)
+    bins = assign_works(
+        [{**cost, "pages": work["todo_pages"]} for cost, work in zip(costs, report)],
+        n_workers,
+        "largest_first",
+    )
+    makespan = max(sum(cost["pages"] for cost in host_costs) for host_costs in bins)
+    print(
+        f"[PLAN] Total: {len(report)} works, {pages} pages to OCR, "
+        f"{n_bytes / 1e9:.1f} GB, "
+        f"{pages} vision calls, ${usd:.2f}, {seconds_per_page:.2f}s/page per host, "
+        f"ETA {format_eta(makespan, 3600 / seconds_per_page)} on {n_workers} hosts"
+    )
+    n_unknown = sum(work["unknown_volumes"] for work in report)
+    if n_unknown:
+        print(
+            f"[ERROR] {n_unknown} volumes could not be checked, all their pages are "
+            "counted as todo, see the log"
+        )
+    output_fn.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Plan OCR of work lists over many hosts")
+    ap.add_argument(
+        "--input_path",
+        default="./usage/bdrc/input",
+        help="path with work ids text files",
+    )
+    ap.add_argument("--output_dir", "-o", default="./plan", help="plan output dir")
+    ap.add_argument("--n_workers", "-n", type=int, default=1, help="number of hosts")
+    ap.add_argument(
+        "--policy", choices=POLICIES, default="largest_first", help="work order"
+    )
+    ap.add_argument(
+        "--pages_per_hour",
+        type=float,
+        default=PAGES_PER_HOUR,
+        help="OCR throughput of one host, used for the ETA",
+    )
+    ap.add_argument(
+        "--plan",
+        action="store_true",
+        help="dry run: report pages, bytes, cost and ETA, pages already OCRed excluded",
+    )
+    ap.add_argument(
+        "--stream", action="store_true", help="with --plan, ETA at the --stream rate"
+    )
+    args = ap.parse_args()
+
+    work_ids = []
+    for workids_path in sorted(Path(args.input_path).iterdir()):
+        work_ids.extend(get_work_ids(workids_path))
+
+    costs = get_work_costs(work_ids)
+    if args.plan:
+        seconds_per_page = get_seconds_per_page(
+            load_rates(), args.stream, args.pages_per_hour
+        )
+        Path(args.output_dir).mkdir(exist_ok=True, parents=True)
+        todo, unknown = get_todo_pages(costs)
+        write_report(
+            costs,
+            todo,
+            unknown,
+            args.n_workers,
+            seconds_per_page,
+            Path(args.output_dir) / "plan_report.json",
+        )
+    else:
+        bins = assign_works(costs, args.n_workers, args.policy)
+        write_plan(bins, Path(args.output_dir), args.pages_per_hour)